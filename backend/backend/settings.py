@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 from pathlib import Path
 import pymysql
 import os
+import sys
 
 from dotenv import load_dotenv
 
@@ -20,6 +21,10 @@ pymysql.install_as_MySQLdb()
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Modules shared with the Lambda (checkin_keys) are deployed from lambda/ and
+# imported from there, so both sides use the same file
+sys.path.append(str(BASE_DIR / 'lambda'))
+
 load_dotenv(os.path.join(BASE_DIR, 'backend', '.env'))
 
 # Quick-start development settings - unsuitable for production
@@ -87,17 +92,59 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# DB_ENGINE=django.db.backends.sqlite3 runs against the SQLite file DB_NAME,
+# e.g. for local benchmarks
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': os.getenv('DB_ENGINE', 'django.db.backends.mysql'),
         'NAME': os.getenv('DB_NAME'),
         'USER': os.getenv('DB_USER'),
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
         'PORT': os.getenv('DB_PORT'),
+        # seconds to keep a connection open between requests, checked before each
+        # reuse. Set DB_CONN_MAX_AGE (e.g. 60) under a WSGI server, where each
+        # worker thread reuses its connection; leave it at 0 under ASGI, where
+        # async views run their queries on short-lived threads whose persistent
+        # connections would pile up instead of being reused.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 0)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Read replicas for the read-only endpoints, as comma-separated MySQL hosts, or
+# SQLite files with DB_ENGINE=sqlite3 (e.g. a copy of DB_NAME to try it
+# locally). A replica more than DB_REPLICA_MAX_LAG seconds behind, checked every
+# DB_REPLICA_CHECK_INTERVAL seconds, is skipped in favour of the primary. The
+# lag check needs the REPLICATION CLIENT privilege on MySQL.
+DB_REPLICA_ALIASES = []
+for _index, _replica in enumerate(filter(None, map(str.strip, os.getenv('DB_REPLICAS', '').split(',')))):
+    DATABASES[f'replica_{_index}'] = {
+        **DATABASES['default'],
+        **({'NAME': _replica} if DATABASES['default']['ENGINE'].endswith('sqlite3') else {'HOST': _replica}),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DB_REPLICA_ALIASES.append(f'replica_{_index}')
+DATABASE_ROUTERS = ['people.replicas.ReplicaRouter']
+DB_REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', 5))
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_CHECK_INTERVAL', 10))
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Local memory by default; set CACHE_BACKEND (e.g. FileBasedCache or RedisCache)
+# and CACHE_LOCATION to share cached responses between workers
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'attendance-capturer'),
+    }
+}
+
+# Seconds a cached read response may be kept; entries are revalidated on every request
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 300))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -140,6 +187,90 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Face matching backend: "rekognition" (default) or "embedding", which stores a
+# local face embedding for each profile image on create/update
+FACE_MATCHER_BACKEND = os.getenv('FACE_MATCHER_BACKEND', 'rekognition')
+
+# Identification (check-in without a profileID): with the rekognition backend,
+# profile images are also indexed into a face collection per admin named
+# FACE_COLLECTION_PREFIX + admin ID, which must match the Lambda's setting
+FACE_IDENTIFICATION = os.getenv('FACE_IDENTIFICATION', 'False').lower() in ('true', '1')
+FACE_COLLECTION_PREFIX = os.getenv('FACE_COLLECTION_PREFIX', 'attendance-')
+
+# Region of the face collections and profile pictures; collections are
+# regional, so this must be the region the Lambda searches them in
+FACE_MATCHING_REGION = os.getenv('FACE_MATCHING_REGION', 'ca-central-1')
+
+# Largest accepted attendance picture, in decoded bytes
+ATTENDANCE_PICTURE_MAX_BYTES = int(os.getenv('ATTENDANCE_PICTURE_MAX_BYTES', 5 * 1024 * 1024))
+
+# Attendance pictures are EXIF-oriented, downsized to this longest side (0
+# disables normalization) and re-encoded as JPEG before upload; optionally
+# cropped to the detected face (needs face_recognition). The unmodified upload
+# is only kept, under <user>/originals/, when auditing requires it.
+ATTENDANCE_PICTURE_MAX_DIMENSION = int(os.getenv('ATTENDANCE_PICTURE_MAX_DIMENSION', 1024))
+ATTENDANCE_PICTURE_QUALITY = int(os.getenv('ATTENDANCE_PICTURE_QUALITY', 85))
+ATTENDANCE_PICTURE_FACE_CROP = os.getenv('ATTENDANCE_PICTURE_FACE_CROP', 'False').lower() in ('true', '1')
+ATTENDANCE_PICTURE_KEEP_ORIGINAL = os.getenv('ATTENDANCE_PICTURE_KEEP_ORIGINAL', 'False').lower() in ('true', '1')
+
+# Group pictures are downsized to this longer side instead, so the faces of a
+# whole room stay large enough to match (0 disables normalization)
+GROUP_PICTURE_MAX_DIMENSION = int(os.getenv('GROUP_PICTURE_MAX_DIMENSION', 2048))
+
+# Lifetime in seconds of presigned attendance picture upload URLs
+ATTENDANCE_UPLOAD_URL_EXPIRES = int(os.getenv('ATTENDANCE_UPLOAD_URL_EXPIRES', 120))
+
+# Verify check-ins in the background and return a ticket instead of waiting
+# for the Lambda; clients can also opt in per request with "async": true
+CHECKIN_ASYNC = os.getenv('CHECKIN_ASYNC', 'False').lower() in ('true', '1')
+
+# Threads the async (ASGI) views use for blocking AWS and image calls; bounds
+# how many such calls are in flight per process, not how many requests are
+ASYNC_BLOCKING_WORKERS = int(os.getenv('ASYNC_BLOCKING_WORKERS', 256))
+
+# One accepted check-in per profile per window (0 disables); must match the
+# Lambda's CHECKIN_DEDUP_WINDOW_SECONDS
+CHECKIN_DEDUP_WINDOW_SECONDS = int(os.getenv('CHECKIN_DEDUP_WINDOW_SECONDS', 300))
+
+# Write-behind attendance inserts: the Lambda only verifies single check-ins and
+# this process records them, ATTENDANCE_WRITE_BATCH_SIZE rows per multi-row
+# INSERT and at least every ATTENDANCE_WRITE_INTERVAL seconds. Accepted rows
+# are spooled to disk under ATTENDANCE_SPOOL_DIR until written.
+ATTENDANCE_WRITE_BEHIND = os.getenv('ATTENDANCE_WRITE_BEHIND', 'False').lower() in ('true', '1')
+ATTENDANCE_WRITE_BATCH_SIZE = int(os.getenv('ATTENDANCE_WRITE_BATCH_SIZE', 200))
+ATTENDANCE_WRITE_INTERVAL = float(os.getenv('ATTENDANCE_WRITE_INTERVAL', 1.0))
+ATTENDANCE_SPOOL_DIR = os.getenv('ATTENDANCE_SPOOL_DIR', os.path.join(BASE_DIR, 'attendance_spool'))
+
+# Batch check-ins: largest accepted batch, concurrent S3 uploads and Lambda
+# invocations, and pictures verified per Lambda invocation
+BATCH_CHECKIN_MAX_ITEMS = int(os.getenv('BATCH_CHECKIN_MAX_ITEMS', 500))
+BATCH_UPLOAD_WORKERS = int(os.getenv('BATCH_UPLOAD_WORKERS', 8))
+BATCH_LAMBDA_SIZE = int(os.getenv('BATCH_LAMBDA_SIZE', 25))
+
+# Profiles written per bulk query when importing a roster
+PROFILE_IMPORT_BATCH_SIZE = int(os.getenv('PROFILE_IMPORT_BATCH_SIZE', 500))
+
+# Default and largest page size of the paginated attendance list
+ATTENDANCE_PAGE_SIZE = int(os.getenv('ATTENDANCE_PAGE_SIZE', 100))
+ATTENDANCE_PAGE_MAX_SIZE = int(os.getenv('ATTENDANCE_PAGE_MAX_SIZE', 1000))
+
+# Per-request stage timing lines (people.metrics) go to stdout; set
+# STAGE_TIMINGS_LOG_LEVEL=WARNING to keep only the /metrics histograms
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'stdout': {'class': 'logging.StreamHandler', 'stream': 'ext://sys.stdout'},
+    },
+    'loggers': {
+        'people.metrics': {
+            'handlers': ['stdout'],
+            'level': os.getenv('STAGE_TIMINGS_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 CORS_ORIGIN_WHITELIST = [
     'http://localhost:3000',
     'https://attendance-capturer.onrender.com'
@@ -17,7 +17,7 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import include, path
 from rest_framework import routers
-from people import views
+from people import async_views, views
 from django.http import HttpResponse
 
 router = routers.DefaultRouter()
@@ -31,12 +31,37 @@ def home(request):
 urlpatterns = [
     path('', home),
     path('admin/', admin.site.urls),
+    path('metrics', views.metrics, name='metrics'),
     path('api/', include(router.urls)),
     path('api/attendance/<admin_id>/', views.get_attendance_by_admin, name="get_attendance"),
+    path('api/analytics/<admin_id>/', views.get_attendance_analytics, name='get_attendance_analytics'),
+    path('api/dashboard/<admin_id>/trend/', views.get_attendance_trend, name='get_attendance_trend'),
+    path('api/dashboard/<admin_id>/heatmap/', views.get_attendance_heatmap, name='get_attendance_heatmap'),
+    path('api/dashboard/<admin_id>/attendance_rate/', views.get_attendance_rate_distribution,
+         name='get_attendance_rate_distribution'),
     path('api/upload_attendance_picture/',
          views.upload_attendance_picture, name='upload_attendance_picture'),
+    path('api/upload_attendance_pictures/',
+         views.upload_attendance_pictures, name='upload_attendance_pictures'),
+    path('api/identify_attendance_picture/', views.identify_attendance_picture,
+         name='identify_attendance_picture'),
+    path('api/group_attendance_picture/', views.upload_group_attendance_picture,
+         name='upload_group_attendance_picture'),
+    path('api/attendance_upload_url/', views.get_attendance_upload_url, name='get_attendance_upload_url'),
+    path('api/verify_attendance_picture/', views.verify_uploaded_attendance_picture,
+         name='verify_uploaded_attendance_picture'),
+    path('api/checkin_status/<uuid:ticket_id>/',
+         views.get_checkin_status, name='get_checkin_status'),
     path('api/create_profile/', views.create_profile, name='create_profile'),
     path('api/profiles/<profile_id>/', views.get_profiles, name='get_profiles'),
     path('api/update_profile/', views.update_profile, name='update_profile'),
+    path('api/import_profiles/', views.import_profiles, name='import_profiles'),
+    path('api/export/<admin_id>/', views.export_admin_data, name='export_admin_data'),
     path('api/profiles_by_admin/<admin_id>/', views.get_profile_by_admin, name='get_profile_by_admin'),
+    # async versions of the check-in and read endpoints, served under ASGI
+    path('api/async/upload_attendance_picture/', async_views.upload_attendance_picture,
+         name='async_upload_attendance_picture'),
+    path('api/async/attendance/<admin_id>/', async_views.get_attendance_by_admin, name='async_get_attendance'),
+    path('api/async/profiles_by_admin/<admin_id>/', async_views.get_profile_by_admin,
+         name='async_get_profile_by_admin'),
 ]
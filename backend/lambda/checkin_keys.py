@@ -0,0 +1,202 @@
+import re
+import uuid
+import datetime
+import urllib.parse
+from typing import NamedTuple, Optional
+
+# S3 key format of attendance pictures, shared by the Django backend (which
+# builds keys) and the Lambda (which parses them). Deploy this file next to
+# lambda_function.py. Only the standard library is used, so both sides can load it.
+#
+#   v2: <admin_id>/attendance_v2_<YYYYMMDDTHHMMSSffffffZ>_<uuid hex>_<profile_id>.jpg
+#   v1: <admin_id>/attendance_<profile_id>_<YYYY-MM-DD>_<HH-MM-SS>.jpg (legacy, read only)
+#   identification, where the Lambda finds the profile: <admin_id>/identify_v2_<timestamp>_<uuid hex>.jpg
+#   group, where the Lambda finds every profile in the picture: <admin_id>/group_v2_<timestamp>_<uuid hex>.jpg
+#
+# The profile ID comes last and is percent-encoded, so it may contain any
+# character including '_'. The microsecond timestamp and the uuid keep keys
+# from colliding when a profile checks in twice within a second.
+
+KEY_VERSION = 2
+TIMESTAMP_FORMAT = "%Y%m%dT%H%M%S%fZ"
+LEGACY_TIMESTAMP_FORMAT = "%Y-%m-%d_%H-%M-%S"
+# characters left as-is in the encoded profile ID; all are safe in a URL path
+PROFILE_ID_SAFE = "@-._~"
+# length of the attendance object_key column
+MAX_KEY_LENGTH = 255
+# length of the profile_id column; a group picture records one row per
+# profile, keyed <picture key>#<profile_id>
+MAX_PROFILE_ID_LENGTH = 100
+
+_V2_FILE_NAME = re.compile(r"attendance_v2_(\d{8}T\d{12}Z)_([0-9a-f]{32})_([A-Za-z0-9%@._~-]+)\.jpg")
+_IDENTIFY_FILE_NAME = re.compile(r"(identify|group)_v2_(\d{8}T\d{12}Z)_([0-9a-f]{32})\.jpg")
+_V1_FILE_NAME = re.compile(r"attendance_([^_]+)_(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})\.jpg")
+
+
+class CheckinKeyError(ValueError):
+    """Raised for an object key or field that is not a valid attendance picture key."""
+
+
+class CheckinKey(NamedTuple):
+    admin_id: str
+    # None for identification pictures
+    profile_id: Optional[str]
+    # aware UTC datetime the picture was taken
+    taken_at: datetime.datetime
+    # uuid hex; None for legacy keys
+    checkin_id: Optional[str]
+    version: int
+    # group pictures are checked in for every recognized face
+    group: bool = False
+
+    @property
+    def key(self):
+        """
+        :return: The S3 object key.
+        """
+        if self.profile_id is None:
+            kind = "group" if self.group else "identify"
+            return f"{self.admin_id}/{kind}_v2_{self.taken_at.strftime(TIMESTAMP_FORMAT)}_{self.checkin_id}.jpg"
+        if self.version == 1:
+            return (f"{self.admin_id}/attendance_{self.profile_id}_"
+                    f"{self.taken_at.strftime(LEGACY_TIMESTAMP_FORMAT)}.jpg")
+        return (f"{self.admin_id}/attendance_v2_{self.taken_at.strftime(TIMESTAMP_FORMAT)}_"
+                f"{self.checkin_id}_{urllib.parse.quote(self.profile_id, safe=PROFILE_ID_SAFE)}.jpg")
+
+    @property
+    def metadata(self):
+        """
+        :return: S3 user metadata (x-amz-meta-*) describing the check-in. Values are ASCII as S3 requires.
+        """
+        return {
+            "checkin-version": str(self.version),
+            "admin-id": self.admin_id,
+            "profile-id": urllib.parse.quote(self.profile_id or "", safe=PROFILE_ID_SAFE),
+            "taken-at": self.taken_at.isoformat(),
+            "checkin-id": self.checkin_id or "",
+        }
+
+    @property
+    def timestamp(self):
+        """
+        :return: taken_at as a naive UTC datetime, as stored in the attendance table.
+        """
+        return self.taken_at.replace(tzinfo=None)
+
+
+def new_checkin_key(admin_id, profile_id, taken_at=None):
+    """
+    Build the key of a new attendance picture.
+
+    :param admin_id: Admin (Cognito user) whose folder the picture goes in.
+    :param profile_id: Profile checking in.
+    :param taken_at: When the picture was taken (default now); naive datetimes are taken as UTC.
+    :return: CheckinKey
+    :raises CheckinKeyError: If the admin or profile ID cannot be used in a key.
+    """
+    if not profile_id:
+        raise CheckinKeyError("Missing profile ID")
+    checkin_key = _new_key(admin_id, profile_id, taken_at)
+    if len(checkin_key.key) > MAX_KEY_LENGTH:
+        raise CheckinKeyError(f"Profile ID {profile_id!r} is too long for an attendance picture key")
+    return checkin_key
+
+
+def new_identification_key(admin_id, taken_at=None):
+    """
+    Build the key of a new attendance picture whose profile the Lambda identifies from the face.
+
+    :return: CheckinKey with profile_id None
+    :raises CheckinKeyError: If the admin ID cannot be used in a key.
+    """
+    return _new_key(admin_id, None, taken_at)
+
+
+def new_group_key(admin_id, taken_at=None):
+    """
+    Build the key of a new group attendance picture, in which the Lambda checks in every recognized face.
+
+    :return: CheckinKey with profile_id None and group True
+    :raises CheckinKeyError: If the admin ID cannot be used in a key.
+    """
+    checkin_key = _new_key(admin_id, None, taken_at)._replace(group=True)
+    if len(group_object_key(checkin_key.key, "x" * MAX_PROFILE_ID_LENGTH)) > MAX_KEY_LENGTH:
+        raise CheckinKeyError(f"Admin ID {admin_id!r} is too long for a group picture key")
+    return checkin_key
+
+
+def group_object_key(key, profile_id):
+    """
+    :return: The object_key recorded for one profile checked in by a group picture.
+    """
+    return f"{key}#{profile_id}"
+
+
+def _new_key(admin_id, profile_id, taken_at):
+    if not admin_id or "/" in admin_id:
+        raise CheckinKeyError(f"Invalid admin ID {admin_id!r}")
+    if taken_at is None:
+        taken_at = datetime.datetime.now(datetime.timezone.utc)
+    elif taken_at.tzinfo is None:
+        taken_at = taken_at.replace(tzinfo=datetime.timezone.utc)
+    return CheckinKey(admin_id, profile_id, taken_at.astimezone(datetime.timezone.utc),
+                      uuid.uuid4().hex, KEY_VERSION)
+
+
+def parse_checkin_key(key):
+    """
+    Parse and validate an attendance picture key of any version or kind.
+
+    :param key: S3 object key (not URL-encoded).
+    :return: CheckinKey
+    :raises CheckinKeyError: If the key is not a well-formed attendance picture key.
+    """
+    admin_id, _, file_name = key.rpartition("/")
+    if not admin_id or "/" in admin_id:
+        raise CheckinKeyError(f"Attendance picture key {key!r} is not directly under an admin folder")
+
+    identify_match = _IDENTIFY_FILE_NAME.fullmatch(file_name)
+    v2_match = _V2_FILE_NAME.fullmatch(file_name)
+    group = False
+    if identify_match:
+        kind, taken, checkin_id = identify_match.groups()
+        profile_id = None
+        group = kind == "group"
+        version = 2
+        timestamp_format = TIMESTAMP_FORMAT
+    elif v2_match:
+        taken, checkin_id, encoded_profile_id = v2_match.groups()
+        profile_id = urllib.parse.unquote(encoded_profile_id)
+        # only the canonical encoding is accepted, so each check-in has one key
+        if urllib.parse.quote(profile_id, safe=PROFILE_ID_SAFE) != encoded_profile_id:
+            raise CheckinKeyError(f"Attendance picture key {key!r} has a badly encoded profile ID")
+        version = 2
+        timestamp_format = TIMESTAMP_FORMAT
+    else:
+        match = _V1_FILE_NAME.fullmatch(file_name)
+        if not match:
+            raise CheckinKeyError(f"Unexpected attendance picture name {file_name!r}")
+        profile_id, taken = match.groups()
+        checkin_id = None
+        version = 1
+        timestamp_format = LEGACY_TIMESTAMP_FORMAT
+
+    try:
+        taken_at = datetime.datetime.strptime(taken, timestamp_format).replace(tzinfo=datetime.timezone.utc)
+    except ValueError:
+        raise CheckinKeyError(f"Attendance picture key {key!r} has an invalid timestamp")
+    return CheckinKey(admin_id, profile_id, taken_at, checkin_id, version, group)
+
+
+def object_url(bucket, key, region="ca-central-1"):
+    """
+    :return: HTTPS URL of an S3 object, with the key escaped so key_from_url gives it back unchanged.
+    """
+    return f"https://{bucket}.s3.{region}.amazonaws.com/{urllib.parse.quote(key, safe='/:@-._~')}"
+
+
+def key_from_url(url):
+    """
+    :return: The S3 object key of a URL built by object_url.
+    """
+    return urllib.parse.unquote(url.split(".com/", 1)[-1])
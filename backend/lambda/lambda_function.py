@@ -1,101 +1,462 @@
 import boto3
 import pymysql
 import os
+import io
+import json
+import uuid
+import time
 import datetime
+import calendar
+import threading
+import urllib.parse
+from contextlib import contextmanager
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
+from checkin_keys import group_object_key, key_from_url, object_url, parse_checkin_key
+
+# Clients and the database connection live at module level so that warm
+# invocations of the same Lambda container can reuse them instead of paying
+# for a new MySQL handshake and boto3 client on every photo.
+_db_connection = None
+_rekognition_client = None
+_s3_client = None
+pool_stats = {
+    "db_hits": 0,
+    "db_misses": 0,
+    "rekognition_hits": 0,
+    "rekognition_misses": 0,
+    "s3_hits": 0,
+    "s3_misses": 0,
+    "profile_face_hits": 0,
+    "profile_face_misses": 0,
+}
+# Batch worker threads update pool_stats concurrently
+_pool_stats_lock = threading.Lock()
+
+# Face matching backend: "rekognition" (default) or "embedding" for the local
+# embedding matcher. Profiles without a stored embedding fall back to Rekognition.
+FACE_MATCHER_BACKEND = os.environ.get("FACE_MATCHER_BACKEND", "rekognition")
+FACE_EMBEDDING_THRESHOLD = float(os.environ.get("FACE_EMBEDDING_THRESHOLD", "0.92"))
+
+# Profile face analysis keyed by (profile_id, image_version). Backed by the
+# face_analysis column so that cold containers also skip detect_faces.
+_profile_face_cache = {}
+PROFILE_FACE_CACHE_SIZE = 1024
+
+# Concurrent face comparisons per batch invocation. The shared pymysql
+# connection is not thread-safe, so worker threads take _db_lock to use it.
+BATCH_MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", "8"))
+_db_lock = threading.Lock()
+
+# One accepted check-in per profile per window; must match the Django setting
+CHECKIN_DEDUP_WINDOW_SECONDS = int(os.environ.get("CHECKIN_DEDUP_WINDOW_SECONDS", "300"))
+
+# Identification (pictures keyed without a profile): the rekognition backend
+# searches the admin's face collection, FACE_COLLECTION_PREFIX + admin ID, which
+# the backend keeps up to date; the embedding backend searches a gallery of the
+# admin's profile embeddings held in the warm container. A gallery is synced
+# incrementally from people_profile.updated_at on every search and rebuilt
+# every GALLERY_REFRESH_SECONDS, which also drops deleted profiles.
+FACE_COLLECTION_PREFIX = os.environ.get("FACE_COLLECTION_PREFIX", "attendance-")
+FACE_SEARCH_THRESHOLD = float(os.environ.get("FACE_SEARCH_THRESHOLD", "90"))
+GALLERY_REFRESH_SECONDS = int(os.environ.get("GALLERY_REFRESH_SECONDS", "300"))
+_galleries = {}
+
+# Group pictures: candidate profiles searched per face, so a face whose best
+# match is taken by a closer face can still get its second choice, and the
+# margin kept around each face cropped out for the collection search
+GROUP_SEARCH_CANDIDATES = int(os.environ.get("GROUP_SEARCH_CANDIDATES", "5"))
+GROUP_FACE_CROP_MARGIN = 0.5
+
+# Milliseconds spent in each stage of the current invocation. A container runs
+# one invocation at a time; batch worker threads add their stages up.
+_stage_timings = {}
+_timings_lock = threading.Lock()
 
 
 def lambda_handler(event, context):
+    reset_stage_timings()
+    started = time.perf_counter()
+    # S3 object-created notifications, directly or through an SQS queue
+    if "Records" in event:
+        result = verify_event_records(event["Records"])
+    # Batches from kiosks and offline-sync devices carry a list of paths
+    elif "paths" in event:
+        result = verify_attendance_batch(event["paths"])
+    else:
+        # With "defer", the caller buffers the attendance row and writes it in bulk
+        result = verify_attendance(event.get("path"), defer_insert=event.get("defer", False))
+
+        # Asynchronous check-ins carry a ticket whose row holds the outcome
+        ticket = event.get("ticket")
+        if ticket:
+            with stage_timer("ticket_update"):
+                record_checkin_result(ticket, result)
+
+    # The caller aggregates these into end-to-end latency percentiles
+    result["timings"] = get_stage_timings()
+    log_stage_timings(result, (time.perf_counter() - started) * 1000,
+                      len(event.get("Records") or event.get("paths") or [None]))
+
+    # S3 retries an asynchronous invocation only when it raises; the check-in
+    # is idempotent on its object key, so re-running the whole event is safe
+    if result.pop("retry", False):
+        raise RuntimeError(f"Event needs a retry: {result['body']}")
+    return result
+
+# Time a stage of the current invocation
+
+
+@contextmanager
+def stage_timer(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        with _timings_lock:
+            _stage_timings[stage] = _stage_timings.get(stage, 0.0) + elapsed
+
+
+def reset_stage_timings():
+    with _timings_lock:
+        _stage_timings.clear()
+
+
+def get_stage_timings():
+    with _timings_lock:
+        return {stage: round(ms, 2) for stage, ms in _stage_timings.items()}
+
+# Write the invocation's stage timings as one structured JSON log line
+
+
+def log_stage_timings(result, total_ms, pictures):
+    print(json.dumps({
+        "event": "stage_timings",
+        "operation": "verify_attendance",
+        "status": result.get("status"),
+        "pictures": pictures,
+        "total_ms": round(total_ms, 2),
+        "stages_ms": result["timings"],
+    }))
+
+# Verify one attendance picture against its profile picture and record
+# attendance, or with defer_insert return the row for the caller to record
+
+
+def verify_attendance(path, defer_insert=False):
+    # Reject a malformed key before any database or Rekognition work
+    try:
+        item = parse_attendance_path(path)
+    except (AttributeError, ValueError) as e:
+        return malformed_path_response(e)
+    if item["group"]:
+        return identify_group_attendance(path, item)
+    if item["profile_id"] is None:
+        return identify_attendance(path, item)
+
     try:
-        path = event.get("path")
         print(f"[DEBUG] Processing attendance image: {path}")
 
         # Get attendance picture bucket name and key
         attend_bucket = os.environ["BUCKET1_NAME"]
-        attend_key = path.split(".com/")[-1]
 
         # Get default profile picture bucket name
         pfp_name = os.environ["BUCKET2_NAME"]
 
-        # Get S3 object url from RDS for default profile picture and extract key
-        file_name = attend_key.split("/")[-1]
-        file_name_stripped = file_name.split(".")[0]
-        components = file_name_stripped.split("_")
-        admin_id = attend_key.split("/")[0]
-        rds_key = components[1]
-        pfp_path = get_path_from_db(admin_id, rds_key)
+        # Get S3 object url from RDS for default profile picture
+        rds_key = item["profile_id"]
+        with stage_timer("db_connect"):
+            connection = get_db_connection()
+        with stage_timer("db_lookup"):
+            # A redelivered event for a picture that was already recorded
+            if get_recorded_keys([item["attend_key"]], connection):
+                return already_recorded_response()
+            profile = get_profile_from_db(item["admin_id"], rds_key, connection)
+        pfp_path = profile["profile_image"] if profile else None
         print(f"[INFO] Profile picture S3 path retrieved: {pfp_path}")
 
         if not pfp_path:
-            return {
-                "statusCode": 404,
-                "status": "failure",
-                "body": f"Profile picture with ID {rds_key} not found"
-            }
-
-        pfp_key = pfp_path.split(".com/")[-1]
+            return profile_not_found_response(rds_key)
 
-        # Use rekognition to do facial comparison
         print(f"[DEBUG] Comparing faces between attendance and profile images")
-        comparison_response, error = handle_rekognition(
-            attend_bucket, attend_key, pfp_name, pfp_key)
+        matched, error = compare_with_profile(
+            attend_bucket, item["attend_key"], pfp_name, rds_key, profile, connection)
 
         if error:
-            print(f"[ERROR] Rekognition error: {str(error)}")
-            error_code = error.response['Error']['Code']
-            if error_code == 'InvalidS3ObjectException':
-                return {
-                    "statusCode": 404,
-                    "status": "failure",
-                    "body": f"One or both of the S3 objects could not be found: {error.response['Error']['Message']}"
-                }
-            elif error_code == 'InvalidParameterException':
-                return {
-                    "statusCode": 400,
-                    "status": "failure",
-                    "body": "No face detected in one or both images"
-                }
-            elif error_code == 'AccessDeniedException':
-                return {
-                    "statusCode": 403,
-                    "status": "failure",
-                    "body": "Access denied. Check your S3 bucket permissions."
-                }
-            else:
-                return {
-                    "statusCode": 500,
-                    "status": "failure",
-                    "body": f"A Rekognition error occurred: {error.response['Error']['Message']}"
-                }
+            return rekognition_error_response(error)
 
         # Case 1: Face detected and facial comparison passed
-        if len(comparison_response['FaceMatches']) == 1:
-            timestamp_str = components[2] + '_' + components[3]
-            timestamp = datetime.datetime.strptime(
-                timestamp_str, "%Y-%m-%d_%H-%M-%S")
-            insertion_err = insert_data_into_db(rds_key, path, timestamp)
+        if matched and defer_insert:
+            print("[INFO] Face match successful, attendance handed to the caller")
+            return match_accepted_response(rds_key, path, item)
+        if matched:
+            with stage_timer("db_insert"):
+                inserted, insertion_err = insert_many_into_db(
+                    [(rds_key, path, item["timestamp"], item["attend_key"])], connection)
             if insertion_err:
                 print(f"[ERROR] Database insertion error: {insertion_err}")
-                return {
-                    "statusCode": 400,
-                    "status": "failure",
-                    "body": f"Error inserting data: {insertion_err}"
-                }
+                return insertion_error_response(insertion_err)
+            if not inserted:
+                # Either a concurrent delivery of this same picture won the
+                # insert, or the profile already checked in this window
+                if get_recorded_keys([item["attend_key"]], connection):
+                    return already_recorded_response()
+                print("[INFO] Face match successful, but already checked in")
+                return duplicate_checkin_response(rds_key)
             print("[INFO] Face match successful, attendance recorded")
-            return {
-                "statusCode": 200,
-                "status": "success",
-                "body": "Face match successful, attendance recorded"
-            }
+            return match_success_response()
         # Case 2: Failed facial comparison
         else:
             print("[INFO] Face match failed")
-            return {
-                "statusCode": 200,
-                "status": "failure",
-                "body": "Face match failed"
+            return match_failed_response()
+
+    except Exception as e:
+        print(f"[ERROR] Unexpected error: {str(e)}")
+        return {
+            "statusCode": 500,
+            "status": "failure",
+            "body": f"An error occurred: {str(e)}"
+        }
+
+    finally:
+        print(f"[METRIC] Pool stats: {get_pool_stats()}")
+
+# Verify a batch of attendance pictures: one profile query, parallel face
+# comparisons and a single multi-row insert for every match
+
+
+def verify_attendance_batch(paths):
+    results = [None] * len(paths)
+    try:
+        print(f"[DEBUG] Processing batch of {len(paths)} attendance images")
+        attend_bucket = os.environ["BUCKET1_NAME"]
+        pfp_name = os.environ["BUCKET2_NAME"]
+
+        items = {}
+        # Pictures without a profile are identified one by one
+        identify_items = {}
+        # A queue can deliver the same picture twice in one batch; later
+        # copies share the result of the first
+        first_index = {}
+        copies = {}
+        for index, path in enumerate(paths):
+            try:
+                item = parse_attendance_path(path)
+            except (AttributeError, ValueError) as e:
+                results[index] = malformed_path_response(e)
+                continue
+            if item["attend_key"] in first_index:
+                copies[index] = first_index[item["attend_key"]]
+            else:
+                first_index[item["attend_key"]] = index
+                if item["profile_id"] is None:
+                    identify_items[index] = item
+                else:
+                    items[index] = item
+
+        with stage_timer("db_connect"):
+            connection = get_db_connection() if items else None
+        with stage_timer("db_lookup"):
+            recorded_keys = get_recorded_keys(first_index, connection)
+            for key in recorded_keys:
+                results[first_index[key]] = already_recorded_response()
+                items.pop(first_index[key], None)
+                identify_items.pop(first_index[key], None)
+            profiles = get_profiles_from_db(
+                {(item["admin_id"], item["profile_id"]) for item in items.values()}, connection)
+
+        to_compare = {}
+        for index, item in items.items():
+            profile = profiles.get((item["admin_id"], item["profile_id"]))
+            if profile is None:
+                results[index] = profile_not_found_response(item["profile_id"])
+            else:
+                to_compare[index] = (item, profile)
+
+        with ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS) as executor:
+            futures = {
+                index: executor.submit(
+                    compare_with_profile, attend_bucket, item["attend_key"],
+                    pfp_name, item["profile_id"], profile, connection)
+                for index, (item, profile) in to_compare.items()
             }
 
+        matched_rows = []
+        seen_windows = set()
+        for index, future in futures.items():
+            try:
+                matched, error = future.result()
+            except Exception as e:
+                print(f"[ERROR] Unexpected error: {str(e)}")
+                matched, error = False, ClientError(
+                    {'Error': {'Code': 'InternalError', 'Message': str(e)}}, 'CompareFaces')
+            if error:
+                results[index] = rekognition_error_response(error)
+            elif matched:
+                item = to_compare[index][0]
+                window = dedup_window(item["timestamp"])
+                if window is not None:
+                    if (item["profile_id"], window) in seen_windows:
+                        results[index] = duplicate_checkin_response(item["profile_id"])
+                        continue
+                    seen_windows.add((item["profile_id"], window))
+                matched_rows.append(
+                    (index, (item["profile_id"], paths[index], item["timestamp"], item["attend_key"])))
+            else:
+                results[index] = match_failed_response()
+
+        if matched_rows:
+            with stage_timer("db_insert"):
+                _, insertion_err = insert_many_into_db(
+                    [row for _, row in matched_rows], connection)
+            recorded = set()
+            if not insertion_err:
+                # Rows missing now were skipped for an earlier check-in in the same window
+                with stage_timer("db_lookup"):
+                    recorded = get_recorded_keys([row[3] for _, row in matched_rows], connection)
+            for index, row in matched_rows:
+                if insertion_err:
+                    results[index] = insertion_error_response(insertion_err)
+                elif row[3] in recorded:
+                    results[index] = match_success_response()
+                else:
+                    results[index] = duplicate_checkin_response(row[0])
+
+        for index, item in identify_items.items():
+            if item["group"]:
+                results[index] = identify_group_attendance(paths[index], item)
+            else:
+                results[index] = identify_attendance(paths[index], item)
+
+        for index, first in copies.items():
+            results[index] = results[first]
+
+        recorded = sum(1 for result in results if result["status"] == "success")
+        print(f"[INFO] Batch processed, {recorded} of {len(paths)} recorded")
+        return {
+            "statusCode": 200,
+            "status": "success",
+            "body": f"{recorded} of {len(paths)} attendance records created",
+            "results": results
+        }
+
+    except Exception as e:
+        print(f"[ERROR] Unexpected error: {str(e)}")
+        return {
+            "statusCode": 500,
+            "status": "failure",
+            "body": f"An error occurred: {str(e)}",
+            "results": results
+        }
+
+    finally:
+        print(f"[METRIC] Pool stats: {get_pool_stats()}")
+
+# Verify the attendance pictures named by S3 event records, delivered either
+# directly by S3 or as SQS messages. SQS records whose pictures hit a
+# retryable (5xx) failure are reported in batchItemFailures so only they are
+# redelivered; for direct S3 events the handler raises instead
+
+
+def verify_event_records(records):
+    paths = []
+    sources = []
+    for record in records:
+        try:
+            record_paths = attendance_paths_from_record(record)
+        except (KeyError, TypeError, ValueError) as e:
+            # A malformed message will not get better on redelivery
+            print(f"[WARN] Skipping unreadable event record: {str(e)}")
+            continue
+        sources.append((record, range(len(paths), len(paths) + len(record_paths))))
+        paths.extend(record_paths)
+
+    if paths:
+        result = verify_attendance_batch(paths)
+    else:
+        result = {"statusCode": 200, "status": "success", "body": "No attendance pictures in event", "results": []}
+
+    failures = []
+    for record, indices in sources:
+        failed = [index for index in indices
+                  if result["results"][index] is None or result["results"][index]["statusCode"] >= 500]
+        if failed:
+            failures.append(record)
+    print(f"[INFO] Event processed, {len(paths)} pictures from {len(records)} records, "
+          f"{len(failures)} records to retry")
+
+    result["batchItemFailures"] = [
+        {"itemIdentifier": record["messageId"]} for record in failures if record.get("eventSource") == "aws:sqs"]
+    result["retry"] = any(record.get("eventSource") != "aws:sqs" for record in failures)
+    return result
+
+# Attendance picture URLs in one event record. Keys in S3 notifications are
+# URL-encoded; anything but a new attendance_*, identify_* or group_* object directly
+# under an admin folder (e.g. the originals/ copies) is ignored
+
+
+def attendance_paths_from_record(record):
+    if record.get("eventSource") == "aws:sqs":
+        body = json.loads(record["body"])
+        # Messages sent by the backend carry the picture URL itself
+        if "path" in body:
+            return [body["path"]]
+        # S3 notifications sent to the queue; the s3:TestEvent has no Records
+        return [path for s3_record in body.get("Records", [])
+                for path in attendance_paths_from_record(s3_record)]
+
+    if record.get("eventSource") == "aws:s3":
+        if not record["eventName"].startswith("ObjectCreated"):
+            return []
+        bucket = record["s3"]["bucket"]["name"]
+        key = urllib.parse.unquote_plus(record["s3"]["object"]["key"])
+        folder, _, file_name = key.rpartition("/")
+        if not folder or "/" in folder or not file_name.startswith(("attendance_", "identify_", "group_")):
+            return []
+        return [object_url(bucket, key, record.get("awsRegion", "ca-central-1"))]
+
+    raise ValueError(f"Unsupported event source {record.get('eventSource')}")
+
+# Identify who is in an attendance picture among the admin's enrolled
+# profiles and record their attendance
+
+
+def identify_attendance(path, item):
+    try:
+        print(f"[DEBUG] Identifying attendance image: {path}")
+        attend_bucket = os.environ["BUCKET1_NAME"]
+        with stage_timer("db_connect"):
+            connection = get_db_connection()
+        with stage_timer("db_lookup"):
+            if get_recorded_keys([item["attend_key"]], connection):
+                return already_recorded_response()
+
+        if FACE_MATCHER_BACKEND == "embedding":
+            profile_id, similarity, error = search_gallery(
+                attend_bucket, item["attend_key"], item["admin_id"], connection)
+        else:
+            profile_id, similarity, error = search_face_collection(
+                attend_bucket, item["attend_key"], item["admin_id"], connection)
+        if error:
+            return rekognition_error_response(error)
+        if profile_id is None:
+            print("[INFO] No enrolled profile matched")
+            return identification_failed_response()
+        print(f"[INFO] Identified profile {profile_id} with similarity {similarity:.2f}")
+
+        with stage_timer("db_insert"):
+            inserted, insertion_err = insert_many_into_db(
+                [(profile_id, path, item["timestamp"], item["attend_key"])], connection)
+        if insertion_err:
+            return insertion_error_response(insertion_err)
+        if not inserted:
+            if get_recorded_keys([item["attend_key"]], connection):
+                return already_recorded_response()
+            return {**duplicate_checkin_response(profile_id), "profileID": profile_id}
+        return identified_response(profile_id, similarity)
+
     except Exception as e:
         print(f"[ERROR] Unexpected error: {str(e)}")
         return {
@@ -104,16 +465,575 @@ def lambda_handler(event, context):
             "body": f"An error occurred: {str(e)}"
         }
 
+# Check in every enrolled profile recognized in a group picture. All faces are
+# matched in one pass, each profile to at most one face, and the matches are
+# inserted in one transaction under per-profile object keys, so a redelivered
+# picture records nobody twice
+
+
+def identify_group_attendance(path, item):
+    try:
+        print(f"[DEBUG] Identifying group attendance image: {path}")
+        attend_bucket = os.environ["BUCKET1_NAME"]
+        admin_id = item["admin_id"]
+        with stage_timer("db_connect"):
+            connection = get_db_connection()
+
+        if FACE_MATCHER_BACKEND == "embedding":
+            faces, error = match_group_gallery(attend_bucket, item["attend_key"], admin_id, connection)
+        else:
+            faces, error = match_group_collection(attend_bucket, item["attend_key"], admin_id, connection)
+        if error:
+            return rekognition_error_response(error)
+        if not faces:
+            print("[INFO] No face detected in group photo")
+            return group_checkin_response(faces)
+
+        with stage_timer("db_lookup"):
+            enrolled = get_profiles_from_db(
+                {(admin_id, face["profileID"]) for face in faces if face["profileID"]}, connection)
+        for face in faces:
+            if face["profileID"] and (admin_id, face["profileID"]) not in enrolled:
+                # Deleted since its face was enrolled
+                _galleries.pop(admin_id, None)
+                face["profileID"], face["similarity"] = None, None
+
+        rows = [(face["profileID"], path, item["timestamp"], group_object_key(item["attend_key"], face["profileID"]))
+                for face in faces if face["profileID"]]
+        recorded = set()
+        if rows:
+            with stage_timer("db_insert"):
+                _, insertion_err = insert_many_into_db(rows, connection)
+            if insertion_err:
+                return insertion_error_response(insertion_err)
+            # Rows missing now were skipped for an earlier check-in in the same window
+            with stage_timer("db_lookup"):
+                recorded = get_recorded_keys([row[3] for row in rows], connection)
+
+        for face in faces:
+            if face["profileID"] is None:
+                face["status"] = "unrecognized"
+            elif group_object_key(item["attend_key"], face["profileID"]) in recorded:
+                face["status"] = "success"
+            else:
+                face["status"] = "duplicate"
+        return group_checkin_response(faces)
+
+    except Exception as e:
+        print(f"[ERROR] Unexpected error: {str(e)}")
+        return {
+            "statusCode": 500,
+            "status": "failure",
+            "body": f"An error occurred: {str(e)}"
+        }
+
+# Match every face of a group picture against the admin's face collection.
+# Rekognition searches only the largest face of an image, so each detected
+# face is cropped out and searched on its own, in parallel; the FaceIds found
+# are resolved to profiles with one query. Returns (faces, error)
+
+
+def match_group_collection(bucket_name, img_key, admin_id, connection=None):
+    client = get_rekognition_client()
+    try:
+        with stage_timer("rekognition_detect_faces"):
+            details = client.detect_faces(
+                Image={'S3Object': {'Bucket': bucket_name, 'Name': img_key}})['FaceDetails']
+    except ClientError as e:
+        print(f"[ERROR] Rekognition error: {str(e)}")
+        return None, e
+    boxes = [detail['BoundingBox'] for detail in details]
+    if not boxes:
+        return [], None
+
+    image_bytes, error = read_attendance_image(bucket_name, img_key)
+    if error:
+        return None, error
+    with stage_timer("crop_faces"):
+        crops = crop_faces(image_bytes, boxes)
+
+    def search(crop):
+        try:
+            with stage_timer("rekognition_search_faces"):
+                return client.search_faces_by_image(
+                    CollectionId=FACE_COLLECTION_PREFIX + admin_id,
+                    Image={'Bytes': crop},
+                    MaxFaces=GROUP_SEARCH_CANDIDATES,
+                    FaceMatchThreshold=FACE_SEARCH_THRESHOLD
+                )['FaceMatches'], None
+        except ClientError as e:
+            # A crop in which Rekognition finds no face just has no match
+            if e.response['Error']['Code'] == 'InvalidParameterException':
+                return [], None
+            return None, e
+
+    with ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS) as executor:
+        searches = list(executor.map(search, crops))
+
+    candidates = []
+    for index, (matches, error) in enumerate(searches):
+        if error:
+            if error.response['Error']['Code'] == 'ResourceNotFoundException':
+                # No profile of this admin has been enrolled yet
+                return group_faces(boxes, {}), None
+            print(f"[ERROR] Rekognition error: {str(error)}")
+            return None, error
+        candidates.extend((match['Similarity'], index, match['Face']['FaceId']) for match in matches)
+
+    with stage_timer("db_lookup"):
+        profile_ids = get_profile_ids_by_faces(admin_id, {face_id for _, _, face_id in candidates}, connection)
+    return group_faces(boxes, assign_faces(
+        [(similarity, index, profile_ids[face_id])
+         for similarity, index, face_id in candidates if face_id in profile_ids])), None
+
+# Match every face of a group picture against the admin's embedding gallery
+# with one similarity matrix. Returns (faces, error)
+
+
+def match_group_gallery(bucket_name, img_key, admin_id, connection=None):
+    image_bytes, error = read_attendance_image(bucket_name, img_key)
+    if error:
+        return None, error
+    with stage_timer("db_lookup"):
+        gallery = get_gallery(admin_id, connection)
+    with stage_timer("embedding_match"):
+        embeddings, boxes = compute_face_embeddings_with_boxes(image_bytes)
+        candidates = []
+        if len(embeddings) and gallery["profile_ids"]:
+            embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+            similarities = embeddings @ gallery["matrix"].T
+            for index, gallery_index in zip(*np.nonzero(similarities >= FACE_EMBEDDING_THRESHOLD)):
+                candidates.append((float(similarities[index, gallery_index]), int(index),
+                                   gallery["profile_ids"][gallery_index]))
+    return group_faces(boxes, assign_faces(candidates)), None
+
+# Pair faces with profiles, most similar pairs first, so each face and each
+# profile is used at most once. Candidates are (similarity, face index,
+# profile_id); returns {face index: (profile_id, similarity)}
+
+
+def assign_faces(candidates):
+    assigned = {}
+    taken = set()
+    for similarity, index, profile_id in sorted(candidates, key=lambda candidate: candidate[0], reverse=True):
+        if index in assigned or profile_id in taken:
+            continue
+        assigned[index] = (profile_id, similarity)
+        taken.add(profile_id)
+    return assigned
+
+# Per-face results of a group picture, in detection order
+
+
+def group_faces(boxes, assigned):
+    faces = []
+    for index, box in enumerate(boxes):
+        profile_id, similarity = assigned.get(index, (None, None))
+        faces.append({
+            "boundingBox": {side: round(float(box[side]), 4) for side in ("Left", "Top", "Width", "Height")},
+            "profileID": profile_id,
+            "similarity": similarity,
+        })
+    return faces
+
+# Cut each face, with a margin, out of an image as JPEG bytes. Boxes are
+# Rekognition BoundingBox ratios of the image size
+
+
+def crop_faces(image_bytes, boxes):
+    # Pillow is only bundled when group check-ins are used
+    from PIL import Image
+    image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    crops = []
+    for box in boxes:
+        margin_x, margin_y = box['Width'] * GROUP_FACE_CROP_MARGIN, box['Height'] * GROUP_FACE_CROP_MARGIN
+        left = max(box['Left'] - margin_x, 0) * image.width
+        top = max(box['Top'] - margin_y, 0) * image.height
+        right = min(box['Left'] + box['Width'] + margin_x, 1) * image.width
+        bottom = min(box['Top'] + box['Height'] + margin_y, 1) * image.height
+        buffer = io.BytesIO()
+        image.crop((int(left), int(top), int(right), int(bottom))).save(buffer, format="JPEG", quality=90)
+        crops.append(buffer.getvalue())
+    return crops
+
+# Search the admin's Rekognition face collection for the largest face in the
+# picture. Returns (profile_id or None, similarity, error)
+
+
+def search_face_collection(bucket_name, img_key, admin_id, connection=None):
+    try:
+        with stage_timer("rekognition_search_faces"):
+            response = get_rekognition_client().search_faces_by_image(
+                CollectionId=FACE_COLLECTION_PREFIX + admin_id,
+                Image={'S3Object': {'Bucket': bucket_name, 'Name': img_key}},
+                MaxFaces=1,
+                FaceMatchThreshold=FACE_SEARCH_THRESHOLD
+            )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ResourceNotFoundException':
+            # No profile of this admin has been enrolled yet
+            return None, None, None
+        print(f"[ERROR] Rekognition error: {str(e)}")
+        return None, None, e
+
+    if not response.get('FaceMatches'):
+        return None, None, None
+    match = response['FaceMatches'][0]
+    with stage_timer("db_lookup"):
+        profile_id = get_profile_id_by_face(admin_id, match['Face']['FaceId'], connection)
+    return profile_id, match['Similarity'], None
+
+# Search the admin's embedding gallery for the best match of any face in the
+# picture. Returns (profile_id or None, similarity, error)
+
+
+def search_gallery(bucket_name, img_key, admin_id, connection=None):
+    image_bytes, error = read_attendance_image(bucket_name, img_key)
+    if error:
+        return None, None, error
+    with stage_timer("db_lookup"):
+        gallery = get_gallery(admin_id, connection)
+    with stage_timer("embedding_match"):
+        faces = compute_face_embeddings(image_bytes)
+        if len(faces) == 0:
+            print("[ERROR] No face detected in attendance photo")
+            return None, None, ClientError(
+                {'Error': {'Code': 'InvalidParameterException', 'Message': 'No face detected in attendance photo'}},
+                'SearchFacesByImage'
+            )
+        profile_id, similarity = best_gallery_match(gallery, faces)
+    if profile_id is None or similarity < FACE_EMBEDDING_THRESHOLD:
+        return None, similarity, None
+    with stage_timer("db_lookup"):
+        if get_profile_from_db(admin_id, profile_id, connection) is None:
+            # Deleted since the gallery was loaded
+            _galleries.pop(admin_id, None)
+            return None, similarity, None
+    return profile_id, similarity, None
+
+# Return the gallery profile most similar to any of the faces, and the cosine similarity
+
+
+def best_gallery_match(gallery, faces):
+    if not gallery["profile_ids"]:
+        return None, None
+    faces = faces / np.linalg.norm(faces, axis=1, keepdims=True)
+    similarities = faces @ gallery["matrix"].T
+    face, index = np.unravel_index(np.argmax(similarities), similarities.shape)
+    return gallery["profile_ids"][index], float(similarities[face, index])
+
+# Return the admin's embedding gallery, syncing it with people_profile first:
+# a full load when missing or older than GALLERY_REFRESH_SECONDS, otherwise
+# only the profiles updated since the last sync. A write stamped earlier than
+# one already seen is picked up by the next full load.
+
+
+def get_gallery(admin_id, connection=None):
+    gallery = _galleries.get(admin_id)
+    full_load = gallery is None or time.monotonic() - gallery["loaded"] > GALLERY_REFRESH_SECONDS
+    try:
+        if connection is None:
+            connection = get_db_connection()
+        with connection.cursor() as cursor:
+            if full_load:
+                cursor.execute(
+                    "SELECT profile_id, face_embedding, updated_at FROM people_profile WHERE admin_id = %s",
+                    (admin_id,))
+            else:
+                cursor.execute(
+                    "SELECT profile_id, face_embedding, updated_at FROM people_profile "
+                    "WHERE admin_id = %s AND updated_at >= %s",
+                    (admin_id, gallery["synced"]))
+            rows = cursor.fetchall()
+    except Exception as e:
+        print(f"[ERROR] Database error: {str(e)}")
+        reset_db_connection()
+        raise
+
+    if full_load:
+        gallery = {"loaded": time.monotonic(), "synced": None, "updated": {}, "embeddings": {},
+                   "profile_ids": [], "matrix": None}
+        _galleries[admin_id] = gallery
+
+    changed = gallery["matrix"] is None
+    for profile_id, embedding, updated_at in rows:
+        gallery["synced"] = max(gallery["synced"] or updated_at, updated_at)
+        if gallery["updated"].get(profile_id) == updated_at:
+            continue
+        gallery["updated"][profile_id] = updated_at
+        changed = True
+        if embedding:
+            vector = np.frombuffer(embedding, dtype=np.float32)
+            gallery["embeddings"][profile_id] = vector / np.linalg.norm(vector)
+        else:
+            gallery["embeddings"].pop(profile_id, None)
+
+    if changed:
+        gallery["profile_ids"] = list(gallery["embeddings"])
+        gallery["matrix"] = (np.stack([gallery["embeddings"][p] for p in gallery["profile_ids"]])
+                             if gallery["profile_ids"] else np.zeros((0, 0), dtype=np.float32))
+        print(f"[INFO] Gallery of {admin_id} holds {len(gallery['profile_ids'])} profiles")
+    return gallery
+
+# Extract admin, profile and timestamp from an attendance picture URL; the key
+# format (see checkin_keys.py) is shared with the backend that builds it
+
+
+def parse_attendance_path(path):
+    attend_key = key_from_url(path)
+    parsed = parse_checkin_key(attend_key)
+    return {
+        "attend_key": attend_key,
+        "admin_id": parsed.admin_id,
+        "profile_id": parsed.profile_id,
+        "timestamp": parsed.timestamp,
+        "group": parsed.group,
+    }
+
+# Compare an attendance picture with a profile using the configured matcher
+
+
+def compare_with_profile(attend_bucket, attend_key, pfp_bucket, profile_id, profile, connection=None):
+    if profile.get("face_embedding") is not None:
+        # Use the stored profile embedding to do facial comparison locally
+        return handle_embedding_match(
+            attend_bucket, attend_key, profile["face_embedding"])
+
+    # Use rekognition to do facial comparison, reusing the cached
+    # analysis of the profile picture when it is still current
+    pfp_key = profile["profile_image"].split(".com/")[-1]
+    profile_face, error = get_profile_face_analysis(
+        profile_id, profile, pfp_bucket, pfp_key, connection)
+    if error:
+        return False, error
+    comparison_response, error = handle_rekognition(
+        attend_bucket, attend_key, pfp_bucket, pfp_key, profile_face)
+    if error:
+        return False, error
+    return len(comparison_response['FaceMatches']) == 1, None
+
+# Build the responses shared by the single and batch paths
+
+
+def profile_not_found_response(profile_id):
+    return {
+        "statusCode": 404,
+        "status": "failure",
+        "body": f"Profile picture with ID {profile_id} not found"
+    }
+
+
+def match_success_response():
+    return {
+        "statusCode": 200,
+        "status": "success",
+        "body": "Face match successful, attendance recorded"
+    }
+
+
+def match_accepted_response(profile_id, path, item):
+    return {
+        "statusCode": 200,
+        "status": "success",
+        "body": "Face match successful, attendance accepted",
+        "attendance": {
+            "profileID": profile_id,
+            "photoURL": path,
+            "timestamp": item["timestamp"].isoformat(),
+            "objectKey": item["attend_key"]
+        }
+    }
+
+
+def duplicate_checkin_response(profile_id):
+    return {
+        "statusCode": 409,
+        "status": "failure",
+        "body": f"Profile {profile_id} has already checked in"
+    }
+
+
+def malformed_path_response(error):
+    return {
+        "statusCode": 400,
+        "status": "failure",
+        "body": f"Malformed attendance path: {str(error)}"
+    }
+
+
+def identified_response(profile_id, similarity):
+    return {
+        "statusCode": 200,
+        "status": "success",
+        "body": f"Identified profile {profile_id}, attendance recorded",
+        "profileID": profile_id,
+        "similarity": similarity
+    }
+
+
+def group_checkin_response(faces):
+    recorded = sum(1 for face in faces if face["status"] == "success")
+    return {
+        "statusCode": 200,
+        "status": "success" if recorded else "failure",
+        "body": f"{recorded} of {len(faces)} faces checked in" if faces else "No face detected in group photo",
+        "faces": faces
+    }
+
+
+def identification_failed_response():
+    return {
+        "statusCode": 200,
+        "status": "failure",
+        "body": "No enrolled profile matched"
+    }
+
+
+def already_recorded_response():
+    return {
+        "statusCode": 200,
+        "status": "success",
+        "body": "Attendance already recorded"
+    }
+
+
+def insertion_error_response(error):
+    # A server-side failure, so queue and S3 deliveries retry it
+    return {
+        "statusCode": 500,
+        "status": "failure",
+        "body": f"Error inserting data: {error}"
+    }
+
+
+def match_failed_response():
+    return {
+        "statusCode": 200,
+        "status": "failure",
+        "body": "Face match failed"
+    }
+
+
+def rekognition_error_response(error):
+    print(f"[ERROR] Rekognition error: {str(error)}")
+    error_code = error.response['Error']['Code']
+    if error_code == 'InvalidS3ObjectException':
+        return {
+            "statusCode": 404,
+            "status": "failure",
+            "body": f"One or both of the S3 objects could not be found: {error.response['Error']['Message']}"
+        }
+    elif error_code == 'InvalidParameterException':
+        return {
+            "statusCode": 400,
+            "status": "failure",
+            "body": "No face detected in one or both images"
+        }
+    elif error_code == 'AccessDeniedException':
+        return {
+            "statusCode": 403,
+            "status": "failure",
+            "body": "Access denied. Check your S3 bucket permissions."
+        }
+    else:
+        return {
+            "statusCode": 500,
+            "status": "failure",
+            "body": f"A Rekognition error occurred: {error.response['Error']['Message']}"
+        }
+
+# Count a hit or miss of a warm container cache in pool_stats
+
+
+def count_pool_stat(name):
+    with _pool_stats_lock:
+        pool_stats[name] += 1
+
+# Return a consistent copy of pool_stats
+
+
+def get_pool_stats():
+    with _pool_stats_lock:
+        return dict(pool_stats)
+
+# Return the cached database connection, reconnecting if the socket went stale
+
+
+def get_db_connection():
+    global _db_connection
+    if _db_connection is not None:
+        try:
+            _db_connection.ping(reconnect=False)
+            count_pool_stat("db_hits")
+            return _db_connection
+        except Exception as e:
+            print(f"[WARN] Stale database connection, reconnecting: {str(e)}")
+            reset_db_connection()
+
+    count_pool_stat("db_misses")
+    # Fetch database credentials from environment variables
+    _db_connection = pymysql.connect(
+        host=os.environ["DB_HOST"],
+        user=os.environ["DB_USER"],
+        password=os.environ["DB_PASSWORD"],
+        database=os.environ["DB_NAME"],
+        connect_timeout=5,
+        # Without autocommit a reused connection would keep reading from the
+        # snapshot of its first SELECT and miss profiles added since then
+        autocommit=True
+    )
+    return _db_connection
+
+# Drop the cached connection so the next call opens a fresh one
+
+
+def reset_db_connection():
+    global _db_connection
+    if _db_connection is not None:
+        try:
+            _db_connection.close()
+        except Exception:
+            pass
+    _db_connection = None
+
+# Return the cached Rekognition client, creating it on first use
+
+
+def get_rekognition_client():
+    global _rekognition_client
+    if _rekognition_client is not None:
+        count_pool_stat("rekognition_hits")
+        return _rekognition_client
+
+    count_pool_stat("rekognition_misses")
+    _rekognition_client = boto3.client('rekognition', region_name='ca-central-1')
+    return _rekognition_client
+
+# Return the cached S3 client, creating it on first use
+
+
+def get_s3_client():
+    global _s3_client
+    if _s3_client is not None:
+        count_pool_stat("s3_hits")
+        return _s3_client
+
+    count_pool_stat("s3_misses")
+    _s3_client = boto3.client('s3', region_name='ca-central-1')
+    return _s3_client
+
 # Pass the two S3 objects to rekognition for facial comparison
 
 
-def handle_rekognition(bucket1_name, img1_key, bucket2_name, img2_key):
-    client = boto3.client('rekognition', region_name='ca-central-1')
+def handle_rekognition(bucket1_name, img1_key, bucket2_name, img2_key, profile_face=None):
+    client = get_rekognition_client()
     try:
-        # First check if faces exist in both images
-        source_faces = client.detect_faces(
-            Image={'S3Object': {'Bucket': bucket1_name, 'Name': img1_key}}
-        )
+        # First check if faces exist in both images, unless the profile
+        # picture was already analysed
+        with stage_timer("rekognition_detect_faces"):
+            source_faces = client.detect_faces(
+                Image={'S3Object': {'Bucket': bucket1_name, 'Name': img1_key}}
+            )
         
         if not source_faces.get('FaceDetails'):
             print("[ERROR] No face detected in attendance photo")
@@ -122,100 +1042,387 @@ def handle_rekognition(bucket1_name, img1_key, bucket2_name, img2_key):
                 'CompareFaces'
             )
         
-        target_faces = client.detect_faces(
-            Image={'S3Object': {'Bucket': bucket2_name, 'Name': img2_key}}
-        )
-        
-        if not target_faces.get('FaceDetails'):
-            print("[ERROR] No face detected in profile photo")
-            return None, ClientError(
-                {'Error': {'Code': 'InvalidParameterException', 'Message': 'No face detected in profile photo'}},
-                'CompareFaces'
-            )
+        if profile_face is None:
+            profile_face, error = detect_profile_face(bucket2_name, img2_key)
+            if error:
+                return None, error
 
-        comparison_response = client.compare_faces(
-            SimilarityThreshold=80,
-            SourceImage={'S3Object': {'Bucket': bucket1_name, 'Name': img1_key}},
-            TargetImage={'S3Object': {'Bucket': bucket2_name, 'Name': img2_key}}
-        )
+        with stage_timer("rekognition_compare_faces"):
+            comparison_response = client.compare_faces(
+                SimilarityThreshold=80,
+                SourceImage={'S3Object': {'Bucket': bucket1_name, 'Name': img1_key}},
+                TargetImage={'S3Object': {'Bucket': bucket2_name, 'Name': img2_key}}
+            )
         return comparison_response, None
 
     except ClientError as e:
         print(f"[ERROR] Rekognition error: {str(e)}")
         return None, e
 
-# Get S3 url for default profile image from RDS
+# Run detect_faces on a profile picture and keep what compare_faces needs
 
 
-def get_path_from_db(admin_id, profile_id):
-    connection = None
-    try:
-        # Fetch database credentials from environment variables
-        db_host = os.environ["DB_HOST"]
-        db_user = os.environ["DB_USER"]
-        db_password = os.environ["DB_PASSWORD"]
-        db_name = os.environ["DB_NAME"]
+def detect_profile_face(bucket_name, img_key):
+    with stage_timer("rekognition_detect_profile_face"):
+        target_faces = get_rekognition_client().detect_faces(
+            Image={'S3Object': {'Bucket': bucket_name, 'Name': img_key}}
+        )
 
-        # Connect to the database
-        connection = pymysql.connect(
-            host=db_host,
-            user=db_user,
-            password=db_password,
-            database=db_name
+    if not target_faces.get('FaceDetails'):
+        print("[ERROR] No face detected in profile photo")
+        return None, ClientError(
+            {'Error': {'Code': 'InvalidParameterException', 'Message': 'No face detected in profile photo'}},
+            'CompareFaces'
         )
-        cursor = connection.cursor()
 
-        # Fix the tuple syntax and fetch data
-        cursor.execute("SELECT profile_image FROM people_profile WHERE profile_id = %s AND admin_id = %s", (profile_id, admin_id))
-        result_tuple = cursor.fetchall()
-        
-        if not result_tuple:
+    face = max(target_faces['FaceDetails'], key=lambda f: f.get('Confidence', 0))
+    return {
+        "face_count": len(target_faces['FaceDetails']),
+        "bounding_box": face.get('BoundingBox'),
+        "confidence": face.get('Confidence'),
+    }, None
+
+# Get the profile face analysis from the warm cache, RDS, or Rekognition, in that order
+
+
+def get_profile_face_analysis(profile_id, profile, bucket_name, img_key, connection=None):
+    cache_key = (profile_id, profile["image_version"])
+    if cache_key in _profile_face_cache:
+        count_pool_stat("profile_face_hits")
+        return _profile_face_cache[cache_key], None
+
+    analysis = profile.get("face_analysis")
+    if analysis is None:
+        count_pool_stat("profile_face_misses")
+        try:
+            analysis, error = detect_profile_face(bucket_name, img_key)
+        except ClientError as e:
+            print(f"[ERROR] Rekognition error: {str(e)}")
+            return None, e
+        if error:
+            return None, error
+        save_face_analysis_to_db(
+            profile_id, profile["image_version"], analysis, connection)
+    else:
+        count_pool_stat("profile_face_hits")
+
+    if len(_profile_face_cache) >= PROFILE_FACE_CACHE_SIZE:
+        _profile_face_cache.clear()
+    _profile_face_cache[cache_key] = analysis
+    return analysis, None
+
+# Compute face embeddings for every face in an image on the local CPU
+
+
+def compute_face_embeddings(image_bytes):
+    # face_recognition (dlib) is only bundled when the embedding backend is used
+    import face_recognition
+    image = face_recognition.load_image_file(io.BytesIO(image_bytes))
+    encodings = face_recognition.face_encodings(image)
+    return np.asarray(encodings, dtype=np.float32).reshape(len(encodings), -1)
+
+# Compute an embedding and a BoundingBox-style box (ratios of the image size)
+# for every face in an image
+
+
+def compute_face_embeddings_with_boxes(image_bytes):
+    import face_recognition
+    image = face_recognition.load_image_file(io.BytesIO(image_bytes))
+    height, width = image.shape[:2]
+    locations = face_recognition.face_locations(image)
+    encodings = face_recognition.face_encodings(image, known_face_locations=locations)
+    boxes = [{"Left": left / width, "Top": top / height, "Width": (right - left) / width,
+              "Height": (bottom - top) / height} for top, right, bottom, left in locations]
+    return np.asarray(encodings, dtype=np.float32).reshape(len(encodings), -1), boxes
+
+# Return the highest cosine similarity between any face in the image and the profile
+
+
+def match_embedding(image_bytes, profile_embedding, embed=compute_face_embeddings):
+    faces = embed(image_bytes)
+    if len(faces) == 0:
+        return None
+    faces = faces / np.linalg.norm(faces, axis=1, keepdims=True)
+    profile = profile_embedding / np.linalg.norm(profile_embedding)
+    return float(np.max(faces @ profile))
+
+# Match the attendance photo against a stored profile embedding
+
+
+def handle_embedding_match(bucket_name, img_key, profile_embedding):
+    image_bytes, error = read_attendance_image(bucket_name, img_key)
+    if error:
+        return False, error
+
+    with stage_timer("embedding_match"):
+        similarity = match_embedding(image_bytes, profile_embedding)
+    if similarity is None:
+        print("[ERROR] No face detected in attendance photo")
+        return False, ClientError(
+            {'Error': {'Code': 'InvalidParameterException', 'Message': 'No face detected in attendance photo'}},
+            'CompareFaces'
+        )
+
+    print(f"[INFO] Embedding similarity: {similarity:.4f}")
+    return similarity >= FACE_EMBEDDING_THRESHOLD, None
+
+# Read an attendance picture from S3. Returns (bytes, error)
+
+
+def read_attendance_image(bucket_name, img_key):
+    try:
+        with stage_timer("s3_get_object"):
+            return get_s3_client().get_object(
+                Bucket=bucket_name, Key=img_key)['Body'].read(), None
+    except ClientError as e:
+        print(f"[ERROR] S3 error: {str(e)}")
+        code = e.response['Error']['Code']
+        if code in ('NoSuchKey', '404'):
+            return None, ClientError(
+                {'Error': {'Code': 'InvalidS3ObjectException', 'Message': f'Attendance photo {img_key} not found'}},
+                'GetObject'
+            )
+        return None, e
+
+# Get S3 url, image version, cached face analysis and, for the embedding
+# backend, the stored face embedding of a profile from RDS
+
+
+def get_profile_from_db(admin_id, profile_id, connection=None):
+    embedding_column = ", face_embedding" if FACE_MATCHER_BACKEND == "embedding" else ""
+    try:
+        if connection is None:
+            connection = get_db_connection()
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT profile_image, image_version, face_analysis{embedding_column} FROM people_profile WHERE profile_id = %s AND admin_id = %s", (profile_id, admin_id))
+            result = cursor.fetchone()
+
+        if not result:
             print(f"[ERROR] No profile found for ID: {profile_id}")
             return None
-            
-        return result_tuple[0][0]
+
+        profile = profile_from_row(*result[:3])
+        if embedding_column and result[3]:
+            profile["face_embedding"] = np.frombuffer(result[3], dtype=np.float32)
+        return profile
 
     except Exception as e:
         print(f"[ERROR] Database error: {str(e)}")
-        return str(e)
+        reset_db_connection()
+        raise
 
-    finally:
-        if connection:
-            connection.close()
+# Get the profile a face collection FaceId was indexed for
+
+
+def get_profile_id_by_face(admin_id, face_id, connection=None):
+    try:
+        if connection is None:
+            connection = get_db_connection()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT profile_id FROM people_profile WHERE admin_id = %s AND face_id = %s", (admin_id, face_id))
+            result = cursor.fetchone()
+        if not result:
+            print(f"[WARN] Face {face_id} is not enrolled for any profile")
+            return None
+        return result[0]
+
+    except Exception as e:
+        print(f"[ERROR] Database error: {str(e)}")
+        reset_db_connection()
+        raise
 
-# Insert attendance picture url into RDS
+# Get the profiles that a set of face collection FaceIds were indexed for, with
+# a single query. Returns {face_id: profile_id}
 
 
-def insert_data_into_db(profile_id, photo_url, timestamp):
-    connection = None
+def get_profile_ids_by_faces(admin_id, face_ids, connection=None):
+    face_ids = list(face_ids)
+    if not face_ids:
+        return {}
     try:
-        # Fetch database credentials from environment variables
-        db_host = os.environ["DB_HOST"]
-        db_user = os.environ["DB_USER"]
-        db_password = os.environ["DB_PASSWORD"]
-        db_name = os.environ["DB_NAME"]
-        
-        # Connect to the database
-        connection = pymysql.connect(
-            host=db_host,
-            user=db_user,
-            password=db_password,
-            database=db_name
-        )
-        cursor = connection.cursor()
-        
-        # Execute the query
-        cursor.execute(
-            "INSERT INTO people_attendance (profile_id, photo_url, timestamp) VALUES (%s, %s, %s)",
-            (profile_id, photo_url, timestamp)
-        )
+        if connection is None:
+            connection = get_db_connection()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT face_id, profile_id FROM people_profile "
+                f"WHERE admin_id = %s AND face_id IN ({', '.join(['%s'] * len(face_ids))})",
+                [admin_id] + face_ids
+            )
+            return dict(cursor.fetchall())
+
+    except Exception as e:
+        print(f"[ERROR] Database error: {str(e)}")
+        reset_db_connection()
+        raise
+
+# Get the profiles for a set of (admin_id, profile_id) pairs with a single query
+
+
+def get_profiles_from_db(keys, connection=None):
+    if not keys:
+        return {}
+    keys = list(keys)
+    embedding_column = ", face_embedding" if FACE_MATCHER_BACKEND == "embedding" else ""
+    placeholders = ", ".join(["(%s, %s)"] * len(keys))
+    params = [value for admin_id, profile_id in keys for value in (admin_id, profile_id)]
+    try:
+        if connection is None:
+            connection = get_db_connection()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT admin_id, profile_id, profile_image, image_version, face_analysis{embedding_column} "
+                f"FROM people_profile WHERE (admin_id, profile_id) IN ({placeholders})",
+                params
+            )
+            rows = cursor.fetchall()
+
+        profiles = {}
+        for row in rows:
+            profile = profile_from_row(*row[2:5])
+            if embedding_column and row[5]:
+                profile["face_embedding"] = np.frombuffer(row[5], dtype=np.float32)
+            profiles[(row[0], row[1])] = profile
+        return profiles
+
+    except Exception as e:
+        print(f"[ERROR] Database error: {str(e)}")
+        reset_db_connection()
+        raise
+
+# Build a profile dict from its columns, dropping face analysis of an older picture
+
+
+def profile_from_row(profile_image, image_version, face_analysis):
+    if face_analysis is not None:
+        face_analysis = json.loads(face_analysis)
+        if face_analysis.get("version") != image_version:
+            face_analysis = None
+    return {
+        "profile_image": profile_image,
+        "image_version": image_version,
+        "face_analysis": face_analysis,
+    }
+
+# Store the profile face analysis, unless the picture changed in the meantime
+
+
+def save_face_analysis_to_db(profile_id, image_version, analysis, connection=None):
+    try:
+        # Called from batch worker threads, which share one connection
+        with _db_lock:
+            if connection is None:
+                connection = get_db_connection()
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "UPDATE people_profile SET face_analysis = %s WHERE profile_id = %s AND image_version = %s",
+                    (json.dumps({**analysis, "version": image_version}), profile_id, image_version)
+                )
+            connection.commit()
+    except Exception as e:
+        # The analysis is only a cache, so a failed write is not fatal
+        print(f"[WARN] Could not cache profile face analysis: {str(e)}")
+
+# Write the outcome of an asynchronous check-in to its ticket row
+
+
+def record_checkin_result(ticket, result, connection=None):
+    status = "matched" if result["status"] == "success" else "failed"
+    try:
+        if connection is None:
+            connection = get_db_connection()
+        with connection.cursor() as cursor:
+            # Django stores UUIDField as 32 hex characters on MySQL
+            cursor.execute(
+                "UPDATE people_checkin SET status = %s, message = %s, updated_at = %s WHERE ticket_id = %s",
+                (status, str(result["body"])[:1000], datetime.datetime.now(datetime.timezone.utc),
+                 uuid.UUID(ticket).hex)
+            )
         connection.commit()
+    except Exception as e:
+        print(f"[ERROR] Could not record check-in result for {ticket}: {str(e)}")
+        reset_db_connection()
+
+# Return which of the given S3 keys already have an attendance row
+
+
+def get_recorded_keys(keys, connection=None):
+    keys = list(keys)
+    if not keys:
+        return set()
+    try:
+        if connection is None:
+            connection = get_db_connection()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT object_key FROM people_attendance WHERE object_key IN ({', '.join(['%s'] * len(keys))})",
+                keys
+            )
+            return {row[0] for row in cursor.fetchall()}
+
+    except Exception as e:
+        print(f"[ERROR] Database error: {str(e)}")
+        reset_db_connection()
+        raise
+
+# Dedup bucket of a check-in: one accepted check-in per profile per bucket,
+# enforced by a unique (profile_id, dedup_window) key
+
+
+def dedup_window(timestamp):
+    if CHECKIN_DEDUP_WINDOW_SECONDS <= 0:
         return None
-    
+    return calendar.timegm(timestamp.utctimetuple()) // CHECKIN_DEDUP_WINDOW_SECONDS
+
+# Insert several attendance records in one statement and recount their daily
+# rollups in the same transaction. Rows are (profile_id, photo_url, timestamp,
+# object_key); rows that fall in a dedup window which already has a check-in,
+# or whose picture was already recorded, are skipped. Returns (rows inserted, error).
+
+
+def insert_many_into_db(rows, connection=None):
+    days = {(profile_id, timestamp.date()) for profile_id, _, timestamp, _ in rows}
+
+    try:
+        if connection is None:
+            connection = get_db_connection()
+        connection.begin()
+        with connection.cursor() as cursor:
+            # pymysql rewrites executemany INSERT ... VALUES into one multi-row INSERT
+            inserted = cursor.executemany(
+                "INSERT INTO people_attendance (profile_id, photo_url, timestamp, dedup_window, object_key) "
+                "VALUES (%s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE id = id",
+                [(profile_id, photo_url, timestamp, dedup_window(timestamp), object_key)
+                 for profile_id, photo_url, timestamp, object_key in rows]
+            )
+            cursor.executemany(
+                "INSERT INTO people_attendancedailyrollup (profile_id, admin_id, date, check_ins) "
+                "SELECT * FROM (SELECT a.profile_id, p.admin_id, %s AS date, COUNT(*) AS check_ins "
+                "FROM people_attendance a JOIN people_profile p ON p.profile_id = a.profile_id "
+                "WHERE a.profile_id = %s AND a.timestamp >= %s AND a.timestamp < %s "
+                "GROUP BY a.profile_id, p.admin_id) AS counted "
+                "ON DUPLICATE KEY UPDATE check_ins = counted.check_ins",
+                [(date, profile_id, date, date + datetime.timedelta(days=1))
+                 for profile_id, date in days]
+            )
+            if inserted:
+                # bump the admins' attendance version so the backend's response cache drops their lists
+                profile_ids = sorted({profile_id for profile_id, _ in days})
+                cursor.execute(
+                    "INSERT INTO people_responseversion (scope, version) "
+                    "SELECT * FROM (SELECT DISTINCT CONCAT('attendance:', admin_id) AS scope, 2 AS version "
+                    f"FROM people_profile WHERE profile_id IN ({', '.join(['%s'] * len(profile_ids))})) AS scopes "
+                    "ON DUPLICATE KEY UPDATE version = people_responseversion.version + 1",
+                    profile_ids
+                )
+        connection.commit()
+        return inserted, None
+
     except Exception as e:
         print(f"[ERROR] Database insertion error: {str(e)}")
-        return str(e)
-
-    finally:
-        if connection:
-            connection.close()
+        if connection is not None:
+            try:
+                connection.rollback()
+            except Exception:
+                pass
+        reset_db_connection()
+        return 0, str(e)
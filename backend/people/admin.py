@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Attendance, Profile
+from .models import Attendance, AttendanceDailyRollup, CheckIn, Profile
 
 # Admin class for the Attendance model
 
@@ -13,3 +13,15 @@ class AttendanceAdmin(admin.ModelAdmin):
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
     list_display = ('profile_id', 'profile_name', 'profile_image', 'admin_id')
+
+# Admin class for the CheckIn model
+
+@admin.register(CheckIn)
+class CheckInAdmin(admin.ModelAdmin):
+    list_display = ('ticket_id', 'profile_id', 'status', 'created_at')
+
+# Admin class for the AttendanceDailyRollup model
+
+@admin.register(AttendanceDailyRollup)
+class AttendanceDailyRollupAdmin(admin.ModelAdmin):
+    list_display = ('profile', 'admin_id', 'date', 'check_ins')
@@ -0,0 +1,163 @@
+import asyncio
+import functools
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from .aws_clients import get_aws_clients
+from .caching import acached_response
+from .dedup import ais_duplicate_checkin, remember_checkin
+from .metrics import StageTimer
+from .models import CheckIn, Profile
+from .replicas import use_read_replica
+from .serializers import CheckInSerializer, ProfileSerializer, aserialize_attendance
+from .views import (attendance_page, attendance_picture_key, attendance_picture_too_large, attendance_query,
+                    duplicate_checkin_result, get_user_id, invoke_lambda, invoke_lambda_async,
+                    normalize_attendance_image, read_attendance_image, upload_fileobj, upload_original)
+
+# Async versions of the check-in and read endpoints, for running under an ASGI
+# server. Database access goes through Django's async ORM. boto3 has no async
+# API, so each AWS call is handed to a dedicated thread pool: a request only
+# holds a thread while one of its calls is actually waiting on AWS, and calls
+# that do not depend on each other (credential exchange, image normalization,
+# the dedup lookup) run at the same time.
+
+_blocking_executor = ThreadPoolExecutor(max_workers=settings.ASYNC_BLOCKING_WORKERS,
+                                        thread_name_prefix='async-views')
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Run a blocking call (boto3, Pillow) on the shared pool without blocking the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_blocking_executor, functools.partial(func, *args, **kwargs))
+
+
+async def timed(timer, stage, awaitable):
+    with timer.stage(stage):
+        return await awaitable
+
+
+def read_body(request):
+    # DRF's request.data is not available outside @api_view
+    if request.content_type.startswith('multipart/'):
+        return request.POST
+    return json.loads(request.body)
+
+
+@csrf_exempt
+@require_POST
+async def upload_attendance_picture(request):
+    """
+    Async version of views.upload_attendance_picture, with the same request and response bodies.
+    """
+    if attendance_picture_too_large(request):
+        return JsonResponse({'error': 'Attendance picture is too large'}, status=413)
+
+    timer = StageTimer('checkin_async')
+    try:
+        with timer.stage('decode'):
+            body = read_body(request)
+            image_file = read_attendance_image(request, body)
+        profileID = body['profileID']
+        pools = body['region'], body['identityPoolId'], body['userPoolId']
+        cognitoID = get_user_id(body['idToken'])
+    except (KeyError, ValueError) as e:
+        return JsonResponse({'error': f"Invalid check-in: {e}"}, status=400)
+    if attendance_picture_too_large(request, image_file):
+        timer.finish(status='too_large')
+        return JsonResponse({'error': 'Attendance picture is too large'}, status=413)
+
+    # the dedup lookup, the credential exchange and normalization are independent
+    duplicate, clients, normalized = await asyncio.gather(
+        timed(timer, 'dedup_check', ais_duplicate_checkin(profileID)),
+        timed(timer, 'cognito', run_blocking(
+            get_aws_clients, *pools, body['idToken'], cognitoID)),
+        timed(timer, 'normalize', run_blocking(normalize_attendance_image, image_file)),
+        return_exceptions=True)
+    if duplicate is True:
+        timer.finish(status='duplicate')
+        return JsonResponse(duplicate_checkin_result(profileID), status=200)
+    for result in (duplicate, clients, normalized):
+        if isinstance(result, ValueError):
+            timer.finish(status='invalid_image')
+            return JsonResponse({'error': str(result)}, status=400)
+        if isinstance(result, BaseException):
+            raise result
+    s3_client, lambda_client = clients
+    image_file, original = normalized
+
+    bucket = os.getenv("ATTENDANCE_PICTURE_BUCKET_NAME")
+    try:
+        checkin_key = attendance_picture_key(cognitoID, profileID)
+    except ValueError as e:
+        timer.finish(status='invalid_key')
+        return JsonResponse({'error': str(e)}, status=400)
+    with timer.stage('s3_upload'):
+        attendance_picture_url, _ = await asyncio.gather(
+            run_blocking(upload_fileobj, image_file, bucket, checkin_key.key, client=s3_client,
+                         metadata=checkin_key.metadata),
+            run_blocking(upload_original, original, bucket, checkin_key.key, client=s3_client))
+
+    async_mode = str(body.get('async', settings.CHECKIN_ASYNC)).lower() in ('true', '1')
+    if async_mode:
+        checkin = await CheckIn.objects.acreate(profile_id=profileID, photo_url=attendance_picture_url)
+        try:
+            await timed(timer, 'lambda_invoke', run_blocking(
+                invoke_lambda_async, attendance_picture_url, checkin.ticket_id, lambda_client))
+        except RuntimeError as e:
+            checkin.status = CheckIn.FAILED
+            checkin.message = str(e)
+            await checkin.asave()
+        timer.finish(status=checkin.status)
+        return JsonResponse(CheckInSerializer(checkin).data, status=202)
+
+    response_status_code, response_status, response_body = await timed(timer, 'lambda_invoke', run_blocking(
+        invoke_lambda, attendance_picture_url, lambda_client, timer))
+    if response_status == 'success':
+        remember_checkin(profileID)
+    timer.finish(status=response_status, status_code=response_status_code)
+    return JsonResponse({'statusCode': response_status_code, 'status': response_status,
+                         'message': response_body}, status=200)
+
+
+@require_GET
+@use_read_replica
+async def get_attendance_by_admin(request, admin_id):
+    """
+    Async version of views.get_attendance_by_admin, with the same parameters and pages.
+    """
+    try:
+        attendance, limit = attendance_query(admin_id, request.GET)
+
+        async def build():
+            if limit is None:
+                return await aserialize_attendance(attendance)
+            return attendance_page(await aserialize_attendance(attendance[:limit + 1]), limit)
+
+        return await acached_response(request, f"attendance:{admin_id}", build)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+
+@require_GET
+@use_read_replica
+async def get_profile_by_admin(request, admin_id):
+    """
+    Async version of views.get_profile_by_admin.
+    """
+    try:
+        profiles = Profile.objects.filter(admin_id=admin_id)
+
+        async def build():
+            return [ProfileSerializer(profile).data async for profile in profiles]
+
+        return await acached_response(request, f"profiles-by-admin:{admin_id}", build)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=400)
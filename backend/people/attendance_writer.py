@@ -0,0 +1,237 @@
+import atexit
+import datetime
+import glob
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .caching import invalidate
+from .models import Attendance, Profile
+from .rollups import recount_rollups, rollup_date
+
+try:
+    import fcntl
+except ImportError:
+    # no flock (Windows): spools left by dead processes are not picked up there
+    fcntl = None
+
+# Write-behind for verified check-ins: instead of one INSERT and commit per
+# check-in, rows are buffered and written with multi-row INSERTs every
+# ATTENDANCE_WRITE_BATCH_SIZE rows or ATTENDANCE_WRITE_INTERVAL seconds.
+#
+# A row is appended to an fsynced spool file before the check-in is confirmed,
+# so nothing confirmed is lost if the process dies before the flush. Each
+# process spools into its own directory under ATTENDANCE_SPOOL_DIR and holds a
+# lock on it while alive; a starting writer inserts and removes the spools of
+# directories whose lock is free. Conflicting rows (same picture, or a profile
+# already checked in within the dedup window) are skipped by the insert, so a
+# row written twice is recorded once.
+
+
+class AttendanceWriter:
+    """
+    Buffers attendance rows and writes them in batches.
+
+    Usage:
+        writer = AttendanceWriter(spool_dir, batch_size=200, interval=1.0)
+        writer.start()
+        writer.accept(profile_id, photo_url, timestamp, object_key)
+        writer.close()
+    """
+
+    def __init__(self, spool_dir, batch_size, interval):
+        self.spool_dir = spool_dir
+        self.batch_size = batch_size
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._rows = []
+        self._spool = None
+        # spool files of the buffered rows, removed once those are written
+        self._spooled = []
+        self._directory = os.path.join(spool_dir, f"{os.getpid()}-{uuid.uuid4().hex}")
+        os.makedirs(self._directory)
+        self._owner_lock = open(os.path.join(self._directory, 'lock'), 'w')
+        if fcntl is not None:
+            fcntl.flock(self._owner_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._stopped = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, name='attendance-writer', daemon=True)
+
+    def start(self):
+        """
+        Write what dead processes left spooled, then start flushing every interval.
+        """
+        try:
+            recovered = self.recover()
+            if recovered:
+                logging.warning("Recovered %d spooled attendance rows", recovered)
+        except Exception:
+            logging.exception("Could not recover spooled attendance rows")
+        self._flusher.start()
+
+    def accept(self, profile_id, photo_url, timestamp, object_key):
+        """
+        Queue a verified check-in for the next batch insert.
+
+        :param timestamp: Aware datetime the picture was taken.
+        :raises OSError: If the row could not be spooled; the check-in must not be confirmed then
+                         (it may still be written with the batch).
+        """
+        row = {'profile_id': profile_id, 'photo_url': photo_url, 'timestamp': timestamp.isoformat(),
+               'object_key': object_key}
+        with self._lock:
+            if self._spool is None:
+                path = os.path.join(self._directory, f"{uuid.uuid4().hex}.spool")
+                self._spool = open(path, 'a')
+                self._spooled.append(path)
+            self._spool.write(json.dumps(row) + '\n')
+            self._spool.flush()
+            # a flush may close the spool meanwhile; the duplicate still syncs its file
+            spool_fd = os.dup(self._spool.fileno())
+            self._rows.append(row)
+            full = len(self._rows) >= self.batch_size
+        # other check-ins are spooled while this one waits for the disk
+        try:
+            os.fsync(spool_fd)
+        finally:
+            os.close(spool_fd)
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered rows now. On a database error they stay buffered and spooled for the next flush.
+
+        :return: Number of rows written (conflicting ones are skipped by the database).
+        """
+        with self._lock:
+            rows, spooled = self._rows, self._spooled
+            if not rows:
+                return 0
+            self._rows, self._spooled = [], []
+            self._spool.close()
+            self._spool = None
+        try:
+            write_attendance(rows)
+        except Exception:
+            logging.exception("Could not write %d buffered attendance rows", len(rows))
+            with self._lock:
+                self._rows = rows + self._rows
+                self._spooled = spooled + self._spooled
+            return 0
+        for path in spooled:
+            os.remove(path)
+        return len(rows)
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(self.interval):
+            # this thread is outside any request, which is where Django recycles connections
+            close_old_connections()
+            self.flush()
+
+    def close(self):
+        """
+        Stop flushing and write what is buffered; the spool directory is removed if nothing is left in it.
+        """
+        self._stopped.set()
+        self.flush()
+        if not self._rows:
+            shutil.rmtree(self._directory, ignore_errors=True)
+        self._owner_lock.close()
+
+    def recover(self):
+        """
+        Write and remove the spools of processes that died before flushing them.
+
+        :return: Number of rows recovered.
+        """
+        if fcntl is None:
+            return 0
+        recovered = 0
+        for name in os.listdir(self.spool_dir):
+            directory = os.path.join(self.spool_dir, name)
+            if directory == self._directory or not os.path.isdir(directory):
+                continue
+            try:
+                owner_lock = open(os.path.join(directory, 'lock'), 'a')
+            except OSError:
+                # removed by another process recovering it
+                continue
+            with owner_lock:
+                try:
+                    fcntl.flock(owner_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    # the owner is alive
+                    continue
+                rows = []
+                for path in sorted(glob.glob(os.path.join(directory, '*.spool'))):
+                    rows.extend(read_spool(path))
+                if rows:
+                    write_attendance(rows)
+                shutil.rmtree(directory, ignore_errors=True)
+            recovered += len(rows)
+        return recovered
+
+
+def read_spool(path):
+    """
+    :return: The rows of a spool file, without a final line cut short by a crash.
+    """
+    rows = []
+    with open(path) as spool:
+        for line in spool:
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                logging.warning("Skipping a partly written row in %s", path)
+    return rows
+
+
+def write_attendance(rows):
+    """
+    Insert spooled attendance rows with multi-row INSERTs in one transaction and
+    recount the daily rollups they touch.
+
+    Rows conflicting with a recorded picture or dedup window are skipped, as are
+    rows of profiles deleted since their check-in was verified.
+    """
+    window = settings.CHECKIN_DEDUP_WINDOW_SECONDS
+    profile_ids = set(Profile.objects.filter(profile_id__in={row['profile_id'] for row in rows})
+                      .values_list('profile_id', flat=True))
+    attendance = []
+    for row in rows:
+        if row['profile_id'] not in profile_ids:
+            continue
+        timestamp = datetime.datetime.fromisoformat(row['timestamp'])
+        attendance.append(Attendance(profile_id=row['profile_id'], photo_url=row['photo_url'], timestamp=timestamp,
+                                     dedup_window=int(timestamp.timestamp()) // window if window > 0 else None,
+                                     object_key=row['object_key']))
+    with transaction.atomic():
+        Attendance.objects.bulk_create(attendance, batch_size=settings.ATTENDANCE_WRITE_BATCH_SIZE,
+                                       ignore_conflicts=True)
+        admin_ids = recount_rollups({(row.profile_id, rollup_date(row.timestamp)) for row in attendance})
+        # bulk inserts send no post_save signals
+        invalidate(*(f"attendance:{admin_id}" for admin_id in admin_ids))
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_attendance_writer():
+    """
+    :return: This process's AttendanceWriter, started on first use and flushed at exit.
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = AttendanceWriter(settings.ATTENDANCE_SPOOL_DIR, settings.ATTENDANCE_WRITE_BATCH_SIZE,
+                                       settings.ATTENDANCE_WRITE_INTERVAL)
+            _writer.start()
+            atexit.register(_writer.close)
+        return _writer
@@ -0,0 +1,130 @@
+import datetime
+import hashlib
+import threading
+
+import boto3
+
+# Refresh temporary credentials this long before Cognito says they expire
+CREDENTIALS_REFRESH_MARGIN = datetime.timedelta(minutes=5)
+MAX_CACHED_IDENTITIES = 1024
+
+# Process-wide cache shared by all gunicorn threads:
+# (identity pool, user pool, token subject) -> credentials and the clients built from them
+_identity_cache = {}
+_cognito_clients = {}
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _is_fresh(entry, now):
+    return entry["expiration"] - CREDENTIALS_REFRESH_MARGIN > now
+
+
+def _get_cognito_client(region):
+    with _lock:
+        if region not in _cognito_clients:
+            _cognito_clients[region] = boto3.session.Session().client(
+                "cognito-identity", region_name=region)
+        return _cognito_clients[region]
+
+
+def _fetch_credentials(region, identity_pool_id, user_pool_id, id_token):
+    client = _get_cognito_client(region)
+    logins = {
+        'cognito-idp.' + region + '.amazonaws.com/' + user_pool_id: id_token
+    }
+    identity_response = client.get_id(
+        IdentityPoolId=identity_pool_id,
+        Logins=logins
+    )
+    response = client.get_credentials_for_identity(
+        IdentityId=identity_response['IdentityId'],
+        Logins=logins
+    )
+    return response['Credentials']
+
+
+def get_aws_clients(region, identity_pool_id, user_pool_id, id_token, subject):
+    """
+    Get S3 and Lambda clients authorised with the Cognito identity behind an ID token.
+
+    Temporary credentials and the clients built from them are cached per identity
+    pool, user pool and token subject until shortly before they expire.
+
+    :param region: Cognito region.
+    :param identity_pool_id: Cognito identity pool ID.
+    :param user_pool_id: Cognito user pool ID.
+    :param id_token: The user's ID token.
+    :param subject: The 'sub' claim of id_token.
+    :return: (s3_client, lambda_client) tuple.
+    """
+    key = (identity_pool_id, user_pool_id, subject)
+    # The token is not verified locally, so a cached entry is only reused for the
+    # exact token Cognito accepted; a new token for the same user refreshes it.
+    token_hash = hashlib.sha256(id_token.encode()).hexdigest()
+    now = _now()
+
+    with _lock:
+        cached = _identity_cache.get(key)
+        if cached and cached["token_hash"] == token_hash and _is_fresh(cached, now):
+            _stats["hits"] += 1
+            return cached["s3"], cached["lambda"]
+        _stats["misses"] += 1
+
+    credentials = _fetch_credentials(region, identity_pool_id, user_pool_id, id_token)
+    session = boto3.session.Session(
+        aws_access_key_id=credentials['AccessKeyId'],
+        aws_secret_access_key=credentials['SecretKey'],
+        aws_session_token=credentials['SessionToken']
+    )
+    s3_client = session.client('s3')
+    lambda_client = session.client('lambda', region_name='ca-central-1')
+
+    with _lock:
+        if len(_identity_cache) >= MAX_CACHED_IDENTITIES:
+            for stale_key in [k for k, v in _identity_cache.items() if not _is_fresh(v, now)]:
+                del _identity_cache[stale_key]
+            if len(_identity_cache) >= MAX_CACHED_IDENTITIES:
+                _identity_cache.clear()
+        _identity_cache[key] = {
+            "token_hash": token_hash,
+            "expiration": credentials['Expiration'],
+            "s3": s3_client,
+            "lambda": lambda_client,
+        }
+
+    return s3_client, lambda_client
+
+
+def get_cache_stats():
+    """
+    :return: Credential cache hits, misses and hit rate since the process started.
+    """
+    with _lock:
+        total = _stats["hits"] + _stats["misses"]
+        return {
+            "hits": _stats["hits"],
+            "misses": _stats["misses"],
+            "hit_rate": _stats["hits"] / total if total else 0.0,
+            "size": len(_identity_cache),
+        }
+
+
+def render_cache_metrics():
+    """
+    :return: The credential cache counters in the Prometheus text exposition format.
+    """
+    stats = get_cache_stats()
+    return '\n'.join([
+        '# HELP aws_credential_cache_lookups_total Credential cache lookups by check-ins, by result.',
+        '# TYPE aws_credential_cache_lookups_total counter',
+        f'aws_credential_cache_lookups_total{{result="hit"}} {stats["hits"]}',
+        f'aws_credential_cache_lookups_total{{result="miss"}} {stats["misses"]}',
+        '# HELP aws_credential_cache_identities Identities with cached credentials.',
+        '# TYPE aws_credential_cache_identities gauge',
+        f'aws_credential_cache_identities {stats["size"]}',
+    ]) + '\n'
@@ -0,0 +1,428 @@
+import base64
+import contextlib
+import datetime
+import importlib.util
+import io
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+
+from . import aws_clients
+from .caching import invalidate
+from .checkin_keys import new_checkin_key, object_url
+from .models import Attendance, AttendanceDailyRollup, Profile
+from .rollups import rebuild_rollups
+
+# Benchmark harness for the check-in path. AWS services are replaced by
+# in-process stand-ins that sleep for a configurable latency, the database is
+# whatever DATABASES points at (a local MySQL, or SQLite with DB_ENGINE), and
+# each scenario reports throughput, latency percentiles and query counts as JSON.
+
+BENCH_ADMIN_ID = 'bench-admin'
+ATTENDANCE_BUCKET = 'bench-attendance'
+PROFILE_BUCKET = 'bench-profiles'
+
+# Seconds each stand-in sleeps per call
+DEFAULT_LATENCY = {'cognito': 0.05, 's3': 0.03, 'lambda': 0.4, 'rekognition': 0.15, 'db': 0.001}
+
+
+def parse_latency(value):
+    """
+    Parse 'service=seconds,...' (e.g. 's3=0.05,lambda=0.3') over the default latencies.
+    """
+    latency = dict(DEFAULT_LATENCY)
+    for part in filter(None, (value or '').split(',')):
+        service, _, seconds = part.partition('=')
+        if service not in latency:
+            raise ValueError(f"Unknown service '{service}', expected one of {', '.join(latency)}")
+        latency[service] = float(seconds)
+    return latency
+
+
+class FakeCognitoClient:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def get_id(self, IdentityPoolId, Logins):
+        time.sleep(self.latency['cognito'])
+        return {'IdentityId': 'bench-identity'}
+
+    def get_credentials_for_identity(self, IdentityId, Logins):
+        time.sleep(self.latency['cognito'])
+        return {'Credentials': {
+            'AccessKeyId': 'bench', 'SecretKey': 'bench', 'SessionToken': 'bench',
+            'Expiration': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1),
+        }}
+
+
+class FakeS3Client:
+    def __init__(self, latency):
+        self.latency = latency
+        self.objects = {}
+
+    def upload_fileobj(self, file_obj, bucket, key, ExtraArgs=None):
+        time.sleep(self.latency['s3'])
+        self.objects[(bucket, key)] = len(file_obj.read())
+
+    def get_object(self, Bucket, Key):
+        time.sleep(self.latency['s3'])
+        return {'Body': io.BytesIO(b'')}
+
+
+class FakeLambdaClient:
+    """Answers every verification with a match after the configured Lambda latency."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        time.sleep(self.latency['lambda'])
+        event = json.loads(Payload)
+        result = {'statusCode': 200, 'status': 'success', 'body': 'Face match successful, attendance recorded',
+                  'timings': {'rekognition_compare_faces': self.latency['lambda'] * 1000}}
+        if 'paths' in event:
+            result['results'] = [dict(result) for _ in event['paths']]
+        return {'Payload': io.BytesIO(json.dumps(result).encode())}
+
+
+class FakeRekognitionClient:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def detect_faces(self, Image):
+        time.sleep(self.latency['rekognition'])
+        return {'FaceDetails': [{'BoundingBox': {'Width': 0.4, 'Height': 0.5, 'Left': 0.3, 'Top': 0.2},
+                                 'Confidence': 99.9}]}
+
+    def compare_faces(self, **kwargs):
+        time.sleep(self.latency['rekognition'])
+        return {'FaceMatches': [{'Similarity': 99.0}]}
+
+
+class FakeBoto3:
+    """Stands in for the boto3 module as used by people.aws_clients."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.session = self
+
+    def Session(self, **credentials):
+        return self
+
+    def client(self, service, **kwargs):
+        return {
+            'cognito-identity': FakeCognitoClient,
+            's3': FakeS3Client,
+            'lambda': FakeLambdaClient,
+        }[service](self.latency)
+
+
+class FakeLambdaCursor:
+    def __init__(self, latency, profile_image):
+        self.latency = latency
+        self.profile_image = profile_image
+        self.query = ''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, args=None):
+        time.sleep(self.latency['db'])
+        self.query = query
+
+    def executemany(self, query, rows):
+        time.sleep(self.latency['db'])
+        return len(rows)
+
+    def fetchone(self):
+        return (self.profile_image, 1, None) if 'people_profile' in self.query else None
+
+    def fetchall(self):
+        return []
+
+
+class FakeLambdaConnection:
+    """pymysql stand-in for the Lambda when the benchmark database is not MySQL."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def cursor(self):
+        return FakeLambdaCursor(
+            self.latency, f"https://{PROFILE_BUCKET}.s3.ca-central-1.amazonaws.com/{BENCH_ADMIN_ID}/profile.jpg")
+
+    def ping(self, reconnect=False):
+        pass
+
+    def begin(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def make_test_image(width=1280, height=720):
+    image = Image.new('RGB', (width, height), (90, 120, 160))
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=90)
+    return output.getvalue()
+
+
+def make_id_token(subject):
+    payload = base64.urlsafe_b64encode(json.dumps({'sub': subject}).encode()).decode().rstrip('=')
+    return f"bench.{payload}.bench"
+
+
+def clear_bench_data(admin_id=BENCH_ADMIN_ID):
+    # raw delete: the ORM would load every row to send post_delete signals
+    table = connection.ops.quote_name(Attendance._meta.db_table)
+    profile_table = connection.ops.quote_name(Profile._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE profile_id IN "
+                       f"(SELECT profile_id FROM {profile_table} WHERE admin_id = %s)", [admin_id])
+    AttendanceDailyRollup.objects.filter(admin_id=admin_id).delete()
+    Profile.objects.filter(admin_id=admin_id).delete()
+
+
+def seed_attendance(rows, profiles=100, admin_id=BENCH_ADMIN_ID, days=365, batch_size=10000):
+    """
+    Replace the benchmark admin's data with `profiles` profiles and `rows` attendance
+    records spread evenly over the last `days` days, then rebuild their rollups.
+
+    :return: Seconds spent seeding.
+    """
+    started = time.perf_counter()
+    clear_bench_data(admin_id)
+    Profile.objects.bulk_create([
+        Profile(profile_id=f"{admin_id}-{i}", profile_name=f"Bench {i}", admin_id=admin_id,
+                profile_image=f"https://{PROFILE_BUCKET}.s3.ca-central-1.amazonaws.com/{admin_id}/{i}.jpg")
+        for i in range(profiles)
+    ])
+
+    # raw executemany: no model instance per row, which adds up at benchmark sizes
+    table = connection.ops.quote_name(Attendance._meta.db_table)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    step = datetime.timedelta(days=days) / max(rows, 1)
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(0, rows, batch_size):
+            cursor.executemany(
+                f"INSERT INTO {table} (profile_id, photo_url, timestamp, dedup_window) VALUES (%s, %s, %s, NULL)",
+                [(f"{admin_id}-{i % profiles}",
+                  f"https://{ATTENDANCE_BUCKET}.s3.ca-central-1.amazonaws.com/{admin_id}/{i}.jpg",
+                  connection.ops.adapt_datetimefield_value(now - step * i))
+                 for i in range(start, min(start + batch_size, rows))])
+    rebuild_rollups(admin_id)
+    # bulk and raw inserts send no post_save signals
+    invalidate(f"profiles-by-admin:{admin_id}", f"attendance:{admin_id}")
+    return time.perf_counter() - started
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def summarize(latencies, queries, errors, wall_seconds):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'wall_seconds': round(wall_seconds, 3),
+        'throughput_rps': round(len(latencies) / wall_seconds, 2) if wall_seconds else None,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+            **{name: round(_percentile(latencies, q) * 1000, 2) if latencies else None
+               for name, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99), ('max', 1.0))},
+        },
+        'queries': {
+            'mean': round(sum(queries) / len(queries), 2) if queries else None,
+            'max': max(queries) if queries else None,
+        },
+    }
+
+
+def run_concurrently(requests, concurrency, call, cleanup=None):
+    """
+    Run call(worker_state, index) `requests` times on `concurrency` threads.
+
+    call returns True on success. Each worker thread gets its own state dict and
+    database connection; cleanup(worker_state) runs when the worker is done.
+
+    :return: Summary dict (see summarize).
+    """
+    latencies, queries, lock = [], [], threading.Lock()
+    errors = 0
+    next_index = iter(range(requests))
+
+    def worker():
+        nonlocal errors
+        state = {}
+        try:
+            while True:
+                with lock:
+                    index = next(next_index, None)
+                if index is None:
+                    return
+                with CaptureQueriesContext(connections['default']) as captured:
+                    start = time.perf_counter()
+                    try:
+                        ok = call(state, index)
+                    except Exception:
+                        ok = False
+                    elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+                    queries.append(len(captured))
+                    errors += 0 if ok else 1
+        finally:
+            if cleanup is not None:
+                cleanup(state)
+            connections.close_all()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    return summarize(latencies, queries, errors, time.perf_counter() - started)
+
+
+def bench_checkin(requests, concurrency, latency, profiles=100, admin_id=BENCH_ADMIN_ID):
+    """
+    Drive upload_attendance_picture end to end against the AWS stand-ins.
+    """
+    image = 'data:image/jpeg;base64,' + base64.b64encode(make_test_image()).decode()
+
+    def call(state, index):
+        client = state.setdefault('client', Client())
+        body = {
+            'image': image,
+            'profileID': f"{admin_id}-{index % profiles}",
+            # one user per worker thread, so the credential cache sees repeat users
+            'idToken': make_id_token(f"{admin_id}-user-{threading.get_ident()}"),
+            'region': 'ca-central-1', 'identityPoolId': 'bench-pool', 'userPoolId': 'bench-user-pool',
+        }
+        response = client.post('/api/upload_attendance_picture/', json.dumps(body), content_type='application/json')
+        return response.status_code == 200 and response.json().get('status') == 'success'
+
+    aws_clients._identity_cache.clear()
+    aws_clients._cognito_clients.clear()
+    try:
+        with mock.patch.object(aws_clients, 'boto3', FakeBoto3(latency)), \
+                override_settings(CHECKIN_DEDUP_WINDOW_SECONDS=0, CHECKIN_ASYNC=False):
+            return run_concurrently(requests, concurrency, call)
+    finally:
+        aws_clients._identity_cache.clear()
+        aws_clients._cognito_clients.clear()
+
+
+def bench_attendance_list(requests, concurrency, page_size=100, cold_cache=False, admin_id=BENCH_ADMIN_ID):
+    """
+    Read the attendance list, one keyset page (page_size rows) per request; 0 reads the full list.
+
+    With cold_cache the response cache is cleared before every request.
+    """
+    params = {'limit': page_size} if page_size else {}
+
+    def call(state, index):
+        client = state.setdefault('client', Client())
+        if cold_cache:
+            cache.clear()
+        response = client.get(f'/api/attendance/{admin_id}/', params)
+        return response.status_code == 200
+
+    return run_concurrently(requests, concurrency, call)
+
+
+def load_lambda_module():
+    """
+    Load a fresh copy of the Lambda module, standing in for one warm container.
+
+    The Lambda lives in backend/lambda, which is not an importable package name.
+    """
+    path = os.path.join(settings.BASE_DIR, 'lambda', 'lambda_function.py')
+    spec = importlib.util.spec_from_file_location('bench_lambda_function', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench_lambda(requests, concurrency, latency, profiles=100, admin_id=BENCH_ADMIN_ID):
+    """
+    Drive lambda_handler with one module copy (container) per worker thread.
+
+    Rekognition is always a stand-in. The database is the benchmark MySQL when
+    DATABASES points at one, otherwise a stand-in with the configured latency.
+    """
+    database = settings.DATABASES['default']
+    use_mysql = connection.vendor == 'mysql'
+    os.environ.update(BUCKET1_NAME=ATTENDANCE_BUCKET, BUCKET2_NAME=PROFILE_BUCKET)
+    if use_mysql:
+        os.environ.update(DB_HOST=database['HOST'] or 'localhost', DB_USER=database['USER'],
+                          DB_PASSWORD=database['PASSWORD'], DB_NAME=database['NAME'])
+    base = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+
+    def call(state, index):
+        container = state.get('lambda')
+        if container is None:
+            container = state['lambda'] = load_lambda_module()
+            container.CHECKIN_DEDUP_WINDOW_SECONDS = 0
+            container._rekognition_client = FakeRekognitionClient(latency)
+            if not use_mysql:
+                container._db_connection = FakeLambdaConnection(latency)
+        # one picture per second of simulated time
+        checkin_key = new_checkin_key(admin_id, f"{admin_id}-{index % profiles}",
+                                      base + datetime.timedelta(seconds=index))
+        path = object_url(ATTENDANCE_BUCKET, checkin_key.key)
+        result = container.lambda_handler({'path': path}, None)
+        return result['status'] == 'success'
+
+    def cleanup(state):
+        if 'lambda' in state:
+            state['lambda'].reset_db_connection()
+
+    try:
+        return run_concurrently(requests, concurrency, call, cleanup)
+    finally:
+        if use_mysql:
+            # remove the check-ins recorded during the run, leaving the seeded rows
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {connection.ops.quote_name(Attendance._meta.db_table)} "
+                    f"WHERE photo_url LIKE %s", [f"https://{ATTENDANCE_BUCKET}.s3.%/{admin_id}/attendance_%"])
+            rebuild_rollups(admin_id)
+
+
+SCENARIOS = ('checkin', 'attendance_list', 'lambda')
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the print logging of the views and the Lambda, and the stage timing lines, while a scenario runs."""
+    stage_timings = logging.getLogger('people.metrics')
+    disabled, stage_timings.disabled = stage_timings.disabled, True
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        stage_timings.disabled = disabled
@@ -0,0 +1,90 @@
+import hashlib
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.http import HttpResponseNotModified, JsonResponse
+from rest_framework.response import Response
+
+from .models import ResponseVersion
+
+# Read endpoints cache their response data per scope (an admin_id or profile_id)
+# and query string. Each scope has a version counter in the database that every
+# write to its data bumps, in the same transaction: ORM writes through signals,
+# bulk writers by calling invalidate, and the Lambda in its raw SQL insert. A
+# request reads that one counter by primary key; cache entries and ETags are
+# keyed on it, so nothing stale is served and a hit costs no scan of the data.
+
+
+def invalidate(*scopes):
+    """
+    Bump the versions of the given scopes, e.g. 'attendance:<admin_id>', so their cached responses are dropped.
+    """
+    if not scopes:
+        return
+    # a scope without a row is at version 1
+    ResponseVersion.objects.bulk_create([ResponseVersion(scope=scope) for scope in set(scopes)], ignore_conflicts=True)
+    ResponseVersion.objects.filter(scope__in=scopes).update(version=F('version') + 1)
+
+
+def response_version(scope):
+    return ResponseVersion.objects.filter(scope=scope).values_list('version', flat=True).first() or 1
+
+
+async def aresponse_version(scope):
+    return await ResponseVersion.objects.filter(scope=scope).values_list('version', flat=True).afirst() or 1
+
+
+def _etag_and_params(query_params, scope, version):
+    params = urlencode(sorted(query_params.items()))
+    etag = '"' + hashlib.md5(f"{scope}|{params}|{version}".encode()).hexdigest() + '"'
+    return etag, params
+
+
+def _entry_key(scope, version, params):
+    return f"response:{scope}:{version}:" + hashlib.md5(params.encode()).hexdigest()
+
+
+def cached_response(request, scope, build):
+    """
+    Serve build() for a read endpoint through the response cache, with ETag support.
+
+    :param request: The DRF request; its query string is part of the cache key.
+    :param scope: Invalidation scope of the response, e.g. 'profiles-by-admin:<admin_id>'.
+    :param build: Function returning the response data on a cache miss.
+    :return: 304 if the client's If-None-Match matches, else a 200 Response with an ETag.
+    """
+    version = response_version(scope)
+    etag, params = _etag_and_params(request.query_params, scope, version)
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers={'ETag': etag})
+
+    key = _entry_key(scope, version, params)
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, settings.RESPONSE_CACHE_TIMEOUT)
+
+    return Response(data, status=200, headers={'ETag': etag})
+
+
+async def acached_response(request, scope, build):
+    """
+    Async version of cached_response for plain Django async views.
+
+    :param build: Coroutine function returning the response data on a cache miss.
+    :return: 304 HttpResponse or 200 JsonResponse, with an ETag.
+    """
+    version = await aresponse_version(scope)
+    etag, params = _etag_and_params(request.GET, scope, version)
+    if etag in request.headers.get('If-None-Match', ''):
+        return HttpResponseNotModified(headers={'ETag': etag})
+
+    key = _entry_key(scope, version, params)
+    data = await cache.aget(key)
+    if data is None:
+        data = await build()
+        await cache.aset(key, data, settings.RESPONSE_CACHE_TIMEOUT)
+
+    return JsonResponse(data, safe=False, headers={'ETag': etag})
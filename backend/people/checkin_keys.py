@@ -0,0 +1,6 @@
+# The attendance picture key format lives in backend/lambda/checkin_keys.py,
+# which is deployed with the Lambda; settings puts backend/lambda on the path,
+# so this process (and a Lambda module loaded by the benchmark) imports that file.
+
+from checkin_keys import (CheckinKey, CheckinKeyError, key_from_url, new_checkin_key,  # noqa: F401
+                          new_group_key, new_identification_key, object_url, parse_checkin_key)
@@ -0,0 +1,123 @@
+import calendar
+import datetime
+import zoneinfo
+
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Attendance, Profile
+
+# Series for the dashboard charts, each computed with one grouped query over an
+# admin's attendance instead of shipping the full history to the browser.
+# Days are calendar days in the viewer's time zone; on MySQL, named zones need
+# the time zone tables to be loaded (mysql_tzinfo_to_sql).
+
+# Attendance-rate buckets of the pie chart, as (label, lowest rate in percent)
+RATE_BUCKETS = (('90-100%', 90), ('70-90%', 70), ('50-70%', 50), ('<50%', 0))
+
+
+def dashboard_timezone(name=None):
+    """
+    :param name: IANA time zone name, e.g. 'America/Vancouver'; the server's zone if empty.
+    :raises ValueError: If the zone is unknown.
+    """
+    if not name:
+        return timezone.get_current_timezone()
+    try:
+        return zoneinfo.ZoneInfo(name)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown time zone: {name}")
+
+
+def _day_range(first_day, last_day, tz):
+    """
+    :return: (start, end) aware datetimes covering first_day to last_day inclusive in tz.
+    """
+    start = datetime.datetime.combine(first_day, datetime.time.min, tzinfo=tz)
+    end = datetime.datetime.combine(last_day + datetime.timedelta(days=1), datetime.time.min, tzinfo=tz)
+    return start, end
+
+
+def _present_by_day(admin_id, tz, first_day, last_day):
+    """
+    :return: {date: number of distinct profiles that checked in that day}.
+    """
+    start, end = _day_range(first_day, last_day, tz)
+    rows = (Attendance.objects
+            .filter(profile__admin_id=admin_id, timestamp__gte=start, timestamp__lt=end)
+            .annotate(date=TruncDate('timestamp', tzinfo=tz))
+            .values('date')
+            .annotate(present=Count('profile_id', distinct=True))
+            .order_by())
+    return {row['date']: row['present'] for row in rows}
+
+
+def attendance_trend(admin_id, tz, days=10, today=None):
+    """
+    Attended and absent profiles for each of the last `days` days, ending today.
+
+    :return: {'profile_count', 'days': [{'date', 'attended', 'not_attended'}]}, oldest day first.
+    """
+    today = today or timezone.now().astimezone(tz).date()
+    first_day = today - datetime.timedelta(days=days - 1)
+    profile_count = Profile.objects.filter(admin_id=admin_id).count()
+    present = _present_by_day(admin_id, tz, first_day, today)
+    series = []
+    for offset in range(days):
+        day = first_day + datetime.timedelta(days=offset)
+        attended = present.get(day, 0)
+        series.append({'date': day.isoformat(), 'attended': attended,
+                       'not_attended': max(profile_count - attended, 0)})
+    return {'profile_count': profile_count, 'days': series}
+
+
+def monthly_heatmap(admin_id, tz, year=None, month=None):
+    """
+    Profiles present on each day of a month (default the current one) with the
+    calendar position of the day: weekday 0 is Sunday, weeks start at 1.
+
+    :return: {'month': 'YYYY-MM', 'days': [{'date', 'count', 'weekday', 'week', 'future'}]}
+    """
+    today = timezone.now().astimezone(tz).date()
+    year, month = year or today.year, month or today.month
+    first_day = datetime.date(year, month, 1)
+    last_day = first_day.replace(day=calendar.monthrange(year, month)[1])
+    present = _present_by_day(admin_id, tz, first_day, last_day)
+    # Python counts weekdays from Monday, the chart from Sunday
+    first_weekday = (first_day.weekday() + 1) % 7
+    series = []
+    for day_of_month in range(1, last_day.day + 1):
+        day = first_day.replace(day=day_of_month)
+        series.append({
+            'date': day.isoformat(),
+            'count': present.get(day, 0),
+            'weekday': (day.weekday() + 1) % 7,
+            'week': (day_of_month + first_weekday - 1) // 7 + 1,
+            'future': day > today,
+        })
+    return {'month': f"{year:04d}-{month:02d}", 'days': series}
+
+
+def attendance_rate_distribution(admin_id, tz, days=30, today=None):
+    """
+    How many profiles fall in each attendance-rate bucket, where a profile's rate is
+    the share of the last `days` days (ending today) it checked in on.
+
+    :return: {'days', 'profile_count', 'buckets': [{'label', 'value'}]} in RATE_BUCKETS order.
+    """
+    today = today or timezone.now().astimezone(tz).date()
+    start, end = _day_range(today - datetime.timedelta(days=days - 1), today, tz)
+    in_window = Q(attendance__timestamp__gte=start, attendance__timestamp__lt=end)
+    days_present = (Profile.objects.filter(admin_id=admin_id)
+                    .annotate(days_present=Count(TruncDate('attendance__timestamp', tzinfo=tz),
+                                                 filter=in_window, distinct=True))
+                    .values_list('days_present', flat=True))
+    counts = dict.fromkeys((label for label, _ in RATE_BUCKETS), 0)
+    total = 0
+    for present in days_present:
+        rate = present * 100 / days
+        counts[next(label for label, lowest in RATE_BUCKETS if rate >= lowest)] += 1
+        total += 1
+    return {'days': days, 'profile_count': total,
+            'buckets': [{'label': label, 'value': counts[label]} for label, _ in RATE_BUCKETS]}
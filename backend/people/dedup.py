@@ -0,0 +1,97 @@
+import datetime
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import Attendance, CheckIn
+
+# Bounded TTL index of profiles with a recent accepted check-in, so repeat
+# presses are rejected before any S3 upload or Rekognition call. It is local to
+# the process; on a miss the database is asked, and a unique
+# (profile, dedup_window) key on Attendance catches races that slip through.
+MAX_RECENT_CHECKINS = 10000
+
+_recent = OrderedDict()
+_lock = threading.Lock()
+
+
+def remember_checkin(profile_id, when=None):
+    """
+    Record an accepted check-in for profile_id, starting its dedup window.
+    """
+    window = settings.CHECKIN_DEDUP_WINDOW_SECONDS
+    if window <= 0:
+        return
+    expires = (when or time.time()) + window
+    with _lock:
+        _recent[profile_id] = expires
+        _recent.move_to_end(profile_id)
+        while len(_recent) > MAX_RECENT_CHECKINS:
+            _recent.popitem(last=False)
+
+
+def _remembered(profile_id, now):
+    """
+    :return: True/False if the in-process index knows the answer, None if the database must be asked.
+    """
+    with _lock:
+        expires = _recent.get(profile_id)
+        if expires is not None:
+            if expires > now:
+                return True
+            del _recent[profile_id]
+    return None
+
+
+def _recent_checkins(profile_id, now):
+    since = datetime.datetime.fromtimestamp(now - settings.CHECKIN_DEDUP_WINDOW_SECONDS, datetime.timezone.utc)
+    attendance = (Attendance.objects.filter(profile_id=profile_id, timestamp__gte=since)
+                  .order_by('-timestamp').values_list('timestamp', flat=True))
+    pending = (CheckIn.objects.filter(profile_id=profile_id, created_at__gte=since)
+               .exclude(status=CheckIn.FAILED)
+               .order_by('-created_at').values_list('created_at', flat=True))
+    return attendance, pending
+
+
+def is_duplicate_checkin(profile_id):
+    """
+    :return: True if profile_id already has an accepted or pending check-in in the dedup window.
+    """
+    if settings.CHECKIN_DEDUP_WINDOW_SECONDS <= 0:
+        return False
+    now = time.time()
+    remembered = _remembered(profile_id, now)
+    if remembered is not None:
+        return remembered
+
+    attendance, pending = _recent_checkins(profile_id, now)
+    latest = attendance.first()
+    if latest is None:
+        latest = pending.first()
+    if latest is None:
+        return False
+    remember_checkin(profile_id, latest.timestamp())
+    return True
+
+
+async def ais_duplicate_checkin(profile_id):
+    """
+    Async version of is_duplicate_checkin for the ASGI views.
+    """
+    if settings.CHECKIN_DEDUP_WINDOW_SECONDS <= 0:
+        return False
+    now = time.time()
+    remembered = _remembered(profile_id, now)
+    if remembered is not None:
+        return remembered
+
+    attendance, pending = _recent_checkins(profile_id, now)
+    latest = await attendance.afirst()
+    if latest is None:
+        latest = await pending.afirst()
+    if latest is None:
+        return False
+    remember_checkin(profile_id, latest.timestamp())
+    return True
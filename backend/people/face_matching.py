@@ -0,0 +1,142 @@
+import io
+import logging
+
+import boto3
+import numpy as np
+from botocore.exceptions import BotoCoreError, ClientError
+from django.conf import settings
+
+
+def compute_face_embedding(image_bytes):
+    """
+    Compute the face embedding of the first face found in an image.
+
+    :param image_bytes: Encoded image (JPEG/PNG) as bytes.
+    :return: float32 numpy vector, or None if no face was found.
+    """
+    # face_recognition (dlib) is only required for the embedding backend
+    import face_recognition
+    image = face_recognition.load_image_file(io.BytesIO(image_bytes))
+    encodings = face_recognition.face_encodings(image)
+    if not encodings:
+        return None
+    return np.asarray(encodings[0], dtype=np.float32)
+
+
+def split_s3_url(url):
+    """
+    Split an S3 object URL of the form https://<bucket>.s3.<region>.amazonaws.com/<key>.
+
+    :param url: S3 object URL.
+    :return: (bucket, key) tuple.
+    """
+    host, key = url.split("://", 1)[-1].split("/", 1)
+    return host.split(".s3.")[0], key
+
+
+def store_profile_embedding(profile, client=None, embed=compute_face_embedding, save=True):
+    """
+    Compute and save the face embedding for a profile's current profile_image.
+
+    Does nothing unless FACE_MATCHER_BACKEND is 'embedding'. Failures are logged
+    and leave the embedding empty, so the Lambda falls back to Rekognition.
+
+    :param profile: Profile instance whose profile_image was just written.
+    :param client: Optional S3 client used to fetch the image.
+    :param embed: Function turning image bytes into an embedding.
+    :param save: False only sets face_embedding, for the caller to save in bulk with updated_at.
+    :return: Whether face_embedding was set.
+    """
+    if settings.FACE_MATCHER_BACKEND != 'embedding':
+        return False
+
+    embedding = None
+    try:
+        if client is None:
+            client = boto3.client('s3', region_name=settings.FACE_MATCHING_REGION)
+        bucket, key = split_s3_url(profile.profile_image)
+        image_bytes = client.get_object(Bucket=bucket, Key=key)['Body'].read()
+        embedding = embed(image_bytes)
+        if embedding is None:
+            logging.warning(f"No face detected in profile image of {profile.profile_id}")
+    except (BotoCoreError, ClientError, ImportError, ValueError, OSError, RuntimeError) as e:
+        # OSError: unreadable image; RuntimeError: dlib
+        logging.error(f"Could not compute face embedding for {profile.profile_id}: {e}")
+
+    profile.face_embedding = embedding.tobytes() if embedding is not None else None
+    if save:
+        # updated_at tells the Lambda's identification gallery the embedding changed
+        profile.save(update_fields=['face_embedding', 'updated_at'])
+    return True
+
+
+def face_collection_id(admin_id):
+    """
+    :return: Name of the Rekognition face collection holding an admin's enrolled profiles.
+    """
+    return f"{settings.FACE_COLLECTION_PREFIX}{admin_id}"
+
+
+def index_profile_face(profile, client=None, save=True):
+    """
+    Enroll a profile's current profile_image in its admin's Rekognition face
+    collection, replacing the face indexed for a previous image.
+
+    Does nothing unless FACE_IDENTIFICATION is on with the 'rekognition' backend
+    (the embedding backend identifies from the stored embeddings instead).
+    Failures are logged and leave the profile out of identification.
+
+    :param profile: Profile instance whose profile_image was just written.
+    :param client: Optional Rekognition client.
+    :param save: False only sets face_id, for the caller to save in bulk with updated_at.
+    :return: Whether face_id was set.
+    """
+    if not settings.FACE_IDENTIFICATION or settings.FACE_MATCHER_BACKEND != 'rekognition':
+        return False
+
+    collection_id = face_collection_id(profile.admin_id)
+    face_id = None
+    try:
+        if client is None:
+            client = boto3.client('rekognition', region_name=settings.FACE_MATCHING_REGION)
+        if profile.face_id:
+            client.delete_faces(CollectionId=collection_id, FaceIds=[profile.face_id])
+        bucket, key = split_s3_url(profile.profile_image)
+
+        def index():
+            return client.index_faces(CollectionId=collection_id, Image={'S3Object': {'Bucket': bucket, 'Name': key}},
+                                      MaxFaces=1, QualityFilter='AUTO', DetectionAttributes=[])
+        try:
+            response = index()
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ResourceNotFoundException':
+                raise
+            # first profile of this admin
+            client.create_collection(CollectionId=collection_id)
+            response = index()
+        if response['FaceRecords']:
+            face_id = response['FaceRecords'][0]['Face']['FaceId']
+        else:
+            logging.warning(f"No face indexed for profile image of {profile.profile_id}")
+    except (BotoCoreError, ClientError, ValueError) as e:
+        # best effort: the profile is saved already
+        logging.error(f"Could not index face for {profile.profile_id}: {e}")
+
+    profile.face_id = face_id
+    if save:
+        profile.save(update_fields=['face_id', 'updated_at'])
+    return True
+
+
+def remove_profile_face(profile, client=None):
+    """
+    Remove a deleted profile's face from its admin's face collection, if it was enrolled.
+    """
+    if not profile.face_id or not settings.FACE_IDENTIFICATION:
+        return
+    try:
+        if client is None:
+            client = boto3.client('rekognition', region_name=settings.FACE_MATCHING_REGION)
+        client.delete_faces(CollectionId=face_collection_id(profile.admin_id), FaceIds=[profile.face_id])
+    except (BotoCoreError, ClientError) as e:
+        logging.error(f"Could not remove face of {profile.profile_id} from its collection: {e}")
@@ -0,0 +1,80 @@
+import io
+import logging
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Margin kept around a detected face when cropping, as a fraction of the face size
+FACE_CROP_MARGIN = 0.5
+
+
+def find_face_box(image):
+    """
+    Locate the largest face in an image.
+
+    :param image: RGB PIL image.
+    :return: (left, top, right, bottom) box, or None if no face was found or
+             face_recognition is not installed.
+    """
+    try:
+        # face_recognition (dlib) is optional; without it pictures are not cropped
+        import face_recognition
+        import numpy as np
+    except ImportError:
+        logging.warning("face_recognition is not installed, skipping face crop")
+        return None
+    locations = face_recognition.face_locations(np.asarray(image))
+    if not locations:
+        return None
+    top, right, bottom, left = max(locations, key=lambda box: (box[2] - box[0]) * (box[1] - box[3]))
+    return left, top, right, bottom
+
+
+def crop_to_face(image, box):
+    left, top, right, bottom = box
+    margin_x = int((right - left) * FACE_CROP_MARGIN)
+    margin_y = int((bottom - top) * FACE_CROP_MARGIN)
+    return image.crop((max(left - margin_x, 0), max(top - margin_y, 0),
+                       min(right + margin_x, image.width), min(bottom + margin_y, image.height)))
+
+
+def normalize_image(image_bytes, max_dimension, quality, face_crop=False):
+    """
+    Orient, optionally crop, downsize and re-encode a picture for face matching.
+
+    :param image_bytes: The picture as uploaded.
+    :param max_dimension: Longest side of the result in pixels.
+    :param quality: JPEG quality of the result.
+    :param face_crop: Crop to the largest detected face before downsizing.
+    :return: (normalized JPEG bytes, stats dict with before/after byte counts and size).
+    :raises ValueError: If the bytes are not a readable image.
+    """
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        image.load()
+    except (UnidentifiedImageError, OSError):
+        raise ValueError("Attendance picture is not a readable image")
+    except Image.DecompressionBombError:
+        # not an OSError: declared dimensions far beyond any camera's
+        raise ValueError("Attendance picture is too large to decode")
+
+    original_size = image.size
+    image = ImageOps.exif_transpose(image).convert('RGB')
+    if face_crop:
+        box = find_face_box(image)
+        if box is not None:
+            image = crop_to_face(image, box)
+    image.thumbnail((max_dimension, max_dimension))
+
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=quality, optimize=True)
+    normalized = output.getvalue()
+    # an already small JPEG that needed no geometry change can come out larger
+    if image.size == original_size and len(normalized) >= len(image_bytes):
+        normalized = image_bytes
+
+    return normalized, {
+        'original_bytes': len(image_bytes),
+        'normalized_bytes': len(normalized),
+        'width': image.width,
+        'height': image.height,
+    }
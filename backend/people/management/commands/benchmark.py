@@ -0,0 +1,81 @@
+import datetime
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from people.benchmark import (BENCH_ADMIN_ID, SCENARIOS, bench_attendance_list, bench_checkin, bench_lambda,
+                              clear_bench_data, parse_latency, quiet, seed_attendance)
+
+
+class Command(BaseCommand):
+    help = ("Benchmark the check-in path against local AWS stand-ins and print the results as JSON. "
+            f"Seeds and replaces the data of admin '{BENCH_ADMIN_ID}' in the configured database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*',
+                            help=f"Scenarios to run (default: all of {', '.join(SCENARIOS)})")
+        parser.add_argument('--seed', type=int, default=0,
+                            help="Seed this many attendance rows first, e.g. 10000, 100000 or 1000000")
+        parser.add_argument('--profiles', type=int, default=100, help="Profiles the seeded rows are spread over")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per scenario and concurrency level")
+        parser.add_argument('--concurrency', default='1,8', help="Comma separated concurrency levels")
+        parser.add_argument('--latency', default='',
+                            help="Stand-in latencies in seconds, e.g. 's3=0.05,lambda=0.3,rekognition=0.1'")
+        parser.add_argument('--page-size', type=int, default=100,
+                            help="Rows per attendance list request (0 reads the full list)")
+        parser.add_argument('--cold-cache', action='store_true',
+                            help="Clear the response cache before every attendance list request")
+        parser.add_argument('--output', help="Also write the JSON report to this file")
+        parser.add_argument('--cleanup', action='store_true', help="Delete the benchmark data afterwards")
+
+    def handle(self, *args, **options):
+        try:
+            latency = parse_latency(options['latency'])
+            levels = [int(level) for level in options['concurrency'].split(',')]
+        except ValueError as e:
+            raise CommandError(e)
+        scenarios = options['scenarios'] or list(SCENARIOS)
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios {', '.join(sorted(unknown))}, expected {', '.join(SCENARIOS)}")
+
+        report = {
+            'started_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'database': connection.vendor,
+            'latency_seconds': latency,
+            'seed': None,
+            'cold_cache': options['cold_cache'],
+            'runs': [],
+        }
+        if options['seed']:
+            seconds = seed_attendance(options['seed'], options['profiles'])
+            report['seed'] = {'rows': options['seed'], 'profiles': options['profiles'], 'seconds': round(seconds, 2)}
+            self.stderr.write(f"Seeded {options['seed']} attendance rows in {seconds:.1f}s")
+
+        runs = {
+            'checkin': lambda requests, concurrency: bench_checkin(requests, concurrency, latency, options['profiles']),
+            'attendance_list': lambda requests, concurrency: bench_attendance_list(
+                requests, concurrency, options['page_size'], options['cold_cache']),
+            'lambda': lambda requests, concurrency: bench_lambda(requests, concurrency, latency, options['profiles']),
+        }
+        # the test client's 'testserver' host must pass ALLOWED_HOSTS
+        setup_test_environment()
+        try:
+            for scenario in scenarios:
+                for concurrency in levels:
+                    self.stderr.write(f"Running {scenario} at concurrency {concurrency}")
+                    with quiet():
+                        result = runs[scenario](options['requests'], concurrency)
+                    report['runs'].append({'scenario': scenario, 'concurrency': concurrency, **result})
+        finally:
+            teardown_test_environment()
+            if options['cleanup']:
+                clear_bench_data()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from people.roster import export_rows
+
+
+class Command(BaseCommand):
+    help = "Stream an admin's profiles or attendance to stdout as CSV or JSON Lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument('admin_id', help="Admin whose data to export")
+        parser.add_argument('--type', dest='kind', choices=['profiles', 'attendance'], default='profiles')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+
+    def handle(self, *args, **options):
+        for line in export_rows(options['kind'], options['admin_id'], options['format']):
+            self.stdout.write(line, ending='')
@@ -0,0 +1,48 @@
+import functools
+import json
+import os
+
+import boto3
+from django.core.management.base import BaseCommand, CommandError
+
+from people.roster import import_roster, local_image_uploader, read_roster, roster_format, s3_image_uploader
+
+
+class Command(BaseCommand):
+    help = "Create or update profiles in bulk from a CSV or JSON Lines roster and an image directory"
+
+    def add_arguments(self, parser):
+        parser.add_argument('roster', help="Roster file with profileID, profileName, adminID and image or profileImageUrl columns")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Roster format (default: from the file extension)")
+        parser.add_argument('--images', help="Directory holding the images named in the roster's image column")
+        parser.add_argument('--admin', dest='admin_id', help="adminID for rows that do not name one")
+        parser.add_argument('--bucket', default=os.getenv('PROFILE_PICTURE_BUCKET_NAME'),
+                            help="S3 bucket for profile images (default: $PROFILE_PICTURE_BUCKET_NAME)")
+        parser.add_argument('--local-store', help="Copy images into this directory instead of uploading them to S3")
+        parser.add_argument('--batch-size', type=int, default=500, help="Rows per bulk insert")
+        parser.add_argument('--workers', type=int, default=8, help="Concurrent image uploads")
+
+    def handle(self, *args, **options):
+        images = {}
+        if options['images']:
+            for name in os.listdir(options['images']):
+                images[name] = functools.partial(open, os.path.join(options['images'], name), 'rb')
+
+        upload = None
+        if options['local_store']:
+            upload = local_image_uploader(options['local_store'])
+        elif images:
+            if not options['bucket']:
+                raise CommandError("Images need --bucket, $PROFILE_PICTURE_BUCKET_NAME or --local-store")
+            upload = s3_image_uploader(options['bucket'], boto3.client('s3'))
+
+        fmt = options['format'] or roster_format(options['roster'])
+        with open(options['roster'], newline='', encoding='utf-8') as stream:
+            summary = import_roster(read_roster(stream, fmt), images, upload, options['admin_id'],
+                                    options['batch_size'], options['workers'])
+
+        for error in summary['errors']:
+            self.stderr.write(json.dumps(error))
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {summary['created']}, updated {summary['updated']}, unchanged {summary['unchanged']} "
+            f"profiles; {len(summary['errors'])} rows failed"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from people.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily attendance rollups from the raw attendance history"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--admin', dest='admin_id', help="Only rebuild rollups for this admin ID")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows per bulk insert")
+
+    def handle(self, *args, **options):
+        written = rebuild_rollups(options['admin_id'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} rollup rows"))
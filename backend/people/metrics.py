@@ -0,0 +1,158 @@
+import bisect
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Per-stage latency of the check-in path. Every request gets a StageTimer; its
+# stage durations (plus the stages the Lambda reports back) are logged as one
+# structured JSON line through the people.metrics logger and fed into process-wide histograms, which the
+# /metrics endpoint renders in the Prometheus text format. Each gunicorn worker
+# keeps its own histograms, so scrape every worker (or sum across them).
+
+# Histogram bucket bounds in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Recent samples kept per stage for the p50/p95/p99 summary
+RECENT_SAMPLES = 1000
+QUANTILES = (0.5, 0.95, 0.99)
+
+logger = logging.getLogger(__name__)
+
+_histograms = {}
+_lock = threading.Lock()
+
+
+def observe(operation, stage, seconds):
+    """
+    Record one duration for a stage of an operation, e.g. ('checkin', 's3_upload').
+    """
+    with _lock:
+        histogram = _histograms.get((operation, stage))
+        if histogram is None:
+            histogram = _histograms[(operation, stage)] = {
+                'buckets': [0] * len(BUCKETS),
+                'count': 0,
+                'sum': 0.0,
+                'recent': deque(maxlen=RECENT_SAMPLES),
+            }
+        index = bisect.bisect_left(BUCKETS, seconds)
+        if index < len(BUCKETS):
+            histogram['buckets'][index] += 1
+        histogram['count'] += 1
+        histogram['sum'] += seconds
+        histogram['recent'].append(seconds)
+
+
+def _quantile(sorted_samples, q):
+    return sorted_samples[min(int(q * len(sorted_samples)), len(sorted_samples) - 1)]
+
+
+def percentiles(operation, stage):
+    """
+    :return: {quantile: seconds} over the stage's recent samples, empty if there are none.
+    """
+    with _lock:
+        histogram = _histograms.get((operation, stage))
+        samples = sorted(histogram['recent']) if histogram else []
+    return {q: _quantile(samples, q) for q in QUANTILES} if samples else {}
+
+
+def render_metrics():
+    """
+    :return: All histograms in the Prometheus text exposition format.
+    """
+    lines = [
+        '# HELP checkin_stage_duration_seconds Duration of each stage of the check-in path.',
+        '# TYPE checkin_stage_duration_seconds histogram',
+    ]
+    summary = [
+        '# HELP checkin_stage_recent_seconds Quantiles over the most recent durations of each stage.',
+        '# TYPE checkin_stage_recent_seconds summary',
+    ]
+    with _lock:
+        items = sorted(_histograms.items())
+        snapshot = [(key, list(h['buckets']), h['count'], h['sum'], sorted(h['recent'])) for key, h in items]
+
+    for (operation, stage), buckets, count, total, samples in snapshot:
+        labels = f'operation="{operation}",stage="{stage}"'
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS, buckets):
+            cumulative += bucket_count
+            lines.append(f'checkin_stage_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'checkin_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+        lines.append(f'checkin_stage_duration_seconds_sum{{{labels}}} {total}')
+        lines.append(f'checkin_stage_duration_seconds_count{{{labels}}} {count}')
+        for q in QUANTILES:
+            if samples:
+                summary.append(f'checkin_stage_recent_seconds{{{labels},quantile="{q}"}} {_quantile(samples, q)}')
+        summary.append(f'checkin_stage_recent_seconds_sum{{{labels}}} {sum(samples)}')
+        summary.append(f'checkin_stage_recent_seconds_count{{{labels}}} {len(samples)}')
+    return '\n'.join(lines + summary) + '\n'
+
+
+def reset_metrics():
+    with _lock:
+        _histograms.clear()
+
+
+class StageTimer:
+    """
+    Times the stages of one request.
+
+    Usage:
+        timer = StageTimer('checkin')
+        with timer.stage('s3_upload'):
+            ...
+        timer.add_remote('lambda', payload_timings)
+        timer.finish(status='success')
+    """
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.started = time.perf_counter()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        # stages repeated within a request (batch uploads) add up
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def add_remote(self, prefix, timings_ms):
+        """
+        Add stage timings reported by another service in milliseconds, e.g. the Lambda's.
+        """
+        for stage, milliseconds in (timings_ms or {}).items():
+            self.record(f"{prefix}_{stage}", milliseconds / 1000)
+
+    def finish(self, **fields):
+        """
+        Feed the histograms and log the request's timings as one JSON line at INFO.
+
+        :param fields: Extra fields for the log line, e.g. status or batch size.
+        """
+        total = time.perf_counter() - self.started
+        with self._lock:
+            stages = dict(self.stages)
+        for stage, seconds in stages.items():
+            observe(self.operation, stage, seconds)
+        observe(self.operation, 'total', total)
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        logger.info(json.dumps({
+            'event': 'stage_timings',
+            'operation': self.operation,
+            'total_ms': round(total * 1000, 2),
+            'stages_ms': {stage: round(seconds * 1000, 2) for stage, seconds in stages.items()},
+            **fields,
+        }))
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 15:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0004_alter_attendance_photo_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='face_embedding',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.3 on 2026-10-18 15:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0005_profile_face_embedding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='face_analysis',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='image_version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
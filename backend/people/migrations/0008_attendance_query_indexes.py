@@ -0,0 +1,21 @@
+# Generated by Django 5.1.3 on 2026-10-18 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0007_checkin'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['profile', 'timestamp'], name='attendance_profile_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['admin_id'], name='profile_admin_idx'),
+        ),
+    ]
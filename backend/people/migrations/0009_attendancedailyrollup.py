@@ -0,0 +1,28 @@
+# Generated by Django 5.1.3 on 2026-10-18 15:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0008_attendance_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('admin_id', models.CharField(max_length=100)),
+                ('date', models.DateField()),
+                ('check_ins', models.PositiveIntegerField(default=0)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='people.profile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['admin_id', 'date'], name='rollup_admin_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('profile', 'date'), name='rollup_profile_date_unique')],
+            },
+        ),
+    ]
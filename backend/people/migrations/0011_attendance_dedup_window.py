@@ -0,0 +1,22 @@
+# Generated by Django 5.1.3 on 2026-10-18 15:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0010_profile_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendance',
+            name='dedup_window',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='attendance',
+            constraint=models.UniqueConstraint(fields=('profile', 'dedup_window'), name='attendance_dedup_unique'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.3 on 2026-10-18 16:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0011_attendance_dedup_window'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendance',
+            name='object_key',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='attendance',
+            constraint=models.UniqueConstraint(fields=('object_key',), name='attendance_object_key_unique'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.3 on 2026-10-18 15:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0012_attendance_object_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='face_id',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['admin_id', 'updated_at'], name='profile_admin_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.3 on 2026-10-18 15:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0014_attendance_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResponseVersion',
+            fields=[
+                ('scope', models.CharField(max_length=200, primary_key=True, serialize=False)),
+                ('version', models.PositiveBigIntegerField(default=1)),
+            ],
+        ),
+    ]
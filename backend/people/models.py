@@ -1,4 +1,7 @@
+import uuid
+
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
 
@@ -8,6 +11,22 @@ class Profile(models.Model):
     profile_name = models.CharField(max_length=100)
     profile_image = models.CharField(max_length=1000)
     admin_id = models.CharField(max_length=100)
+    # float32 face embedding of profile_image, used by the local matcher backend
+    face_embedding = models.BinaryField(null=True, blank=True, editable=False)
+    # bumped whenever profile_image changes; keys the Lambda's face analysis cache
+    image_version = models.PositiveIntegerField(default=1)
+    # cached detect_faces result (bounding box, confidence) for image_version
+    face_analysis = models.JSONField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # FaceId of profile_image in the admin's Rekognition face collection, for identification
+    face_id = models.CharField(max_length=64, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['admin_id'], name='profile_admin_idx'),
+            # lets the Lambda pick up only profiles changed since its last gallery sync
+            models.Index(fields=['admin_id', 'updated_at'], name='profile_admin_updated_idx'),
+        ]
 
     def __str__(self):
         return self.profile_id
@@ -17,7 +36,78 @@ class Attendance(models.Model):
     id = models.AutoField(primary_key=True)
     profile = models.ForeignKey(Profile, on_delete=models.CASCADE, null=True)
     photo_url = models.CharField(max_length=1000)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # when the picture was taken; written-behind check-ins keep it instead of the insert time
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+    # timestamp // CHECKIN_DEDUP_WINDOW_SECONDS for verified check-ins; the
+    # unique constraint rejects a second check-in racing into the same window
+    dedup_window = models.BigIntegerField(null=True, blank=True)
+    # S3 key of the verified picture; unique so that a retried or redelivered
+    # Lambda event for the same upload is recognised instead of inserted again
+    object_key = models.CharField(max_length=255, null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['profile', 'dedup_window'], name='attendance_dedup_unique'),
+            models.UniqueConstraint(fields=['object_key'], name='attendance_object_key_unique'),
+        ]
+        indexes = [
+            # serves per-profile date ranges and (timestamp, id) keyset pages
+            models.Index(fields=['profile', 'timestamp'], name='attendance_profile_time_idx'),
+        ]
 
     def __str__(self):
         return str(self.id)
+
+
+class AttendanceDailyRollup(models.Model):
+    """Per-profile attendance count for one UTC day, kept up to date on every insert."""
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE)
+    admin_id = models.CharField(max_length=100)
+    date = models.DateField()
+    check_ins = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['profile', 'date'], name='rollup_profile_date_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['admin_id', 'date'], name='rollup_admin_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.profile_id} {self.date}"
+
+
+class ResponseVersion(models.Model):
+    """
+    Version of the data behind a cached read response scope, e.g. 'attendance:<admin_id>'.
+
+    Bumped by every write to that data: ORM signals, bulk writers and the Lambda's raw SQL.
+    """
+    scope = models.CharField(max_length=200, primary_key=True)
+    version = models.PositiveBigIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.scope} v{self.version}"
+
+
+class CheckIn(models.Model):
+    PENDING = 'pending'
+    MATCHED = 'matched'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (MATCHED, 'Matched'),
+        (FAILED, 'Failed'),
+    ]
+
+    ticket_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    profile_id = models.CharField(max_length=100)
+    photo_url = models.CharField(max_length=1000)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    message = models.CharField(max_length=1000, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return str(self.ticket_id)
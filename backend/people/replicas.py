@@ -0,0 +1,123 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+# Read-only endpoints (profile lists, attendance lists, analytics) are wrapped in
+# use_read_replica, and ReplicaRouter sends their queries to a read replica so
+# dashboard read bursts do not compete with check-in writes on the primary.
+# Replicas are checked every DB_REPLICA_CHECK_INTERVAL seconds; one that is more
+# than DB_REPLICA_MAX_LAG seconds behind, has replication stopped or cannot be
+# reached is skipped, and with no usable replica reads go to the primary.
+# Everything outside those endpoints (writes, check-in dedup lookups) always
+# uses the primary, and so does the rest of a request once it has written, so
+# it reads its own writes.
+
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+_wrote = contextvars.ContextVar('wrote', default=False)
+
+
+def use_read_replica(view):
+    """
+    Decorator letting a read-only view's queries go to a replica; works on sync and async views.
+    """
+    if asyncio.iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(*args, **kwargs):
+            tokens = _replica_reads.set(True), _wrote.set(False)
+            try:
+                return await view(*args, **kwargs)
+            finally:
+                _replica_reads.reset(tokens[0])
+                _wrote.reset(tokens[1])
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        tokens = _replica_reads.set(True), _wrote.set(False)
+        try:
+            return view(*args, **kwargs)
+        finally:
+            _replica_reads.reset(tokens[0])
+            _wrote.reset(tokens[1])
+    return wrapper
+
+
+def replica_lag(alias):
+    """
+    :return: Seconds the replica is behind its source, or None if replication is stopped.
+             Databases that do not replicate through the binlog (Aurora readers, local
+             SQLite copies) count as current.
+    :raises DatabaseError: If the replica cannot be reached or the user lacks REPLICATION CLIENT.
+    """
+    connection = connections[alias]
+    if connection.vendor != 'mysql':
+        return 0.0
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute("SHOW REPLICA STATUS")
+        except DatabaseError:
+            # MySQL before 8.0.22
+            cursor.execute("SHOW SLAVE STATUS")
+        columns = [column[0] for column in cursor.description or ()]
+        row = cursor.fetchone()
+    if row is None:
+        return 0.0
+    status = dict(zip(columns, row))
+    lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+    return None if lag is None else float(lag)
+
+
+class ReplicaRouter:
+    """
+    Routes reads inside use_read_replica to a random usable replica of settings.DB_REPLICA_ALIASES.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # alias -> (monotonic time of the last check, usable)
+        self._checks = {}
+
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get() or _wrote.get():
+            return None
+        usable = [alias for alias in settings.DB_REPLICA_ALIASES if self.usable(alias)]
+        return random.choice(usable) if usable else None
+
+    def db_for_write(self, model, **hints):
+        # the replicas may not have this write yet
+        _wrote.set(True)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same data as the primary
+        return True
+
+    def usable(self, alias):
+        """
+        :return: Whether the replica was reachable and recent enough at its last check, checking it if that is due.
+        """
+        now = time.monotonic()
+        with self._lock:
+            last = self._checks.get(alias)
+            if last is not None and now - last[0] < settings.DB_REPLICA_CHECK_INTERVAL:
+                return last[1]
+            # other threads keep the previous answer (the primary at first) while this one checks
+            self._checks[alias] = (now, last[1] if last else False)
+        try:
+            lag = replica_lag(alias)
+        except DatabaseError as e:
+            logging.warning("Replica %s is unavailable: %s", alias, e)
+            lag = None
+        usable = lag is not None and lag <= settings.DB_REPLICA_MAX_LAG
+        if lag is not None and not usable:
+            logging.warning("Replica %s is %.0f seconds behind, reading from the primary", alias, lag)
+        with self._lock:
+            self._checks[alias] = (time.monotonic(), usable)
+        return usable
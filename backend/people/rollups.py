@@ -0,0 +1,93 @@
+import datetime
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+
+from .models import Attendance, AttendanceDailyRollup
+
+
+def rollup_date(timestamp):
+    """
+    :return: The UTC day an attendance timestamp is counted under.
+    """
+    return timestamp.astimezone(datetime.timezone.utc).date()
+
+
+def add_to_rollup(profile_id, admin_id, date, delta=1):
+    """
+    Add delta check-ins to a profile's rollup row for a day, creating it if needed.
+    """
+    rows = AttendanceDailyRollup.objects.filter(profile_id=profile_id, date=date)
+    if delta < 0:
+        rows.update(check_ins=F('check_ins') + delta)
+        # a day without check-ins must not count as present
+        rows.filter(check_ins__lte=0).delete()
+        return
+    if rows.update(check_ins=F('check_ins') + delta):
+        return
+    try:
+        with transaction.atomic():
+            AttendanceDailyRollup.objects.create(
+                profile_id=profile_id, admin_id=admin_id, date=date, check_ins=delta)
+    except IntegrityError:
+        # another writer created the row first
+        rows.update(check_ins=F('check_ins') + delta)
+
+
+def recount_rollups(days):
+    """
+    Recount the rollup rows of some profile days from the raw attendance, e.g.
+    after a bulk insert that skipped conflicting rows and so cannot tell what it added.
+
+    :param days: Iterable of (profile_id, date) pairs.
+    :return: The admin IDs whose rollups were recounted.
+    """
+    days = set(days)
+    if not days:
+        return set()
+    first, last = min(date for _, date in days), max(date for _, date in days)
+    counts = (Attendance.objects
+              .filter(profile_id__in={profile_id for profile_id, _ in days},
+                      timestamp__gte=datetime.datetime.combine(first, datetime.time.min, datetime.timezone.utc),
+                      timestamp__lt=datetime.datetime.combine(last + datetime.timedelta(days=1), datetime.time.min,
+                                                              datetime.timezone.utc))
+              .annotate(date=TruncDate('timestamp', tzinfo=datetime.timezone.utc))
+              .values('profile_id', 'profile__admin_id', 'date')
+              .annotate(check_ins=Count('id'))
+              .order_by())
+    rollups = [AttendanceDailyRollup(profile_id=row['profile_id'], admin_id=row['profile__admin_id'],
+                                     date=row['date'], check_ins=row['check_ins'])
+               for row in counts if (row['profile_id'], row['date']) in days]
+    AttendanceDailyRollup.objects.bulk_create(
+        rollups, update_conflicts=True, unique_fields=['profile', 'date'], update_fields=['check_ins'])
+    return {rollup.admin_id for rollup in rollups}
+
+
+def rebuild_rollups(admin_id=None, batch_size=1000):
+    """
+    Recompute daily rollups from the raw attendance history.
+
+    :param admin_id: Only rebuild this admin's rollups; all admins if None.
+    :return: Number of rollup rows written.
+    """
+    attendance = Attendance.objects.filter(profile__isnull=False)
+    rollups = AttendanceDailyRollup.objects.all()
+    if admin_id is not None:
+        attendance = attendance.filter(profile__admin_id=admin_id)
+        rollups = rollups.filter(admin_id=admin_id)
+
+    counts = (attendance
+              .annotate(date=TruncDate('timestamp', tzinfo=datetime.timezone.utc))
+              .values('profile_id', 'profile__admin_id', 'date')
+              .annotate(check_ins=Count('id'))
+              .order_by())
+
+    with transaction.atomic():
+        rollups.delete()
+        created = AttendanceDailyRollup.objects.bulk_create(
+            (AttendanceDailyRollup(profile_id=row['profile_id'], admin_id=row['profile__admin_id'],
+                                   date=row['date'], check_ins=row['check_ins'])
+             for row in counts.iterator()),
+            batch_size=batch_size)
+    return len(created)
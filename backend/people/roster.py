@@ -0,0 +1,320 @@
+import csv
+import datetime
+import functools
+import io
+import json
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .caching import invalidate
+from .face_matching import index_profile_face, store_profile_embedding
+from .models import Attendance, Profile
+
+# Bulk roster import and streaming export. Rows are processed in batches: the
+# batch's images are uploaded concurrently, existing profiles are fetched with
+# one query, and new/changed rows are written with bulk_create/bulk_update.
+# A bad row is reported with its line number and never aborts the import.
+
+ROSTER_FIELDS = ['profileID', 'profileName', 'adminID', 'profileImageUrl']
+ATTENDANCE_FIELDS = ['id', 'profileID', 'profileName', 'photoUrl', 'timestamp']
+
+
+def read_roster(stream, fmt):
+    """
+    Read roster rows from a text stream.
+
+    :param stream: Text file-like object with CSV (header row required) or JSON Lines.
+    :param fmt: 'csv' or 'jsonl'.
+    :return: Iterator of (line number, row dict); unparsable JSON lines yield the error instead of a dict.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError as e:
+                yield line_number, ValueError(f"Invalid JSON: {e}")
+    else:
+        raise ValueError(f"Unsupported roster format '{fmt}', expected csv or jsonl")
+
+
+def roster_format(file_name, default='csv'):
+    extension = os.path.splitext(file_name or '')[1].lower()
+    return {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}.get(extension, default)
+
+
+def profile_image_key(admin_id, profile_id, file_name):
+    """
+    S3 key of an imported profile image, in the same layout the frontend uploads to.
+    """
+    extension = os.path.splitext(file_name)[1].lower() or '.jpg'
+    timestamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%d%H%M%S')
+    return f"{admin_id}/{profile_id}_{timestamp}{extension}"
+
+
+def s3_image_uploader(bucket, client):
+    """
+    :return: upload(file_obj, key) function that puts a profile image into an S3 bucket and returns its URL.
+    """
+    region = client.meta.region_name or 'ca-central-1'
+
+    def upload(file_obj, key):
+        client.upload_fileobj(file_obj, bucket, key)
+        return f"https://{bucket}.s3.{region}.amazonaws.com/{key}"
+    return upload
+
+
+def uploaded_file_opener(uploaded):
+    """
+    :param uploaded: A Django UploadedFile.
+    :return: Function returning a new binary file on the upload's content; large uploads
+             are reopened from their temporary file instead of being read into memory.
+    """
+    if hasattr(uploaded, 'temporary_file_path'):
+        return functools.partial(open, uploaded.temporary_file_path(), 'rb')
+    # small uploads are already held in memory
+    return lambda: io.BytesIO(uploaded.file.getvalue())
+
+
+def local_image_uploader(directory):
+    """
+    :return: upload(file_obj, key) function that copies a profile image into a local
+             directory standing in for S3 (for development and benchmarks) and returns its file URL.
+    """
+    def upload(file_obj, key):
+        path = os.path.join(os.path.abspath(directory), key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as destination:
+            shutil.copyfileobj(file_obj, destination)
+        return 'file://' + path
+    return upload
+
+
+def _clean_row(row, default_admin_id, images):
+    """
+    Validate a roster row and normalise its keys.
+
+    :return: Dict with profileID, profileName, adminID and either profileImageUrl or image.
+    :raises ValueError: If the row is incomplete.
+    """
+    if isinstance(row, Exception):
+        raise row
+    if not isinstance(row, dict):
+        raise ValueError("Row is not an object")
+    cleaned = {key: str(row.get(key) or '').strip()
+               for key in ('profileID', 'profileName', 'adminID', 'profileImageUrl', 'image')}
+    cleaned['adminID'] = cleaned['adminID'] or default_admin_id or ''
+    for key in ('profileID', 'profileName', 'adminID'):
+        if not cleaned[key]:
+            raise ValueError(f"Missing {key}")
+    if cleaned['image']:
+        if cleaned['image'] not in images:
+            raise ValueError(f"Image {cleaned['image']} not found")
+    elif not cleaned['profileImageUrl']:
+        raise ValueError("Missing image or profileImageUrl")
+    return cleaned
+
+
+def _upload_images(rows, images, upload, workers):
+    """
+    Upload the images of a batch concurrently, setting each row's profileImageUrl.
+
+    :return: {line number: error message} for rows whose upload failed.
+    """
+    def upload_row(row):
+        with images[row['image']]() as file_obj:
+            return upload(file_obj, profile_image_key(row['adminID'], row['profileID'], row['image']))
+
+    pending = [(line_number, row) for line_number, row in rows if row['image']]
+    errors = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [(line_number, row, executor.submit(upload_row, row)) for line_number, row in pending]
+        for line_number, row, future in futures:
+            try:
+                row['profileImageUrl'] = future.result()
+            except Exception as e:
+                logging.error(f"Could not upload image for {row['profileID']}: {e}")
+                errors[line_number] = f"Image upload failed: {e}"
+    return errors
+
+
+def _create_profiles(profiles, summary):
+    """
+    Insert new profiles with one query, or one at a time if another request created one of them meanwhile.
+
+    :param profiles: (line number, unsaved Profile) pairs.
+    :return: The profiles inserted; the others are reported as row errors.
+    """
+    try:
+        with transaction.atomic():
+            return Profile.objects.bulk_create([profile for _, profile in profiles])
+    except IntegrityError:
+        pass
+    created = []
+    for line_number, profile in profiles:
+        try:
+            with transaction.atomic():
+                profile.save(force_insert=True)
+        except IntegrityError:
+            summary['errors'].append({'line': line_number, 'profileID': profile.profile_id,
+                                      'error': "Profile already exists"})
+            continue
+        created.append(profile)
+    return created
+
+
+def _write_batch(rows, summary):
+    """
+    Insert new profiles and update changed ones for one validated batch.
+    """
+    existing = Profile.objects.in_bulk([row['profileID'] for _, row in rows])
+    now = timezone.now()
+    created, updated, embed = [], [], []
+    for line_number, row in rows:
+        profile = existing.get(row['profileID'])
+        if profile is None:
+            profile = Profile(profile_id=row['profileID'], profile_name=row['profileName'],
+                              profile_image=row['profileImageUrl'], admin_id=row['adminID'])
+            created.append((line_number, profile))
+            continue
+        if profile.admin_id != row['adminID']:
+            summary['errors'].append({'line': line_number, 'profileID': row['profileID'],
+                                      'error': "Profile belongs to another admin"})
+            continue
+        image_changed = profile.profile_image != row['profileImageUrl']
+        if profile.profile_name == row['profileName'] and not image_changed:
+            summary['unchanged'] += 1
+            continue
+        profile.profile_name = row['profileName']
+        profile.profile_image = row['profileImageUrl']
+        if image_changed:
+            # the stored embedding and face analysis belong to the old image
+            profile.face_embedding = None
+            profile.face_analysis = None
+            profile.image_version += 1
+            embed.append(profile)
+        # bulk_update does not apply auto_now, and the Lambda's gallery sync reads it
+        profile.updated_at = now
+        updated.append(profile)
+
+    created = _create_profiles(created, summary)
+    embed = created + embed
+    Profile.objects.bulk_update(updated, ['profile_name', 'profile_image', 'face_embedding',
+                                          'face_analysis', 'image_version', 'updated_at'])
+    summary['created'] += len(created)
+    summary['updated'] += len(updated)
+    # compute every new embedding and face ID, then write them with one query
+    faces = [profile for profile in embed
+             if store_profile_embedding(profile, save=False) | index_profile_face(profile, save=False)]
+    for profile in faces:
+        # the Lambda's identification gallery syncs on updated_at
+        profile.updated_at = timezone.now()
+    Profile.objects.bulk_update(faces, ['face_id', 'face_embedding', 'image_version', 'updated_at'])
+    # bulk writes send no post_save signals
+    admin_ids = {profile.admin_id for profile in created + updated}
+    invalidate(*[f"profiles:{profile.profile_id}" for profile in updated],
+               *[f"profiles-by-admin:{admin_id}" for admin_id in admin_ids],
+               *[f"attendance:{admin_id}" for admin_id in admin_ids])
+
+
+def import_roster(rows, images=None, upload=None, default_admin_id=None, batch_size=500, workers=8):
+    """
+    Create or update profiles from roster rows in batches.
+
+    Each row needs profileID and profileName, an adminID (or default_admin_id), and
+    either a profileImageUrl or an 'image' naming an entry of images.
+
+    :param rows: Iterable of (line number, row dict), e.g. from read_roster.
+    :param images: {image name: function returning an open binary file} for rows with an 'image'.
+    :param upload: upload(file_obj, key) -> URL function, e.g. from s3_image_uploader.
+    :param default_admin_id: adminID for rows that do not name one.
+    :param batch_size: Rows written per bulk query.
+    :param workers: Concurrent image uploads.
+    :return: Summary with created/updated/unchanged counts and per-row errors.
+    """
+    images = images or {}
+    summary = {'created': 0, 'updated': 0, 'unchanged': 0, 'errors': []}
+    seen = set()
+    batch = []
+
+    def flush():
+        errors = _upload_images(batch, images, upload, workers) if upload else {}
+        for line_number, row in batch:
+            if line_number in errors:
+                summary['errors'].append({'line': line_number, 'profileID': row['profileID'],
+                                          'error': errors[line_number]})
+        _write_batch([(line_number, row) for line_number, row in batch if line_number not in errors], summary)
+        batch.clear()
+
+    for line_number, row in rows:
+        try:
+            cleaned = _clean_row(row, default_admin_id, images)
+            if cleaned['image'] and upload is None:
+                raise ValueError("Images need an upload target")
+            if cleaned['profileID'] in seen:
+                raise ValueError("Duplicate profileID in roster")
+        except ValueError as e:
+            profile_id = row.get('profileID') if isinstance(row, dict) else None
+            summary['errors'].append({'line': line_number, 'profileID': profile_id, 'error': str(e)})
+            continue
+        seen.add(cleaned['profileID'])
+        batch.append((line_number, cleaned))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return summary
+
+
+class _Echo:
+    """File-like object whose write() returns the value, so csv.writer can feed a generator."""
+
+    def write(self, value):
+        return value
+
+
+def export_rows(kind, admin_id, fmt='csv', chunk_size=2000):
+    """
+    Stream an admin's profiles or attendance as CSV or JSON Lines without loading them all.
+
+    :param kind: 'profiles' or 'attendance'.
+    :param admin_id: Admin whose data to export.
+    :param fmt: 'csv' or 'jsonl'.
+    :param chunk_size: Rows fetched from the database cursor at a time.
+    :return: Iterator of encoded lines.
+    """
+    if kind == 'profiles':
+        fields = ROSTER_FIELDS
+        rows = (Profile.objects.filter(admin_id=admin_id).order_by('profile_id')
+                .values_list('profile_id', 'profile_name', 'admin_id', 'profile_image'))
+    elif kind == 'attendance':
+        fields = ATTENDANCE_FIELDS
+        rows = (Attendance.objects.filter(profile__admin_id=admin_id).order_by('timestamp', 'id')
+                .values_list('id', 'profile_id', 'profile__profile_name', 'photo_url', 'timestamp'))
+    else:
+        raise ValueError(f"Unsupported export '{kind}', expected profiles or attendance")
+    if fmt not in ('csv', 'jsonl'):
+        raise ValueError(f"Unsupported export format '{fmt}', expected csv or jsonl")
+
+    def generate():
+        writer = csv.writer(_Echo())
+        if fmt == 'csv':
+            yield writer.writerow(fields)
+        for values in rows.iterator(chunk_size=chunk_size):
+            values = [value.isoformat() if isinstance(value, datetime.datetime) else value for value in values]
+            if fmt == 'csv':
+                yield writer.writerow(values)
+            else:
+                yield json.dumps(dict(zip(fields, values))) + '\n'
+    return generate()
+
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Attendance, Profile
+from .models import Attendance, CheckIn, Profile
 
 
 class ProfileSerializer(serializers.ModelSerializer):
@@ -8,9 +8,56 @@ class ProfileSerializer(serializers.ModelSerializer):
         fields = ('profile_id', 'profile_name', 'profile_image', 'admin_id')
 
 
+# Columns read by serialize_attendance; profile fields come from the same joined query
+ATTENDANCE_VALUE_FIELDS = ('id', 'photo_url', 'timestamp', 'profile__profile_id',
+                           'profile__profile_name', 'profile__profile_image', 'profile__admin_id')
+
+
+def _attendance_row(row, timestamp_field):
+    attendance_id, photo_url, timestamp, profile_id, profile_name, profile_image, admin_id = row
+    return {
+        'id': attendance_id,
+        'profile': {
+            'profile_id': profile_id,
+            'profile_name': profile_name,
+            'profile_image': profile_image,
+            'admin_id': admin_id,
+        } if profile_id is not None else None,
+        'photo_url': photo_url,
+        'timestamp': timestamp_field.to_representation(timestamp),
+    }
+
+
+def serialize_attendance(attendance):
+    """
+    Serialize attendance with nested profiles from one joined query.
+
+    Produces the same output as AttendanceSerializer(many=True) but reads plain
+    value rows, which skips model instantiation and DRF field introspection.
+    """
+    timestamp_field = serializers.DateTimeField()
+    return [_attendance_row(row, timestamp_field)
+            for row in attendance.values_list(*ATTENDANCE_VALUE_FIELDS)]
+
+
+async def aserialize_attendance(attendance):
+    """
+    Async version of serialize_attendance, reading the rows through the async ORM.
+    """
+    timestamp_field = serializers.DateTimeField()
+    return [_attendance_row(row, timestamp_field)
+            async for row in attendance.values_list(*ATTENDANCE_VALUE_FIELDS)]
+
+
 class AttendanceSerializer(serializers.ModelSerializer):
     profile = ProfileSerializer(read_only=True)
 
     class Meta:
         model = Attendance
         fields = ('id', 'profile', 'photo_url', 'timestamp')
+
+
+class CheckInSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CheckIn
+        fields = ('ticket_id', 'profile_id', 'photo_url', 'status', 'message', 'created_at', 'updated_at')
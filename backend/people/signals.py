@@ -0,0 +1,44 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .caching import invalidate
+from .face_matching import remove_profile_face
+from .models import Attendance, Profile
+from .rollups import add_to_rollup, rollup_date
+
+# Attendance written through the ORM updates the daily rollups here; the Lambda,
+# which inserts with raw SQL, updates them in the same transaction as its insert.
+
+
+@receiver(post_save, sender=Attendance)
+def count_attendance(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and instance.profile_id is not None:
+        add_to_rollup(instance.profile_id, instance.profile.admin_id, rollup_date(instance.timestamp))
+
+
+@receiver(post_delete, sender=Attendance)
+def uncount_attendance(sender, instance, **kwargs):
+    if instance.profile_id is not None:
+        add_to_rollup(instance.profile_id, None, rollup_date(instance.timestamp), delta=-1)
+
+
+@receiver(post_save, sender=Profile)
+def invalidate_profile_responses(sender, instance, **kwargs):
+    # attendance lists embed profile fields, so they go too
+    invalidate(f"profiles:{instance.profile_id}", f"profiles-by-admin:{instance.admin_id}",
+               f"attendance:{instance.admin_id}")
+
+
+@receiver(post_delete, sender=Profile)
+def unenroll_profile_face(sender, instance, **kwargs):
+    remove_profile_face(instance)
+
+
+@receiver(post_save, sender=Attendance)
+@receiver(post_delete, sender=Attendance)
+def invalidate_attendance_responses(sender, instance, **kwargs):
+    try:
+        if instance.profile_id is not None:
+            invalidate(f"attendance:{instance.profile.admin_id}")
+    except Profile.DoesNotExist:
+        pass
@@ -0,0 +1,501 @@
+import datetime
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import numpy as np
+from botocore.exceptions import ClientError
+from django.test import SimpleTestCase
+from PIL import Image
+
+from .benchmark import load_lambda_module, quiet
+from .checkin_keys import new_checkin_key, new_group_key, new_identification_key, object_url
+
+# Tests of backend/lambda/lambda_function.py, run against in-memory stand-ins
+# for pymysql and boto3 so no database or AWS account is needed.
+
+ATTENDANCE_BUCKET = 'attendance'
+PROFILE_BUCKET = 'profiles'
+# updated_at of every profile, as read by the embedding gallery
+PROFILE_UPDATED_AT = datetime.datetime(2024, 1, 1)
+# a group picture is one vertical stripe per face, so a crop of a face is told apart by its color
+STRIPE_COLORS = ('red', 'green', 'blue')
+
+
+class FakeDatabase:
+    """The tables the Lambda reads and writes, shared by every connection to it."""
+
+    def __init__(self):
+        # (admin_id, profile_id) -> (profile_image, image_version, face_analysis, face_embedding)
+        self.profiles = {}
+        # (admin_id, face_id) -> profile_id, for faces enrolled in a face collection
+        self.face_ids = {}
+        # object_key -> (profile_id, dedup_window)
+        self.attendance = {}
+        self.connections = []
+        self.queries = []
+
+    def add_profile(self, admin_id, profile_id, face_id=None, embedding=None):
+        self.profiles[(admin_id, profile_id)] = (
+            f"https://{PROFILE_BUCKET}.s3.ca-central-1.amazonaws.com/{admin_id}/{profile_id}.jpg", 1, None,
+            None if embedding is None else np.asarray(embedding, dtype=np.float32).tobytes())
+        if face_id is not None:
+            self.face_ids[(admin_id, face_id)] = profile_id
+
+    def insert_attendance(self, rows):
+        windows = set(self.attendance.values())
+        inserted = 0
+        for profile_id, photo_url, timestamp, window, object_key in rows:
+            if object_key in self.attendance or (window is not None and (profile_id, window) in windows):
+                continue
+            self.attendance[object_key] = (profile_id, window)
+            windows.add((profile_id, window))
+            inserted += 1
+        return inserted
+
+
+class FakeCursor:
+    def __init__(self, database):
+        self.database = database
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, args=None):
+        self.database.queries.append(query)
+        profiles = self.database.profiles
+        if 'FROM people_attendance WHERE object_key IN' in query:
+            self.rows = [(key,) for key in args if key in self.database.attendance]
+        elif 'WHERE (admin_id, profile_id) IN' in query:
+            keys = [key for key in zip(args[::2], args[1::2]) if key in profiles]
+            width = 6 if 'face_embedding' in query else 5
+            self.rows = [(*key, *profiles[key])[:width] for key in keys]
+        elif query.startswith('SELECT profile_image'):
+            profile_id, admin_id = args
+            profile = profiles.get((admin_id, profile_id))
+            self.rows = [profile[:query.count(',') + 1]] if profile else []
+        elif 'AND face_id IN' in query:
+            admin_id, face_ids = args[0], args[1:]
+            self.rows = [(face_id, self.database.face_ids[(admin_id, face_id)]) for face_id in face_ids
+                         if (admin_id, face_id) in self.database.face_ids]
+        elif 'AND face_id = %s' in query:
+            profile_id = self.database.face_ids.get(args)
+            self.rows = [(profile_id,)] if profile_id else []
+        elif query.startswith('SELECT profile_id, face_embedding, updated_at'):
+            self.rows = [(profile_id, profile[3], PROFILE_UPDATED_AT)
+                         for (admin_id, profile_id), profile in profiles.items() if admin_id == args[0]]
+        else:
+            self.rows = []
+
+    def executemany(self, query, rows):
+        self.database.queries.append(query)
+        if query.startswith('INSERT INTO people_attendance '):
+            return self.database.insert_attendance(rows)
+        return len(rows)
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    def __init__(self, database):
+        self.database = database
+        self.open = True
+
+    def cursor(self):
+        return FakeCursor(self.database)
+
+    def ping(self, reconnect=False):
+        if not self.open:
+            raise ConnectionError("MySQL server has gone away")
+
+    def begin(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.open = False
+
+
+class FakePymysql:
+    """Stands in for the pymysql module as used by the Lambda."""
+
+    def __init__(self, database):
+        self.database = database
+
+    def connect(self, **kwargs):
+        connection = FakeConnection(self.database)
+        self.database.connections.append(connection)
+        return connection
+
+
+class FakeRekognitionClient:
+    """
+    Finds one face in every picture, or the faces listed in `faces`; compare_faces answers per
+    attendance key from `outcomes`, and search_faces_by_image from `searches`.
+    """
+
+    def __init__(self):
+        # attendance key -> 'match', 'mismatch' or 'error'
+        self.outcomes = {}
+        self.compared = []
+        # attendance key -> BoundingBoxes of the faces in it
+        self.faces = {}
+        # attendance key, or stripe color of a cropped group face -> [(face_id, similarity)];
+        # a picture missing here has no face in it
+        self.searches = {}
+        self.collections = set()
+
+    def detect_faces(self, Image):
+        boxes = self.faces.get(Image['S3Object']['Name'], [{'Width': 0.4, 'Height': 0.5, 'Left': 0.3, 'Top': 0.2}])
+        return {'FaceDetails': [{'BoundingBox': box, 'Confidence': 99.9} for box in boxes]}
+
+    def search_faces_by_image(self, CollectionId, Image, MaxFaces, FaceMatchThreshold):
+        if CollectionId not in self.collections:
+            raise ClientError({'Error': {'Code': 'ResourceNotFoundException', 'Message': 'No collection'}},
+                              'SearchFacesByImage')
+        if 'S3Object' in Image:
+            subject = Image['S3Object']['Name']
+        else:
+            subject = stripe_color(Image['Bytes'])
+        if subject not in self.searches:
+            raise ClientError({'Error': {'Code': 'InvalidParameterException', 'Message': 'No face in the image'}},
+                              'SearchFacesByImage')
+        matches = sorted((match for match in self.searches[subject] if match[1] >= FaceMatchThreshold),
+                         key=lambda match: match[1], reverse=True)[:MaxFaces]
+        return {'FaceMatches': [{'Face': {'FaceId': face_id}, 'Similarity': similarity}
+                                for face_id, similarity in matches]}
+
+    def compare_faces(self, SimilarityThreshold, SourceImage, TargetImage):
+        key = SourceImage['S3Object']['Name']
+        self.compared.append(key)
+        outcome = self.outcomes.get(key, 'match')
+        if outcome == 'error':
+            raise ClientError({'Error': {'Code': 'InternalServerError', 'Message': 'Try again'}}, 'CompareFaces')
+        return {'FaceMatches': [{'Similarity': 99.0}] if outcome == 'match' else []}
+
+
+class FakeS3Client:
+    """Holds the attendance pictures the Lambda reads itself (identification), by key."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'Not found'}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+
+class FakeBoto3:
+    """Stands in for the boto3 module as used by the Lambda."""
+
+    def __init__(self):
+        self.rekognition = FakeRekognitionClient()
+        self.s3 = FakeS3Client()
+        self.created = []
+
+    def client(self, service, **kwargs):
+        self.created.append(service)
+        return {'rekognition': self.rekognition, 's3': self.s3}[service]
+
+
+def stripe_color(picture):
+    """
+    :return: Color of the group picture stripe at the center of a cropped face.
+    """
+    image = Image.open(io.BytesIO(picture)).convert('RGB')
+    pixel = image.getpixel((image.width // 2, image.height // 2))
+    return STRIPE_COLORS[int(np.argmax(pixel))]
+
+
+class LambdaTestCase(SimpleTestCase):
+    def setUp(self):
+        self.database = FakeDatabase()
+        self.boto3 = FakeBoto3()
+        self.lambda_function = load_lambda_module()
+        self.lambda_function.pymysql = FakePymysql(self.database)
+        self.lambda_function.boto3 = self.boto3
+        environ = {'BUCKET1_NAME': ATTENDANCE_BUCKET, 'BUCKET2_NAME': PROFILE_BUCKET,
+                   'DB_HOST': 'db', 'DB_USER': 'user', 'DB_PASSWORD': 'password', 'DB_NAME': 'attendance'}
+        self.enterContext(mock.patch.dict(os.environ, environ))
+        self.enterContext(quiet())
+        self.taken = datetime.datetime(2024, 1, 1, 10, tzinfo=datetime.timezone.utc)
+
+    def picture(self, profile_id, minutes=0, outcome='match'):
+        """
+        :return: URL of a new attendance picture of a profile, which Rekognition will answer with `outcome`.
+        """
+        key = new_checkin_key('admin', profile_id, self.taken + datetime.timedelta(minutes=minutes)).key
+        self.boto3.rekognition.outcomes[key] = outcome
+        return object_url(ATTENDANCE_BUCKET, key)
+
+    def identification_picture(self, matches=None):
+        """
+        :param matches: [(face_id, similarity)] the collection search finds, None for a picture without a face.
+        :return: URL of a new attendance picture to identify.
+        """
+        key = new_identification_key('admin', self.taken).key
+        self.boto3.s3.objects[key] = b'picture'
+        if matches is not None:
+            self.boto3.rekognition.searches[key] = matches
+        return object_url(ATTENDANCE_BUCKET, key)
+
+    def group_picture(self, **matches):
+        """
+        :param matches: [(face_id, similarity)] the collection search finds per face, by stripe color.
+        :return: URL of a new group picture with one face per stripe.
+        """
+        key = new_group_key('admin', self.taken).key
+        image = Image.new('RGB', (300, 100))
+        for index, color in enumerate(STRIPE_COLORS):
+            image.paste(color, (index * 100, 0, (index + 1) * 100, 100))
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG')
+        self.boto3.s3.objects[key] = buffer.getvalue()
+        self.boto3.rekognition.faces[key] = [{'Left': (index + 0.4) / 3, 'Top': 0.3, 'Width': 0.2 / 3, 'Height': 0.4}
+                                             for index in range(len(STRIPE_COLORS))]
+        self.boto3.rekognition.searches.update(matches)
+        return object_url(ATTENDANCE_BUCKET, key)
+
+    def sqs_record(self, message_id, path):
+        return {'eventSource': 'aws:sqs', 'messageId': message_id, 'body': json.dumps({'path': path})}
+
+
+class EventRecordTests(LambdaTestCase):
+    def setUp(self):
+        super().setUp()
+        for profile_id in ('p1', 'p2', 'p3'):
+            self.database.add_profile('admin', profile_id)
+
+    def test_redelivered_record_is_recorded_once(self):
+        path = self.picture('p1')
+        first = self.lambda_function.lambda_handler({'Records': [self.sqs_record('m1', path)]}, None)
+        self.assertEqual(first['results'][0]['body'], "Face match successful, attendance recorded")
+
+        # the same message again, and twice in one batch
+        for records in ([self.sqs_record('m1', path)], [self.sqs_record('m1', path), self.sqs_record('m2', path)]):
+            result = self.lambda_function.lambda_handler({'Records': records}, None)
+            self.assertEqual({response['body'] for response in result['results']}, {"Attendance already recorded"})
+            self.assertEqual(result['batchItemFailures'], [])
+        self.assertEqual(len(self.database.attendance), 1)
+        # a picture already recorded is not compared again
+        self.assertEqual(len(self.boto3.rekognition.compared), 1)
+
+    def test_only_messages_with_retryable_failures_are_reported(self):
+        records = [self.sqs_record('recorded', self.picture('p1')),
+                   self.sqs_record('rekognition-error', self.picture('p2', outcome='error')),
+                   self.sqs_record('no-match', self.picture('p3', outcome='mismatch')),
+                   self.sqs_record('unknown-profile', self.picture('p4')),
+                   {'eventSource': 'aws:sqs', 'messageId': 'unreadable', 'body': 'not json'}]
+        result = self.lambda_function.lambda_handler({'Records': records}, None)
+
+        self.assertEqual(result['batchItemFailures'], [{'itemIdentifier': 'rekognition-error'}])
+        self.assertEqual([response['statusCode'] for response in result['results']], [200, 500, 200, 404])
+        self.assertEqual([profile_id for profile_id, _ in self.database.attendance.values()], ['p1'])
+
+        # the redelivered message is the only one tried again
+        self.boto3.rekognition.outcomes.update(dict.fromkeys(self.boto3.rekognition.outcomes, 'match'))
+        retried = self.lambda_function.lambda_handler({'Records': [records[1]]}, None)
+        self.assertEqual(retried['batchItemFailures'], [])
+        self.assertEqual(sorted(profile_id for profile_id, _ in self.database.attendance.values()), ['p1', 'p2'])
+
+    def test_direct_s3_event_with_a_retryable_failure_raises(self):
+        path = self.picture('p1', outcome='error')
+        key = path.split('.com/', 1)[1]
+        record = {'eventSource': 'aws:s3', 'eventName': 'ObjectCreated:Put', 'awsRegion': 'ca-central-1',
+                  's3': {'bucket': {'name': ATTENDANCE_BUCKET}, 'object': {'key': key}}}
+        with self.assertRaises(RuntimeError):
+            self.lambda_function.lambda_handler({'Records': [record]}, None)
+
+
+class VerifyAttendanceTests(LambdaTestCase):
+    def setUp(self):
+        super().setUp()
+        for profile_id in ('p1', 'p2'):
+            self.database.add_profile('admin', profile_id)
+
+    def test_batch_reports_each_picture_and_records_matches_once(self):
+        first = self.picture('p1')
+        paths = [first,
+                 self.picture('p2', outcome='mismatch'),
+                 self.picture('unknown'),
+                 # the same profile again within its dedup window
+                 self.picture('p1', minutes=1),
+                 object_url(ATTENDANCE_BUCKET, 'admin/attendance_malformed.jpg'),
+                 first]
+        result = self.lambda_function.verify_attendance_batch(paths)
+
+        self.assertEqual([(response['statusCode'], response['status']) for response in result['results']],
+                         [(200, 'success'), (200, 'failure'), (404, 'failure'), (409, 'failure'),
+                          (400, 'failure'), (200, 'success')])
+        self.assertEqual(result['body'], "2 of 6 attendance records created")
+        self.assertEqual(list(self.database.attendance), [first.split('.com/', 1)[1]])
+        # one profile query and one attendance insert for the whole batch
+        self.assertEqual(sum('FROM people_profile WHERE (admin_id, profile_id) IN' in query
+                             for query in self.database.queries), 1)
+        self.assertEqual(sum(query.startswith('INSERT INTO people_attendance ')
+                             for query in self.database.queries), 1)
+
+    def test_batch_reports_rows_skipped_by_the_dedup_window(self):
+        self.lambda_function.verify_attendance(self.picture('p1'))
+        # checked in a minute ago by an earlier invocation
+        result = self.lambda_function.verify_attendance_batch([self.picture('p1', minutes=1), self.picture('p2')])
+
+        self.assertEqual([response['statusCode'] for response in result['results']], [409, 200])
+        self.assertEqual(result['body'], "1 of 2 attendance records created")
+        self.assertEqual(sorted(profile_id for profile_id, _ in self.database.attendance.values()), ['p1', 'p2'])
+
+    def test_embedding_is_read_with_the_profile(self):
+        self.database.profiles[('admin', 'p1')] = (*self.database.profiles[('admin', 'p1')][:3], b'\0' * 512)
+        self.lambda_function.FACE_MATCHER_BACKEND = 'embedding'
+        with mock.patch.object(self.lambda_function, 'handle_embedding_match', return_value=(True, None)) as match:
+            result = self.lambda_function.verify_attendance(self.picture('p1'))
+
+        self.assertEqual(result['body'], "Face match successful, attendance recorded")
+        self.assertEqual(len(match.call_args.args[2]), 128)
+        self.assertEqual(sum(query.startswith('SELECT') and 'people_profile' in query
+                             for query in self.database.queries), 1)
+        self.assertEqual(self.boto3.rekognition.compared, [])
+
+
+class IdentifyAttendanceTests(LambdaTestCase):
+    def setUp(self):
+        super().setUp()
+        for index, profile_id in enumerate(('p1', 'p2')):
+            self.database.add_profile('admin', profile_id, face_id=f'face-{profile_id}',
+                                      embedding=np.eye(1, 128, index, dtype=np.float32)[0])
+        self.boto3.rekognition.collections.add('attendance-admin')
+
+    def identify(self, path, faces=None):
+        """
+        :param faces: Embeddings of the faces in the picture, for the embedding backend.
+        """
+        if faces is not None:
+            self.lambda_function.FACE_MATCHER_BACKEND = 'embedding'
+            self.enterContext(mock.patch.object(self.lambda_function, 'compute_face_embeddings',
+                                                return_value=np.asarray(faces, dtype=np.float32).reshape(-1, 128)))
+        return self.lambda_function.verify_attendance_batch([path])['results'][0]
+
+    def recorded(self):
+        return [profile_id for profile_id, _ in self.database.attendance.values()]
+
+    def test_collection_match_is_recorded(self):
+        result = self.identify(self.identification_picture([('face-p2', 97.0), ('face-p1', 91.0)]))
+        self.assertEqual((result['statusCode'], result['profileID'], result['similarity']), (200, 'p2', 97.0))
+        self.assertEqual(self.recorded(), ['p2'])
+
+    def test_collection_picture_without_a_face(self):
+        result = self.identify(self.identification_picture())
+        self.assertEqual((result['statusCode'], result['body']), (400, "No face detected in one or both images"))
+        self.assertEqual(self.recorded(), [])
+
+    def test_collection_match_below_the_threshold(self):
+        result = self.identify(self.identification_picture([('face-p1', 80.0)]))
+        self.assertEqual((result['status'], result['body']), ('failure', "No enrolled profile matched"))
+        self.assertEqual(self.recorded(), [])
+
+    def test_gallery_match_is_recorded(self):
+        result = self.identify(self.identification_picture(), faces=[np.eye(1, 128, 1)[0]])
+        self.assertEqual((result['statusCode'], result['profileID']), (200, 'p2'))
+        self.assertAlmostEqual(result['similarity'], 1.0, places=5)
+        self.assertEqual(self.recorded(), ['p2'])
+
+    def test_gallery_picture_without_a_face(self):
+        result = self.identify(self.identification_picture(), faces=[])
+        self.assertEqual(result['statusCode'], 400)
+        self.assertEqual(self.recorded(), [])
+
+    def test_gallery_match_below_the_threshold(self):
+        face = np.zeros(128)
+        face[1], face[5] = 0.8, 0.6
+        result = self.identify(self.identification_picture(), faces=[face])
+        self.assertEqual((result['status'], result['body']), ('failure', "No enrolled profile matched"))
+        self.assertEqual(self.recorded(), [])
+
+
+class GroupAttendanceTests(LambdaTestCase):
+    def setUp(self):
+        super().setUp()
+        for profile_id in ('p1', 'p2', 'p3'):
+            self.database.add_profile('admin', profile_id, face_id=f'face-{profile_id}')
+        self.boto3.rekognition.collections.add('attendance-admin')
+
+    def test_closest_pairs_are_assigned_first(self):
+        candidates = [(95.0, 1, 'p1'), (99.0, 0, 'p1'), (93.0, 1, 'p2'), (92.0, 2, 'p2')]
+        self.assertEqual(self.lambda_function.assign_faces(candidates), {0: ('p1', 99.0), 1: ('p2', 93.0)})
+
+    def test_collection_match_searches_each_face(self):
+        path = self.group_picture(red=[('face-p1', 99.0)], green=[('face-p1', 95.0), ('face-p2', 93.0)], blue=[])
+        faces, error = self.lambda_function.match_group_collection(
+            ATTENDANCE_BUCKET, path.split('.com/', 1)[1], 'admin')
+        self.assertIsNone(error)
+        self.assertEqual([(face['profileID'], face['similarity']) for face in faces],
+                         [('p1', 99.0), ('p2', 93.0), (None, None)])
+        self.assertAlmostEqual(faces[1]['boundingBox']['Left'], 1.4 / 3, places=4)
+
+    def test_group_picture_records_each_face_once(self):
+        # p3 already checked in on their own in this dedup window
+        self.lambda_function.verify_attendance(self.picture('p3'))
+        path = self.group_picture(red=[('face-p1', 99.0)], green=[('face-p1', 95.0)], blue=[('face-p3', 98.0)])
+        key = path.split('.com/', 1)[1]
+
+        for delivery in range(2):
+            result = self.lambda_function.verify_attendance_batch([path])['results'][0]
+            self.assertEqual([(face['profileID'], face['status']) for face in result['faces']],
+                             [('p1', 'success'), (None, 'unrecognized'), ('p3', 'duplicate')])
+            self.assertEqual(result['body'], "1 of 3 faces checked in")
+            # the redelivered picture records nobody twice
+            self.assertEqual(self.database.attendance[self.lambda_function.group_object_key(key, 'p1')][0], 'p1')
+            self.assertEqual(sorted(profile_id for profile_id, _ in self.database.attendance.values()), ['p1', 'p3'])
+
+
+class ConnectionPoolTests(LambdaTestCase):
+    def test_warm_connection_is_reused(self):
+        connection = self.lambda_function.get_db_connection()
+        self.assertIs(self.lambda_function.get_db_connection(), connection)
+        self.assertEqual(len(self.database.connections), 1)
+        stats = self.lambda_function.get_pool_stats()
+        self.assertEqual((stats['db_misses'], stats['db_hits']), (1, 1))
+
+    def test_stale_connection_is_replaced(self):
+        stale = self.lambda_function.get_db_connection()
+        # the server dropped the idle connection between invocations
+        stale.open = False
+        connection = self.lambda_function.get_db_connection()
+        self.assertIsNot(connection, stale)
+        self.assertEqual(len(self.database.connections), 2)
+        stats = self.lambda_function.get_pool_stats()
+        self.assertEqual((stats['db_misses'], stats['db_hits']), (2, 0))
+
+    def test_profile_face_counters_add_up_across_batch_workers(self):
+        profile_ids = [f'p{i}' for i in range(8)]
+        for profile_id in profile_ids:
+            self.database.add_profile('admin', profile_id)
+        self.lambda_function.verify_attendance_batch([self.picture(profile_id) for profile_id in profile_ids])
+        self.lambda_function.verify_attendance_batch([self.picture(profile_id, minutes=10)
+                                                     for profile_id in profile_ids])
+
+        stats = self.lambda_function.get_pool_stats()
+        self.assertEqual((stats['profile_face_misses'], stats['profile_face_hits']), (8, 8))
+        self.assertEqual(len(self.database.attendance), 16)
+
+    def test_counters_are_exact_under_contention(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for _ in range(8):
+                executor.submit(lambda: [self.lambda_function.count_pool_stat('s3_hits') for _ in range(5000)])
+        self.assertEqual(self.lambda_function.get_pool_stats()['s3_hits'], 40000)
@@ -1,3 +1,915 @@
-from django.test import TestCase
+import base64
+import datetime
+import functools
+import io
+import json
+import shutil
+import tempfile
+import time
+import uuid
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from botocore.exceptions import EndpointConnectionError, NoCredentialsError, NoRegionError
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+import numpy as np
+from PIL import Image
+
+from . import aws_clients, dedup
+from .attendance_writer import AttendanceWriter
+from .benchmark import DEFAULT_LATENCY, FakeBoto3, load_lambda_module, make_id_token, make_test_image, quiet
+from .caching import invalidate
+from .checkin_keys import (CheckinKeyError, new_checkin_key, new_group_key, new_identification_key,
+                           parse_checkin_key)
+from .dashboard import attendance_rate_distribution, attendance_trend
+from .face_matching import store_profile_embedding
+from .images import normalize_image
+from .metrics import StageTimer, percentiles, reset_metrics
+from .replicas import ReplicaRouter, use_read_replica
+from .roster import import_roster, read_roster, uploaded_file_opener
+from .rollups import rebuild_rollups, recount_rollups
+from .models import Attendance, AttendanceDailyRollup, CheckIn, Profile
+from .serializers import AttendanceSerializer, serialize_attendance
+from .views import decode_cursor, encode_cursor
+
+
+class AttendanceByAdminQueryTests(TestCase):
+    def setUp(self):
+        self.profiles = [
+            Profile.objects.create(profile_id=f"p{i}", profile_name=f"Person {i}",
+                                   profile_image=f"https://profiles/p{i}.jpg", admin_id="admin")
+            for i in range(3)
+        ]
+        Profile.objects.create(profile_id="other", profile_name="Other",
+                               profile_image="https://profiles/other.jpg", admin_id="someone-else")
+
+    def tearDown(self):
+        cache.clear()
+
+    def count_queries(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params or {})
+        return len(queries), response
+
+    def add_attendance(self, count):
+        for i in range(count):
+            Attendance.objects.create(profile=self.profiles[i % len(self.profiles)],
+                                      photo_url=f"https://attendance/{i}.jpg")
+
+    def test_query_count_does_not_grow_with_rows(self):
+        url = reverse("get_attendance", args=["admin"])
+        self.add_attendance(2)
+        few_rows_queries, _ = self.count_queries(url)
+
+        self.add_attendance(50)
+        many_rows_queries, response = self.count_queries(url)
+        self.assertEqual(many_rows_queries, few_rows_queries)
+        self.assertEqual(len(response.json()), 52)
+
+    def test_paginated_query_count_does_not_grow_with_rows(self):
+        url = reverse("get_attendance", args=["admin"])
+        self.add_attendance(2)
+        few_rows_queries, _ = self.count_queries(url, {"limit": 25})
+
+        self.add_attendance(30)
+        many_rows_queries, response = self.count_queries(url, {"limit": 25})
+        self.assertEqual(many_rows_queries, few_rows_queries)
+        self.assertEqual(len(response.json()["results"]), 25)
+
+    async def test_async_view_matches_sync_view(self):
+        await sync_to_async(self.add_attendance)(5)
+        for params in ({}, {"limit": 2}):
+            sync_response = await sync_to_async(self.client.get)(
+                reverse("get_attendance", args=["admin"]), params)
+            async_response = await self.async_client.get(reverse("async_get_attendance", args=["admin"]), params)
+            self.assertEqual(async_response.json(), sync_response.json())
+            self.assertEqual(async_response["ETag"], sync_response["ETag"])
+
+    def test_fast_path_matches_model_serializer(self):
+        self.add_attendance(5)
+        attendance = Attendance.objects.filter(profile__admin_id="admin").order_by("id")
+        self.assertEqual(serialize_attendance(attendance),
+                         AttendanceSerializer(attendance, many=True).data)
+
+
+@override_settings(FACE_IDENTIFICATION=True, FACE_MATCHER_BACKEND="rekognition")
+class FaceIndexingTests(TestCase):
+    def setUp(self):
+        self.rekognition = mock.Mock()
+        self.client_factory = self.enterContext(
+            mock.patch("people.face_matching.boto3.client", return_value=self.rekognition))
+
+    def test_unreachable_rekognition_still_creates_the_profile(self):
+        self.rekognition.index_faces.side_effect = EndpointConnectionError(endpoint_url="https://rekognition")
+        body = {"profileID": "p1", "profileName": "Person 1", "adminID": "admin",
+                "profileImageUrl": "https://profiles.s3.ca-central-1.amazonaws.com/admin/p1.jpg"}
+        with self.assertLogs(level="ERROR"):
+            response = self.client.post(reverse("create_profile"), body, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(Profile.objects.get(profile_id="p1").face_id)
+        # collections are regional, the Lambda searches them in ca-central-1
+        self.client_factory.assert_called_with("rekognition", region_name="ca-central-1")
+
+    def test_deleting_a_profile_survives_missing_credentials(self):
+        profile = Profile.objects.create(profile_id="p1", profile_name="Person 1", admin_id="admin",
+                                         profile_image="https://profiles/p1.jpg", face_id="face-1")
+        self.rekognition.delete_faces.side_effect = NoCredentialsError()
+        with self.assertLogs(level="ERROR"):
+            profile.delete()
+        self.assertFalse(Profile.objects.exists())
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        self.profile = Profile.objects.create(profile_id="p1", profile_name="Before",
+                                              profile_image="https://profiles/p1.jpg", admin_id="admin")
+        self.url = reverse("get_profile_by_admin", args=["admin"])
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_unchanged_list_returns_304(self):
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_profile_update_invalidates_cached_list(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.profile.profile_name = "After"
+        self.profile.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]["profile_name"], "After")
+
+    def test_cache_hit_reads_only_the_version(self):
+        url = reverse("get_attendance", args=["admin"])
+        Attendance.objects.create(profile=self.profile, photo_url="https://attendance/1.jpg")
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(len(response.json()), 1)
+        self.assertEqual(len(queries), 1)
+        self.assertIn("people_responseversion", queries[0]["sql"])
+
+    def test_attendance_edit_invalidates_cached_list(self):
+        url = reverse("get_attendance", args=["admin"])
+        attendance = Attendance.objects.create(profile=self.profile, photo_url="https://attendance/1.jpg")
+        etag = self.client.get(url)["ETag"]
+        attendance.photo_url = "https://attendance/2.jpg"
+        attendance.save()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]["photo_url"], "https://attendance/2.jpg")
+
+    def test_bulk_insert_is_served_after_version_bump(self):
+        url = reverse("get_attendance", args=["admin"])
+        self.assertEqual(self.client.get(url).json(), [])
+        # bulk and raw SQL inserts (the Lambda's) send no signal and bump the version themselves
+        Attendance.objects.bulk_create([Attendance(profile=self.profile, photo_url="https://attendance/1.jpg")])
+        self.assertEqual(self.client.get(url).json(), [])
+        invalidate("attendance:admin")
+        self.assertEqual(len(self.client.get(url).json()), 1)
+
+
+class AttendancePaginationTests(TestCase):
+    def setUp(self):
+        self.profiles = [
+            Profile.objects.create(profile_id=f"p{i}", profile_name=f"Person {i}",
+                                   profile_image=f"https://profiles/p{i}.jpg", admin_id="admin")
+            for i in range(2)
+        ]
+        self.url = reverse("get_attendance", args=["admin"])
+        self.day = datetime.datetime(2024, 3, 1, 9, tzinfo=datetime.timezone.utc)
+
+    def tearDown(self):
+        cache.clear()
+
+    def add_attendance(self, timestamp, profile=0):
+        return Attendance.objects.create(profile=self.profiles[profile], photo_url="https://attendance/1.jpg",
+                                         timestamp=timestamp).id
+
+    def walk(self, params):
+        """
+        :return: Attendance IDs of every page, in order, and the number of pages.
+        """
+        ids, pages, cursor = [], 0, None
+        while True:
+            page = self.client.get(self.url, {**params, **({"cursor": cursor} if cursor else {})}).json()
+            ids += [row["id"] for row in page["results"]]
+            pages += 1
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return ids, pages
+
+    def test_cursor_round_trips(self):
+        timestamp = datetime.datetime(2024, 3, 1, 9, 30, 15, 123456, tzinfo=datetime.timezone.utc)
+        self.assertEqual(decode_cursor(encode_cursor(timestamp.isoformat(), 42)), (timestamp, 42))
+        # the list serializes timestamps with a Z suffix
+        self.assertEqual(decode_cursor(encode_cursor("2024-03-01T09:30:15.123456Z", 42)), (timestamp, 42))
+
+    def test_malformed_cursor_is_rejected(self):
+        for cursor in ("not a cursor", base64.urlsafe_b64encode(b"no separator").decode(),
+                       base64.urlsafe_b64encode(b"2024-03-01T09:00:00|x").decode()):
+            response = self.client.get(self.url, {"cursor": cursor})
+            self.assertEqual(response.status_code, 400, cursor)
+
+    def test_pages_through_equal_timestamps_without_gaps_or_repeats(self):
+        expected = [self.add_attendance(self.day, profile=i % 2) for i in range(7)]
+        expected += [self.add_attendance(self.day - datetime.timedelta(hours=1)) for _ in range(3)]
+        expected = expected[:7][::-1] + expected[7:][::-1]
+
+        ids, pages = self.walk({"limit": 3})
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 4)
+
+    def test_filters_apply_to_every_page(self):
+        for days in range(5):
+            for profile in (0, 1):
+                self.add_attendance(self.day + datetime.timedelta(days=days), profile)
+        ids, pages = self.walk({"limit": 2, "from": "2024-03-02", "to": "2024-03-04", "profile_id": "p1"})
+
+        attendance = Attendance.objects.filter(id__in=ids)
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(pages, 2)
+        self.assertEqual({row.profile_id for row in attendance}, {"p1"})
+        self.assertEqual(sorted(row.timestamp.day for row in attendance), [2, 3, 4])
+
+
+@override_settings(FACE_MATCHER_BACKEND="embedding")
+class FaceEmbeddingTests(TestCase):
+    def setUp(self):
+        self.profile = Profile.objects.create(profile_id="p1", profile_name="Person 1", admin_id="admin",
+                                              profile_image="https://profiles.s3.ca-central-1.amazonaws.com/admin/p1.jpg")
+        self.s3 = mock.Mock()
+        self.s3.get_object.return_value = {"Body": io.BytesIO(b"profile picture")}
+        self.vector = np.linspace(0.1, 1.0, 128, dtype=np.float32)
+        self.lambda_function = load_lambda_module()
+
+    def face_at(self, similarity):
+        # a unit face vector with the given cosine similarity to the first axis
+        face = np.zeros(128, dtype=np.float32)
+        face[0], face[1] = similarity, np.sqrt(1 - similarity ** 2)
+        return face
+
+    def handle_match(self, faces):
+        lambda_function = self.lambda_function
+        profile_embedding = np.eye(1, 128, dtype=np.float32)[0]
+        embed = lambda image_bytes: np.asarray(faces, dtype=np.float32).reshape(len(faces), 128)
+        with mock.patch.object(lambda_function, "read_attendance_image", return_value=(b"picture", None)), \
+                mock.patch.object(lambda_function, "match_embedding",
+                                  functools.partial(lambda_function.match_embedding, embed=embed)), quiet():
+            return lambda_function.handle_embedding_match("attendance", "admin/picture.jpg", profile_embedding)
+
+    def test_stored_embedding_round_trips_to_the_lambda(self):
+        store_profile_embedding(self.profile, client=self.s3, embed=lambda image_bytes: self.vector)
+        self.s3.get_object.assert_called_once_with(Bucket="profiles", Key="admin/p1.jpg")
+
+        stored = Profile.objects.get(profile_id="p1").face_embedding
+        decoded = np.frombuffer(bytes(stored), dtype=np.float32)
+        np.testing.assert_array_equal(decoded, self.vector)
+        similarity = self.lambda_function.match_embedding(b"picture", decoded, embed=lambda image_bytes: [self.vector])
+        self.assertAlmostEqual(similarity, 1.0, places=5)
+
+    def test_profile_without_a_face_keeps_no_embedding(self):
+        self.profile.face_embedding = self.vector.tobytes()
+        with self.assertLogs(level="WARNING"):
+            store_profile_embedding(self.profile, client=self.s3, embed=lambda image_bytes: None)
+        self.assertIsNone(Profile.objects.get(profile_id="p1").face_embedding)
+
+    def test_failed_embedding_still_creates_the_profile(self):
+        body = {"profileID": "p2", "profileName": "Person 2", "adminID": "admin",
+                "profileImageUrl": "https://profiles.s3.ca-central-1.amazonaws.com/admin/p2.jpg"}
+        with mock.patch("people.face_matching.boto3.client") as client_factory, self.assertLogs(level="ERROR"):
+            client_factory.return_value.get_object.side_effect = NoRegionError()
+            response = self.client.post(reverse("create_profile"), body, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(Profile.objects.get(profile_id="p2").face_embedding)
+        client_factory.assert_called_with("s3", region_name="ca-central-1")
+
+    def test_face_library_error_leaves_the_embedding_empty(self):
+        self.profile.face_embedding = self.vector.tobytes()
+        failure = RuntimeError("Unsupported image type, must be 8bit gray or RGB image.")
+        with self.assertLogs(level="ERROR"):
+            self.assertTrue(store_profile_embedding(self.profile, client=self.s3, embed=mock.Mock(side_effect=failure)))
+        self.assertIsNone(Profile.objects.get(profile_id="p1").face_embedding)
+
+    def test_best_face_decides_match_against_threshold(self):
+        threshold = self.lambda_function.FACE_EMBEDDING_THRESHOLD
+        self.assertEqual(self.handle_match([self.face_at(threshold + 0.01)]), (True, None))
+        self.assertEqual(self.handle_match([self.face_at(threshold - 0.01)]), (False, None))
+        # a stranger in the picture does not hide the profile's face
+        self.assertEqual(self.handle_match([self.face_at(0.0), self.face_at(0.99)]), (True, None))
+        self.assertEqual(self.handle_match([self.face_at(0.0)]), (False, None))
+
+    def test_picture_without_a_face_is_an_error(self):
+        matched, error = self.handle_match([])
+        self.assertFalse(matched)
+        self.assertEqual(error.response["Error"]["Code"], "InvalidParameterException")
+
+
+class ImageNormalizationTests(TestCase):
+    def encode(self, image, **kwargs):
+        output = io.BytesIO()
+        image.save(output, format="JPEG", **kwargs)
+        return output.getvalue()
+
+    def test_rotates_by_exif_and_downsizes(self):
+        image = Image.new("RGB", (4000, 3000), (120, 30, 200))
+        exif = image.getexif()
+        exif[0x0112] = 6  # rotated 90 degrees clockwise
+        original = self.encode(image, quality=98, exif=exif)
+
+        normalized, stats = normalize_image(original, 1024, 85)
+        self.assertEqual(Image.open(io.BytesIO(normalized)).size, (768, 1024))
+        self.assertEqual(stats["original_bytes"], len(original))
+        self.assertLess(stats["normalized_bytes"], stats["original_bytes"])
+
+    def test_rejects_unreadable_upload(self):
+        with self.assertRaises(ValueError):
+            normalize_image(b"not an image", 1024, 85)
+
+    def test_rejects_decompression_bomb(self):
+        picture = make_test_image(64, 64)
+        with mock.patch("PIL.Image.MAX_IMAGE_PIXELS", 1000), self.assertRaises(ValueError):
+            normalize_image(picture, 1024, 85)
+
+
+class RosterImportExportTests(TestCase):
+    def tearDown(self):
+        cache.clear()
+
+    def test_import_creates_updates_and_reports_bad_rows(self):
+        Profile.objects.create(profile_id="p1", profile_name="Old name",
+                               profile_image="https://profiles/p1.jpg", admin_id="admin")
+        roster = io.StringIO(
+            "profileID,profileName,adminID,profileImageUrl\n"
+            "p1,New name,admin,https://profiles/p1.jpg\n"
+            "p2,Person 2,,https://profiles/p2.jpg\n"
+            "p3,,admin,https://profiles/p3.jpg\n"
+            "p2,Person 2 again,admin,https://profiles/p2.jpg\n"
+        )
+        with CaptureQueriesContext(connection) as queries:
+            summary = import_roster(read_roster(roster, "csv"), default_admin_id="admin", batch_size=10)
+
+        self.assertEqual((summary["created"], summary["updated"]), (1, 1))
+        self.assertEqual([error["line"] for error in summary["errors"]], [4, 5])
+        self.assertEqual(Profile.objects.get(profile_id="p1").profile_name, "New name")
+        self.assertEqual(Profile.objects.get(profile_id="p2").admin_id, "admin")
+        # one lookup, one bulk insert in a savepoint, one bulk update and the two-statement cache version bump
+        self.assertEqual(len(queries), 7)
+
+    def test_import_reports_profiles_created_concurrently(self):
+        roster = io.StringIO(
+            "profileID,profileName,adminID,profileImageUrl\n"
+            "p1,Person 1,admin,https://profiles/p1.jpg\n"
+            "p2,Person 2,admin,https://profiles/p2.jpg\n"
+        )
+        # p1 is created by another request between the lookup and the insert
+        Profile.objects.create(profile_id="p1", profile_name="Other", profile_image="https://profiles/other.jpg",
+                               admin_id="admin")
+        with mock.patch.object(Profile.objects, "in_bulk", return_value={}):
+            summary = import_roster(read_roster(roster, "csv"), batch_size=10)
+        self.assertEqual(summary["created"], 1)
+        self.assertEqual(summary["errors"], [{"line": 2, "profileID": "p1", "error": "Profile already exists"}])
+        self.assertEqual(Profile.objects.get(profile_id="p1").profile_name, "Other")
+        self.assertTrue(Profile.objects.filter(profile_id="p2").exists())
+
+    def test_uploaded_images_are_reopened_not_read(self):
+        uploads = [SimpleUploadedFile("small.jpg", b"small"),
+                   TemporaryUploadedFile("large.jpg", "image/jpeg", 5, None)]
+        uploads[1].write(b"large")
+        uploads[1].flush()
+        for upload, content in zip(uploads, (b"small", b"large")):
+            open_image = uploaded_file_opener(upload)
+            # each upload thread gets its own file
+            with open_image() as first, open_image() as second:
+                self.assertEqual((first.read(), second.read()), (content, content))
+        uploads[1].close()
+
+    @override_settings(FACE_IDENTIFICATION=True, FACE_MATCHER_BACKEND="rekognition")
+    def test_import_indexes_faces_with_one_update(self):
+        Profile.objects.create(profile_id="p1", profile_name="Person 1", admin_id="admin",
+                               profile_image="https://profiles.s3.ca-central-1.amazonaws.com/admin/old.jpg")
+        roster = io.StringIO(
+            "profileID,profileName,adminID,profileImageUrl\n"
+            "p1,Person 1,admin,https://profiles.s3.ca-central-1.amazonaws.com/admin/p1.jpg\n"
+            "p2,Person 2,admin,https://profiles.s3.ca-central-1.amazonaws.com/admin/p2.jpg\n"
+        )
+        rekognition = mock.Mock()
+        rekognition.index_faces.side_effect = lambda Image, **kwargs: {
+            "FaceRecords": [{"Face": {"FaceId": "face-" + Image["S3Object"]["Name"]}}]}
+        with mock.patch("people.face_matching.boto3.client", return_value=rekognition), \
+                CaptureQueriesContext(connection) as queries:
+            summary = import_roster(read_roster(roster, "csv"), default_admin_id="admin", batch_size=10)
+
+        self.assertEqual((summary["created"], summary["updated"]), (1, 1))
+        self.assertEqual(dict(Profile.objects.values_list("profile_id", "face_id")),
+                         {"p1": "face-admin/p1.jpg", "p2": "face-admin/p2.jpg"})
+        self.assertEqual(Profile.objects.get(profile_id="p1").image_version, 2)
+        # the changed profile, then the face IDs of both, each in one UPDATE
+        self.assertEqual(sum(query["sql"].startswith('UPDATE "people_profile"') for query in queries), 2)
+
+    def test_export_streams_csv(self):
+        Profile.objects.create(profile_id="p1", profile_name="Person 1",
+                               profile_image="https://profiles/p1.jpg", admin_id="admin")
+        response = self.client.get(reverse("export_admin_data", args=["admin"]), {"type": "profiles"})
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines, ["profileID,profileName,adminID,profileImageUrl",
+                                 "p1,Person 1,admin,https://profiles/p1.jpg"])
+
+    def test_export_streams_json_lines(self):
+        Profile.objects.create(profile_id="p1", profile_name="Person 1",
+                               profile_image="https://profiles/p1.jpg", admin_id="admin")
+        response = self.client.get(reverse("export_admin_data", args=["admin"]),
+                                   {"type": "profiles", "file_format": "jsonl"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(rows, [{"profileID": "p1", "profileName": "Person 1", "adminID": "admin",
+                                 "profileImageUrl": "https://profiles/p1.jpg"}])
+
+
+class StageMetricsTests(TestCase):
+    def setUp(self):
+        # other tests' check-ins are recorded too
+        reset_metrics()
+
+    def tearDown(self):
+        reset_metrics()
+
+    def test_stage_timings_reach_metrics_endpoint(self):
+        with self.assertLogs("people.metrics") as logs:
+            for milliseconds in range(1, 101):
+                timer = StageTimer("checkin")
+                timer.add_remote("lambda", {"rekognition_compare_faces": milliseconds})
+                timer.finish()
+        self.assertEqual(json.loads(logs.records[-1].getMessage())["stages_ms"],
+                         {"lambda_rekognition_compare_faces": 100.0})
+
+        self.assertAlmostEqual(percentiles("checkin", "lambda_rekognition_compare_faces")[0.95], 0.096)
+        body = self.client.get(reverse("metrics")).content.decode()
+        self.assertIn('checkin_stage_duration_seconds_bucket{operation="checkin",'
+                      'stage="lambda_rekognition_compare_faces",le="0.05"} 50', body)
+        self.assertIn('checkin_stage_duration_seconds_count{operation="checkin",stage="total"} 100', body)
+        self.assertIn('aws_credential_cache_lookups_total{result="hit"}', body)
+
+
+class PresignedUploadTests(TestCase):
+    def verify(self, key, profile_id="p1"):
+        token = "x." + base64.urlsafe_b64encode(json.dumps({"sub": "user"}).encode()).decode().rstrip("=") + ".y"
+        body = {"idToken": token, "region": "r", "identityPoolId": "i", "userPoolId": "u",
+                "profileID": profile_id, "key": key}
+        return self.client.post(reverse("verify_uploaded_attendance_picture"), json.dumps(body),
+                                content_type="application/json")
+
+    def test_rejects_keys_not_issued_to_caller(self):
+        self.assertEqual(self.verify(new_checkin_key("other-user", "p1").key).status_code, 400)
+        self.assertEqual(self.verify(new_checkin_key("user", "p1").key, "p2").status_code, 400)
+        # upload URLs only ever issue current-version keys
+        self.assertEqual(self.verify("user/attendance_p1_2024-01-01_10-00-00.jpg").status_code, 400)
+
+    def test_rejects_expired_keys(self):
+        response = self.verify(new_checkin_key("user", "p1", datetime.datetime(2020, 1, 1, 10)).key)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("expired", response.json()["error"])
+
+
+class BatchCheckinTests(TestCase):
+    def setUp(self):
+        self.picture = make_test_image(64, 64)
+        self.enterContext(mock.patch("people.views.get_aws_clients", return_value=(mock.Mock(), mock.Mock())))
+        self.enterContext(mock.patch("people.views.upload_original"))
+        self.enterContext(mock.patch("people.views.upload_fileobj",
+                                     side_effect=lambda file, bucket, key, **kwargs: f"https://attendance/{key}"))
+        self.invoke = self.enterContext(mock.patch(
+            "people.views.invoke_lambda_batch",
+            side_effect=lambda paths, client, timer: [{"statusCode": 200, "status": "success", "body": "ok"}] * len(paths)))
+        self.enterContext(quiet())
+
+    def post(self, pictures):
+        body = {"idToken": make_id_token("user"), "region": "r", "identityPoolId": "i", "userPoolId": "u",
+                "image": [io.BytesIO(picture) for picture in pictures],
+                "profileID": [f"p{i}" for i in range(len(pictures))]}
+        return self.client.post(reverse("upload_attendance_pictures"), body)
+
+    @override_settings(BATCH_CHECKIN_MAX_ITEMS=2)
+    def test_rejects_batches_over_the_item_cap(self):
+        response = self.post([self.picture] * 3)
+        self.assertEqual(response.status_code, 413)
+        self.invoke.assert_not_called()
+
+    def test_rejects_only_oversized_pictures(self):
+        with override_settings(ATTENDANCE_PICTURE_MAX_BYTES=len(self.picture)):
+            response = self.post([self.picture, self.picture + b"\0"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item["statusCode"] for item in response.json()["results"]], [200, 413])
+        self.assertEqual(response.json()["recorded"], 1)
+        self.assertEqual(len(self.invoke.call_args.args[0]), 1)
+
+
+@override_settings(CHECKIN_DEDUP_WINDOW_SECONDS=300)
+class DuplicateCheckinTests(TestCase):
+    def setUp(self):
+        self.profile = Profile.objects.create(profile_id="p1", profile_name="Person 1",
+                                              profile_image="https://profiles/p1.jpg", admin_id="admin")
+        self.addCleanup(dedup._recent.clear)
+        self.now = time.time()
+        self.enterContext(mock.patch("people.dedup.time.time", lambda: self.now))
+
+    def check_in(self, seconds_ago):
+        Attendance.objects.create(profile=self.profile, photo_url="https://attendance/1.jpg",
+                                  timestamp=datetime.datetime.fromtimestamp(self.now - seconds_ago,
+                                                                            datetime.timezone.utc))
+
+    def test_check_in_inside_the_window_is_a_duplicate(self):
+        self.check_in(seconds_ago=60)
+        self.assertTrue(dedup.is_duplicate_checkin("p1"))
+        # answered in-process until the window ends
+        with self.assertNumQueries(0):
+            self.assertTrue(dedup.is_duplicate_checkin("p1"))
+        self.now += 241
+        self.assertFalse(dedup.is_duplicate_checkin("p1"))
+
+    def test_check_in_before_the_window_is_not_a_duplicate(self):
+        self.check_in(seconds_ago=301)
+        self.assertFalse(dedup.is_duplicate_checkin("p1"))
+        dedup.remember_checkin("p1", self.now - 301)
+        self.assertFalse(dedup.is_duplicate_checkin("p1"))
+
+    def test_pending_check_in_is_a_duplicate_unless_it_failed(self):
+        checkin = CheckIn.objects.create(profile_id="p1", photo_url="https://attendance/1.jpg")
+        self.assertTrue(dedup.is_duplicate_checkin("p1"))
+        dedup._recent.clear()
+        checkin.status = CheckIn.FAILED
+        checkin.save()
+        self.assertFalse(dedup.is_duplicate_checkin("p1"))
+
+    async def test_async_lookup_matches_sync_lookup(self):
+        await sync_to_async(self.check_in)(seconds_ago=60)
+        self.assertTrue(await dedup.ais_duplicate_checkin("p1"))
+        self.now += 241
+        self.assertFalse(await dedup.ais_duplicate_checkin("p1"))
+        self.assertFalse(await dedup.ais_duplicate_checkin("p2"))
+
+    def checkin_body(self):
+        return {"idToken": make_id_token("user"), "region": "r", "identityPoolId": "i", "userPoolId": "u",
+                "profileID": "p1", "image": io.BytesIO(make_test_image(64, 64))}
+
+    def test_duplicate_is_rejected_with_409_before_upload(self):
+        dedup.remember_checkin("p1")
+        with mock.patch("people.views.get_aws_clients") as get_aws_clients, quiet():
+            response = self.client.post(reverse("upload_attendance_picture"), self.checkin_body())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["statusCode"], 409)
+        get_aws_clients.assert_not_called()
+
+    async def test_async_duplicate_is_rejected_with_409(self):
+        dedup.remember_checkin("p1")
+        with mock.patch("people.async_views.get_aws_clients", return_value=(mock.Mock(), mock.Mock())), \
+                mock.patch("people.async_views.upload_fileobj") as upload, quiet():
+            response = await self.async_client.post(reverse("async_upload_attendance_picture"),
+                                                    self.checkin_body())
+        self.assertEqual(response.json()["statusCode"], 409)
+        upload.assert_not_called()
+
+
+class CheckinStatusTests(TestCase):
+    def setUp(self):
+        self.enterContext(mock.patch("people.views.get_aws_clients", return_value=(mock.Mock(), mock.Mock())))
+        self.enterContext(mock.patch("people.views.upload_original"))
+        self.enterContext(mock.patch("people.views.upload_fileobj",
+                                     side_effect=lambda file, bucket, object_name, **kwargs: f"https://attendance/{object_name}"))
+        self.invoke = self.enterContext(mock.patch("people.views.invoke_lambda_async"))
+        self.addCleanup(dedup._recent.clear)
+        self.enterContext(quiet())
+
+    def submit(self, profile_id="p1"):
+        body = {"idToken": make_id_token("user"), "region": "r", "identityPoolId": "i", "userPoolId": "u",
+                "profileID": profile_id, "image": io.BytesIO(make_test_image(64, 64)), "async": "true"}
+        response = self.client.post(reverse("upload_attendance_picture"), body)
+        self.assertEqual(response.status_code, 202)
+        return response.json()["ticket_id"]
+
+    def status(self, ticket_id):
+        return self.client.get(reverse("get_checkin_status", args=[ticket_id]))
+
+    def test_pending_ticket(self):
+        ticket_id = self.submit()
+        self.assertEqual(self.invoke.call_args.args[1], CheckIn.objects.get().ticket_id)
+        response = self.status(ticket_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()["profile_id"], response.json()["status"]), ("p1", "pending"))
+
+    def test_finished_tickets(self):
+        for status, message in ((CheckIn.MATCHED, "Face match successful, attendance recorded"),
+                                (CheckIn.FAILED, "Face match failed")):
+            ticket_id = self.submit(profile_id=status)
+            # written by the Lambda when it is done
+            CheckIn.objects.filter(ticket_id=ticket_id).update(status=status, message=message)
+            body = self.status(ticket_id).json()
+            self.assertEqual((body["status"], body["message"]), (status, message))
+
+    def test_unknown_ticket(self):
+        response = self.status(uuid.uuid4())
+        self.assertEqual(response.status_code, 404)
+        self.assertIn("not found", response.json()["error"])
+
+
+class PictureSizeLimitTests(TestCase):
+    def setUp(self):
+        self.picture = make_test_image(64, 64)
+        # the declared size passes, only the picture itself is over the limit
+        self.enterContext(override_settings(ATTENDANCE_PICTURE_MAX_BYTES=len(self.picture) - 1))
+        self.get_aws_clients = self.enterContext(mock.patch("people.views.get_aws_clients"))
+        self.addCleanup(dedup._recent.clear)
+        self.enterContext(quiet())
+
+    def body(self, image):
+        return {"idToken": make_id_token("user"), "region": "r", "identityPoolId": "i", "userPoolId": "u",
+                "profileID": "p1", "image": image}
+
+    def test_rejects_oversized_upload(self):
+        response = self.client.post(reverse("upload_attendance_picture"), self.body(io.BytesIO(self.picture)))
+        self.assertEqual(response.status_code, 413)
+        self.get_aws_clients.assert_not_called()
+
+    def test_rejects_oversized_base64_picture(self):
+        data_url = "data:image/jpeg;base64," + base64.b64encode(self.picture).decode()
+        response = self.client.post(reverse("upload_attendance_picture"), self.body(data_url),
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 413)
+        self.get_aws_clients.assert_not_called()
+
+    async def test_async_view_rejects_oversized_upload(self):
+        with mock.patch("people.async_views.get_aws_clients") as get_aws_clients:
+            response = await self.async_client.post(reverse("async_upload_attendance_picture"),
+                                                    self.body(io.BytesIO(self.picture)))
+        self.assertEqual(response.status_code, 413)
+        get_aws_clients.assert_not_called()
+
+
+class AsyncCheckinTests(TestCase):
+    async def test_missing_fields_are_rejected(self):
+        for field in ("profileID", "region", "identityPoolId", "userPoolId"):
+            body = {"idToken": make_id_token("user"), "region": "r", "identityPoolId": "i", "userPoolId": "u",
+                    "profileID": "p1", "image": io.BytesIO(make_test_image(64, 64))}
+            del body[field]
+            with mock.patch("people.async_views.get_aws_clients") as get_aws_clients:
+                response = await self.async_client.post(reverse("async_upload_attendance_picture"), body)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(field, response.json()["error"])
+            get_aws_clients.assert_not_called()
+
+
+class AwsClientCacheTests(TestCase):
+    def setUp(self):
+        self.now = datetime.datetime(2024, 1, 1, 10, tzinfo=datetime.timezone.utc)
+        self.fetched = []
+        self.enterContext(mock.patch("people.aws_clients._now", lambda: self.now))
+        self.enterContext(mock.patch("people.aws_clients._fetch_credentials", self.fetch_credentials))
+        self.enterContext(mock.patch("people.aws_clients.boto3", FakeBoto3(DEFAULT_LATENCY)))
+        self.addCleanup(aws_clients._identity_cache.clear)
+        self.addCleanup(aws_clients._stats.update, hits=0, misses=0)
+
+    def fetch_credentials(self, region, identity_pool_id, user_pool_id, id_token):
+        # Cognito credentials last an hour
+        self.fetched.append(id_token)
+        return {"AccessKeyId": "a", "SecretKey": "s", "SessionToken": "t",
+                "Expiration": self.now + datetime.timedelta(hours=1)}
+
+    def clients(self, id_token="token", subject="user", identity_pool_id="pool"):
+        return aws_clients.get_aws_clients("r", identity_pool_id, "users", id_token, subject)
+
+    def test_refreshes_at_the_expiry_margin(self):
+        clients = self.clients()
+        self.now += datetime.timedelta(minutes=54, seconds=59)
+        self.assertEqual(self.clients(), clients)
+        # within five minutes of the expiration
+        self.now += datetime.timedelta(seconds=2)
+        refreshed = self.clients()
+        self.assertNotEqual(refreshed, clients)
+        self.assertEqual(len(self.fetched), 2)
+        self.assertEqual(self.clients(), refreshed)
+        self.assertEqual(aws_clients.get_cache_stats()["hits"], 2)
+
+    def test_new_token_refreshes_the_identity(self):
+        clients = self.clients(id_token="first")
+        self.assertNotEqual(self.clients(id_token="second"), clients)
+        self.assertEqual(self.fetched, ["first", "second"])
+        # only the latest token is cached
+        self.clients(id_token="first")
+        self.assertEqual(self.fetched, ["first", "second", "first"])
+
+    def test_identities_are_cached_separately(self):
+        clients = {(subject, pool): self.clients(subject=subject, identity_pool_id=pool)
+                   for subject in ("alice", "bob") for pool in ("pool-1", "pool-2")}
+        self.assertEqual(len(set(clients.values())), 4)
+        for (subject, pool), cached in clients.items():
+            self.assertEqual(self.clients(subject=subject, identity_pool_id=pool), cached)
+        self.assertEqual(len(self.fetched), 4)
+        self.assertEqual(aws_clients.get_cache_stats()["size"], 4)
+
+
+class CheckinKeyTests(TestCase):
+    def test_round_trips_profile_ids_with_separators(self):
+        taken = datetime.datetime(2024, 1, 1, 10, 0, 0, 123456, tzinfo=datetime.timezone.utc)
+        key = new_checkin_key("admin", "class_2b/07 é", taken)
+        self.assertEqual(parse_checkin_key(key.key), key)
+        self.assertNotEqual(new_checkin_key("admin", "p1", taken).key, new_checkin_key("admin", "p1", taken).key)
+
+    def test_identification_keys_carry_no_profile(self):
+        key = new_identification_key("admin")
+        self.assertTrue(key.key.startswith("admin/identify_v2_"))
+        self.assertEqual(parse_checkin_key(key.key), key)
+        self.assertIsNone(key.profile_id)
+
+    def test_group_keys_leave_room_for_every_profile(self):
+        key = new_group_key("admin")
+        self.assertTrue(key.key.startswith("admin/group_v2_"))
+        self.assertEqual(parse_checkin_key(key.key), key)
+        self.assertFalse(parse_checkin_key(new_identification_key("admin").key).group)
+        with self.assertRaises(CheckinKeyError):
+            new_group_key("a" * 120)
+
+    def test_reads_legacy_keys_and_rejects_malformed_ones(self):
+        legacy = parse_checkin_key("admin/attendance_p1_2024-01-01_10-00-00.jpg")
+        self.assertEqual((legacy.admin_id, legacy.profile_id, legacy.version), ("admin", "p1", 1))
+        for key in ("admin/originals/attendance_p1_2024-01-01_10-00-00.jpg",
+                    "admin/attendance_p_1_2024-01-01_10-00-00.jpg",
+                    "admin/attendance_v2_20240101T100000000000Z_" + "0" * 32 + "_p%31.jpg"):
+            with self.assertRaises(CheckinKeyError):
+                parse_checkin_key(key)
+
+
+class AttendanceWriterTests(TestCase):
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_dir)
+        Profile.objects.create(profile_id="p1", profile_name="Person 1", profile_image="https://profiles/p1.jpg",
+                               admin_id="admin")
+        self.taken = datetime.datetime(2024, 1, 1, 10, tzinfo=datetime.timezone.utc)
+
+    def test_buffers_until_the_batch_is_full(self):
+        writer = AttendanceWriter(self.spool_dir, batch_size=2, interval=3600)
+        writer.accept("p1", "https://attendance/a.jpg", self.taken, "admin/a.jpg")
+        self.assertFalse(Attendance.objects.exists())
+        # a second check-in in the same dedup window is skipped, not an error
+        writer.accept("p1", "https://attendance/b.jpg", self.taken, "admin/b.jpg")
+        attendance = Attendance.objects.get()
+        self.assertEqual((attendance.object_key, attendance.timestamp), ("admin/a.jpg", self.taken))
+        self.assertEqual(AttendanceDailyRollup.objects.get().check_ins, 1)
+        writer.close()
+
+    def test_syncs_the_spool_outside_the_lock(self):
+        writer = AttendanceWriter(self.spool_dir, batch_size=10, interval=3600)
+        locked = []
+        with mock.patch("people.attendance_writer.os.fsync",
+                        side_effect=lambda fd: locked.append(writer._lock.locked())):
+            writer.accept("p1", "https://attendance/a.jpg", self.taken, "admin/a.jpg")
+        self.assertEqual(locked, [False])
+        writer.close()
+
+    def test_recovers_rows_spooled_by_a_dead_process(self):
+        dead = AttendanceWriter(self.spool_dir, batch_size=10, interval=3600)
+        dead.accept("p1", "https://attendance/a.jpg", self.taken, "admin/a.jpg")
+        # the process dies: its lock goes, its buffer is never flushed
+        dead._owner_lock.close()
+
+        writer = AttendanceWriter(self.spool_dir, batch_size=10, interval=3600)
+        self.assertEqual(writer.recover(), 1)
+        self.assertEqual(writer.recover(), 0)
+        self.assertEqual(Attendance.objects.get().object_key, "admin/a.jpg")
+        writer.close()
+
+
+class ReplicaRouterTests(TestCase):
+    @override_settings(DB_REPLICA_ALIASES=["replica_0", "replica_1"], DB_REPLICA_MAX_LAG=5)
+    def test_replica_reads_skip_lagging_replicas(self):
+        router = ReplicaRouter()
+        lags = {"replica_0": 60.0, "replica_1": 1.0}
+        read_alias = use_read_replica(lambda: router.db_for_read(Profile))
+        with mock.patch("people.replicas.replica_lag", side_effect=lags.get):
+            self.assertIsNone(router.db_for_read(Profile))
+            self.assertEqual(read_alias(), "replica_1")
+            self.assertEqual(router.db_for_write(Profile), "default")
+            # replication stopped: seen at the next check, then reads fall back to the primary
+            lags["replica_1"] = None
+            self.assertEqual(read_alias(), "replica_1")
+            with override_settings(DB_REPLICA_CHECK_INTERVAL=0):
+                self.assertIsNone(read_alias())
+
+    @override_settings(DB_REPLICA_ALIASES=["replica_0"])
+    def test_reads_after_a_write_go_to_the_primary(self):
+        router = ReplicaRouter()
+
+        @use_read_replica
+        def view():
+            before = router.db_for_read(Profile)
+            router.db_for_write(Profile)
+            return before, router.db_for_read(Profile)
+
+        with mock.patch("people.replicas.replica_lag", return_value=0.0):
+            self.assertEqual(view(), ("replica_0", None))
+            # the next request reads from the replica again
+            self.assertEqual(view(), ("replica_0", None))
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        self.profiles = [
+            Profile.objects.create(profile_id=f"p{i}", profile_name=f"Person {i}",
+                                   profile_image=f"https://profiles/p{i}.jpg", admin_id="admin" if i < 2 else "other")
+            for i in range(3)
+        ]
+        eastern = datetime.timezone(datetime.timedelta(hours=-5))
+        self.attendance = [
+            Attendance.objects.create(profile=self.profiles[profile], photo_url="https://attendance/1.jpg",
+                                      timestamp=timestamp)
+            for profile, timestamp in [
+                (0, datetime.datetime(2024, 3, 1, 9, tzinfo=datetime.timezone.utc)),
+                (0, datetime.datetime(2024, 3, 1, 13, tzinfo=datetime.timezone.utc)),
+                # 03:30 UTC on March 2
+                (0, datetime.datetime(2024, 3, 1, 22, 30, tzinfo=eastern)),
+                (1, datetime.datetime(2024, 3, 1, 10, tzinfo=datetime.timezone.utc)),
+                (1, datetime.datetime(2024, 3, 3, 10, tzinfo=datetime.timezone.utc)),
+                (2, datetime.datetime(2024, 3, 1, 10, tzinfo=datetime.timezone.utc)),
+            ]
+        ]
+
+    def tearDown(self):
+        cache.clear()
+
+    def rollups(self):
+        return sorted(AttendanceDailyRollup.objects.values_list("profile_id", "admin_id", "date", "check_ins"))
+
+    def test_signal_rollups_match_rebuild(self):
+        # a day's only check-in removed, and one of two
+        self.attendance[4].delete()
+        self.attendance[0].delete()
+        counted = self.rollups()
+        self.assertIn(("p0", "admin", datetime.date(2024, 3, 2), 1), counted)
+        self.assertFalse(AttendanceDailyRollup.objects.filter(profile_id="p1", date=datetime.date(2024, 3, 3)))
+
+        self.assertEqual(rebuild_rollups(), len(counted))
+        self.assertEqual(self.rollups(), counted)
+        self.assertEqual(recount_rollups({(row[0], row[2]) for row in counted}), {"admin", "other"})
+        self.assertEqual(self.rollups(), counted)
+
+    def test_rebuild_command_only_touches_the_given_admin(self):
+        counted = self.rollups()
+        AttendanceDailyRollup.objects.all().delete()
+        AttendanceDailyRollup.objects.create(profile=self.profiles[2], admin_id="other",
+                                             date=datetime.date(2024, 1, 1), check_ins=5)
+        output = io.StringIO()
+        call_command("rebuild_attendance_rollups", admin="admin", stdout=output)
+
+        self.assertIn("Wrote 4 rollup rows", output.getvalue())
+        self.assertEqual([row for row in self.rollups() if row[1] == "admin"],
+                         [row for row in counted if row[1] == "admin"])
+        self.assertEqual(AttendanceDailyRollup.objects.get(admin_id="other").check_ins, 5)
+
+    def test_analytics_reads_the_rollups(self):
+        response = self.client.get(reverse("get_attendance_analytics", args=["admin"]),
+                                   {"from": "2024-03-01", "to": "2024-03-02"})
+        body = response.json()
+        self.assertEqual(body["session_days"], 2)
+        self.assertEqual([(day["date"], day["present"], day["check_ins"]) for day in body["daily"]],
+                         [("2024-03-01", 2, 3), ("2024-03-02", 1, 1)])
+        self.assertEqual([(profile["profile_id"], profile["days_present"], profile["check_ins"],
+                           profile["attendance_rate"]) for profile in body["profiles"]],
+                         [("p0", 2, 3, 1.0), ("p1", 1, 1, 0.5)])
+
+
+class DashboardTests(TestCase):
+    def setUp(self):
+        for i in range(3):
+            Profile.objects.create(profile_id=f"p{i}", profile_name=f"Person {i}",
+                                   profile_image=f"https://profiles/p{i}.jpg", admin_id="admin")
+        # 23:30 UTC on Jan 1st is already Jan 2nd in Tokyo
+        for profile_id, taken in (("p0", "2024-01-01T23:30:00+00:00"), ("p0", "2024-01-01T23:40:00+00:00"),
+                                  ("p1", "2024-01-01T10:00:00+00:00")):
+            attendance = Attendance.objects.create(profile_id=profile_id, photo_url="https://attendance/x.jpg")
+            Attendance.objects.filter(id=attendance.id).update(timestamp=datetime.datetime.fromisoformat(taken))
+
+    def test_days_follow_the_viewers_time_zone(self):
+        today = datetime.date(2024, 1, 2)
+        utc = attendance_trend("admin", datetime.timezone.utc, days=2, today=today)["days"]
+        self.assertEqual([day["attended"] for day in utc], [2, 0])
+        tokyo = attendance_trend("admin", datetime.timezone(datetime.timedelta(hours=9)), days=2, today=today)
+        self.assertEqual([(day["attended"], day["not_attended"]) for day in tokyo["days"]], [(1, 2), (1, 2)])
+
+    def test_rate_distribution_counts_absent_profiles(self):
+        buckets = attendance_rate_distribution("admin", datetime.timezone.utc, days=2,
+                                               today=datetime.date(2024, 1, 2))["buckets"]
+        self.assertEqual({bucket["label"]: bucket["value"] for bucket in buckets},
+                         {"90-100%": 0, "70-90%": 0, "50-70%": 2, "<50%": 1})
@@ -1,21 +1,38 @@
 import base64
 import datetime
+import io
 import time
 from django.shortcuts import render
 from rest_framework import viewsets
-from .serializers import AttendanceSerializer, ProfileSerializer
-from .models import Attendance, Profile
+from .serializers import AttendanceSerializer, CheckInSerializer, ProfileSerializer, serialize_attendance
+from .models import Attendance, AttendanceDailyRollup, CheckIn, Profile
+from .face_matching import index_profile_face, store_profile_embedding
+from .attendance_writer import get_attendance_writer
+from .aws_clients import get_aws_clients, render_cache_metrics
+from .caching import cached_response
+from .checkin_keys import new_checkin_key, new_group_key, new_identification_key, object_url, parse_checkin_key
+from .dashboard import attendance_rate_distribution, attendance_trend, dashboard_timezone, monthly_heatmap
+from .dedup import is_duplicate_checkin, remember_checkin
+from .images import normalize_image
+from .metrics import StageTimer, render_metrics
+from .replicas import use_read_replica
+from .roster import export_rows, import_roster, read_roster, roster_format, s3_image_uploader, uploaded_file_opener
 import boto3
 import re
 import os
 import logging
 from django.conf import settings
+from django.db.models import Count, Q, Sum
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 import json
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 
 class PeopleView(viewsets.ModelViewSet):
@@ -26,25 +43,23 @@ class PeopleView(viewsets.ModelViewSet):
 load_dotenv()
 
 
-def upload_file(file_name, bucket, object_name=None, client=None):
+def upload_fileobj(file_obj, bucket, object_name, client=None, metadata=None):
     """
-    Upload a file to an S3 bucket.
+    Stream a file-like object to an S3 bucket without touching local disk.
 
-    :param file_name: File to upload
+    :param file_obj: Readable binary file-like object (BytesIO or an uploaded file)
     :param bucket: Bucket to upload to
-    :param object_name: S3 object name, including folder path. If not specified, file_name is used.
+    :param object_name: S3 object name, including folder path
+    :param metadata: Optional S3 user metadata for the object
     :return: URL of the uploaded file if successful, else False
     """
-
-    # Set object_name to file name if not specified
-    if object_name is None:
-        object_name = os.path.basename(file_name)
-
+    extra_args = {'ContentType': 'image/jpeg'}
+    if metadata:
+        extra_args['Metadata'] = metadata
     try:
-        # Upload the file to S3
-        print(f"Uploading file {file_name} to bucket {bucket} with object name {object_name}")
-        client.upload_file(file_name, bucket, object_name)
-        file_url = f"https://{bucket}.s3.ca-central-1.amazonaws.com/{object_name}"
+        print(f"Uploading to bucket {bucket} with object name {object_name}")
+        client.upload_fileobj(file_obj, bucket, object_name, ExtraArgs=extra_args)
+        file_url = object_url(bucket, object_name)
         print(f"File uploaded successfully to {file_url}")
         return file_url
     except ClientError as e:
@@ -52,6 +67,55 @@ def upload_file(file_name, bucket, object_name=None, client=None):
         return False
 
 
+def read_attendance_image(request, body):
+    """
+    Get the attendance picture from either a multipart 'image' file or a base64 data URL.
+
+    :param request: The DRF request.
+    :param body: The parsed request data.
+    :return: Readable binary file-like object positioned at the start of the image.
+    """
+    uploaded = request.FILES.get('image')
+    if uploaded is not None:
+        return uploaded
+
+    data_url = body['image']
+    # strip the "data:image/...;base64," prefix without copying the payload through a regex
+    if data_url.startswith('data:'):
+        data_url = data_url.partition(',')[2]
+    return io.BytesIO(base64.b64decode(data_url))
+
+
+def normalize_attendance_image(image_file, group=False):
+    """
+    Orient, downsize and re-encode an attendance picture per the ATTENDANCE_PICTURE_* settings.
+
+    :param image_file: Readable binary file-like object with the uploaded picture.
+    :param group: A group picture is never cropped to one face and may be up to GROUP_PICTURE_MAX_DIMENSION.
+    :return: (file-like object with the picture to upload, original bytes).
+    :raises ValueError: If the upload is not a readable image.
+    """
+    original = image_file.read()
+    max_dimension = settings.GROUP_PICTURE_MAX_DIMENSION if group else settings.ATTENDANCE_PICTURE_MAX_DIMENSION
+    if max_dimension <= 0:
+        return io.BytesIO(original), original
+    normalized, stats = normalize_image(
+        original, max_dimension, settings.ATTENDANCE_PICTURE_QUALITY,
+        settings.ATTENDANCE_PICTURE_FACE_CROP and not group)
+    print(f"Attendance picture normalized: {stats['original_bytes']} -> {stats['normalized_bytes']} bytes "
+          f"({stats['width']}x{stats['height']})")
+    return io.BytesIO(normalized), original
+
+
+def upload_original(original, bucket, object_name, client=None):
+    """
+    Keep the unmodified upload next to the normalized picture when ATTENDANCE_PICTURE_KEEP_ORIGINAL is set.
+    """
+    if settings.ATTENDANCE_PICTURE_KEEP_ORIGINAL:
+        folder, _, file_name = object_name.rpartition('/')
+        upload_fileobj(io.BytesIO(original), bucket, folder + "/originals/" + file_name, client=client)
+
+
 def get_user_id(id_token):
     """
     Extracts the 'sub' field (Cognito user ID) from a JWT ID token.
@@ -69,10 +133,26 @@ def get_user_id(id_token):
     payload = json.loads(payload_decoded)
     return payload.get("sub")
 
-def invoke_lambda(path, client=None):
+def invoke_lambda(path, client=None, timer=None):
+    response_payload = invoke_lambda_payload(path, client, timer)
+    status_code = response_payload.get('statusCode', 500)
+    status = response_payload.get('status', 'Unknown error')
+    body = response_payload.get('body', 'Unknown error')
+    return status_code, status, body
+
+
+def invoke_lambda_payload(path, client=None, timer=None):
+    """
+    Verify one attendance picture synchronously. With ATTENDANCE_WRITE_BEHIND, a
+    verified check-in is recorded through the attendance writer instead of by the Lambda.
+
+    :return: The Lambda's full response, including 'profileID' and 'similarity' for identification pictures.
+    """
     lambda_function_name = 'facialRecognition'
     payload = {
-        'path': path
+        'path': path,
+        # the Lambda hands a verified row back instead of inserting it
+        'defer': settings.ATTENDANCE_WRITE_BEHIND
     }
     try:
         response = client.invoke(
@@ -81,75 +161,177 @@ def invoke_lambda(path, client=None):
             Payload=json.dumps(payload)
         )
         response_payload = json.loads(response['Payload'].read())
-        status_code = response_payload.get('statusCode', 500)
-        status = response_payload.get('status', 'Unknown error')
-        body = response_payload.get('body', 'Unknown error')
-        return status_code, status, body
+        if timer is not None:
+            timer.add_remote('lambda', response_payload.get('timings'))
+    except ClientError as e:
+        raise RuntimeError(f"Error invoking Lambda: {e}")
+
+    attendance = response_payload.get('attendance')
+    if attendance:
+        # spooled before the check-in is confirmed, written with the next batch
+        get_attendance_writer().accept(attendance['profileID'], attendance['photoURL'],
+                                       parse_capture_time(attendance['timestamp']), attendance['objectKey'])
+    return response_payload
+
+
+def invoke_lambda_async(path, ticket_id, client=None):
+    """
+    Queue verification of an attendance picture without waiting for the result.
+
+    The Lambda writes the outcome to the CheckIn row identified by ticket_id.
+    """
+    payload = {
+        'path': path,
+        'ticket': str(ticket_id)
+    }
+    try:
+        client.invoke(
+            FunctionName='facialRecognition',
+            InvocationType='Event',
+            Payload=json.dumps(payload)
+        )
+    except ClientError as e:
+        raise RuntimeError(f"Error invoking Lambda: {e}")
+
+
+def invoke_lambda_batch(paths, client=None, timer=None):
+    """
+    Verify several attendance pictures with one Lambda invocation.
+
+    :param timer: Optional StageTimer that receives the Lambda's stage timings.
+    :return: List of per-picture results in the order of paths.
+    """
+    payload = {
+        'paths': paths
+    }
+    try:
+        response = client.invoke(
+            FunctionName='facialRecognition',
+            InvocationType='RequestResponse',
+            Payload=json.dumps(payload)
+        )
+        response_payload = json.loads(response['Payload'].read())
+        results = response_payload.get('results') or []
+        if timer is not None:
+            timer.add_remote('lambda', response_payload.get('timings'))
+        if len(results) != len(paths):
+            error = response_payload.get('body', 'Unknown error')
+            results = [{'statusCode': 500, 'status': 'failure', 'body': error}] * len(paths)
+        return results
     except ClientError as e:
         raise RuntimeError(f"Error invoking Lambda: {e}")
 
-# store and upload the attendance picture to s3, then delete the file
+# store and upload the attendance picture to s3, then verify it
+
+
+def attendance_picture_too_large(request, image_file=None):
+    """
+    Check the declared body size before the body is read; base64 inflates by 4/3
+    and the remaining fields (mostly the ID token) need a few KB on top.
+    Chunked requests declare no size, so the picture itself is checked once read.
+
+    :param image_file: The picture from read_attendance_image, once the body is read.
+    """
+    if image_file is not None:
+        return attendance_picture_size(image_file) > settings.ATTENDANCE_PICTURE_MAX_BYTES
+    max_bytes = settings.ATTENDANCE_PICTURE_MAX_BYTES
+    if not request.content_type.startswith('multipart/'):
+        max_bytes = max_bytes * 4 // 3
+    return int(request.META.get('CONTENT_LENGTH') or 0) > max_bytes + 8192
+
+
+def attendance_picture_key(cognito_id, profile_id, timestamp=None):
+    """
+    Key of a new attendance picture taken at the ISO timestamp (default now); the Lambda parses it back.
+
+    :return: CheckinKey with the S3 key and the metadata to store with the object.
+    :raises ValueError: If the timestamp or profile ID cannot be used in a key.
+    """
+    return new_checkin_key(cognito_id, profile_id, parse_capture_time(timestamp))
 
 
 @api_view(['POST'])
 def upload_attendance_picture(request):
-    body = json.loads(request.body)
-    # transform the base64 image to a file
-    image_recovered = base64.b64decode(
-        re.sub('^data:image/.+;base64,', '', body['image']))
-    # get the current timestamp
-    current_timestamp = datetime.datetime.now(
-        datetime.timezone.utc).strftime('%Y-%m-%d_%H-%M-%S')
-    # generate a uuid for the image
-    myuuid = uuid.uuid4()
+    # reject oversized payloads before reading the body
+    if attendance_picture_too_large(request):
+        return Response({'error': 'Attendance picture is too large'}, status=413)
+
+    timer = StageTimer('checkin')
+    # accepts either JSON with a base64 'image' or multipart form data with an 'image' file
+    with timer.stage('decode'):
+        body = request.data
+        image_file = read_attendance_image(request, body)
+    if attendance_picture_too_large(request, image_file):
+        timer.finish(status='too_large')
+        return Response({'error': 'Attendance picture is too large'}, status=413)
     profileID = body['profileID']
 
-    client = boto3.client("cognito-identity", region_name=body['region'])
-    identity_response = client.get_id(
-        IdentityPoolId=body['identityPoolId'],
-        Logins={
-            'cognito-idp.' + body['region'] + '.amazonaws.com/' + body['userPoolId']: body['idToken']
-        }
-    )
-    identity_id = identity_response['IdentityId']
-    response = client.get_credentials_for_identity(
-        IdentityId=identity_id,
-        Logins={
-            'cognito-idp.' + body['region'] + '.amazonaws.com/' + body['userPoolId']: body['idToken']
-        }
-    )
-
-    s3_client = boto3.client(
-        's3',
-        aws_access_key_id=response['Credentials']['AccessKeyId'],
-        aws_secret_access_key=response['Credentials']['SecretKey'],
-        aws_session_token=response['Credentials']['SessionToken']
-    )
+    # repeat presses are rejected before any S3 or Rekognition work
+    with timer.stage('dedup_check'):
+        duplicate = is_duplicate_checkin(profileID)
+    if duplicate:
+        timer.finish(status='duplicate')
+        return Response(duplicate_checkin_result(profileID), status=200)
+
+    try:
+        with timer.stage('normalize'):
+            image_file, original = normalize_attendance_image(image_file)
+    except ValueError as e:
+        timer.finish(status='invalid_image')
+        return Response({'error': str(e)}, status=400)
 
     cognitoID = get_user_id(body['idToken'])
-    attendance_picture_s3_path = cognitoID + "/attendance_" + \
-        profileID + "_" + current_timestamp + ".jpg"
-    attendance_picture_local_path = "./attendance/attendance_" + \
-        current_timestamp + "_" + str(myuuid) + ".jpg"
-
-    with open(attendance_picture_local_path, "wb") as attendance_picture_file:
-        attendance_picture_file.write(image_recovered)
-
-    # upload the attendance picture to s3
-    attendance_picture_url = upload_file(file_name=attendance_picture_local_path, bucket=os.getenv(
-        "ATTENDANCE_PICTURE_BUCKET_NAME"), object_name=attendance_picture_s3_path, client=s3_client)
-
-    # delete the attendance picture file
-    os.remove(attendance_picture_local_path)
-
-    lambda_client = boto3.client(
-        'lambda',
-        region_name='ca-central-1',
-        aws_access_key_id=response['Credentials']['AccessKeyId'],
-        aws_secret_access_key=response['Credentials']['SecretKey'],
-        aws_session_token=response['Credentials']['SessionToken']
-    )
-    response_status_code, response_status, response_body = invoke_lambda(attendance_picture_url, lambda_client)
+    # temporary credentials and clients are reused until shortly before they expire
+    with timer.stage('cognito'):
+        s3_client, lambda_client = get_aws_clients(
+            body['region'], body['identityPoolId'], body['userPoolId'], body['idToken'], cognitoID)
+
+    try:
+        checkin_key = attendance_picture_key(cognitoID, profileID)
+    except ValueError as e:
+        timer.finish(status='invalid_key')
+        return Response({'error': str(e)}, status=400)
+
+    # stream the attendance picture to s3 straight from memory
+    with timer.stage('s3_upload'):
+        attendance_picture_url = upload_fileobj(image_file, bucket=os.getenv(
+            "ATTENDANCE_PICTURE_BUCKET_NAME"), object_name=checkin_key.key, client=s3_client,
+            metadata=checkin_key.metadata)
+        upload_original(original, os.getenv("ATTENDANCE_PICTURE_BUCKET_NAME"),
+                        checkin_key.key, client=s3_client)
+
+    return verify_attendance_picture(attendance_picture_url, profileID, body, lambda_client, timer)
+
+
+def verify_attendance_picture(attendance_picture_url, profileID, body, lambda_client, timer):
+    """
+    Have the Lambda verify an uploaded attendance picture and build the check-in response.
+
+    :param body: The request data; its optional 'async' flag selects a ticket response.
+    :param timer: The request's StageTimer, finished here.
+    """
+    # in async mode, hand verification to the Lambda and return a ticket right away
+    async_mode = str(body.get('async', settings.CHECKIN_ASYNC)).lower() in ('true', '1')
+    if async_mode:
+        checkin = CheckIn.objects.create(
+            profile_id=profileID, photo_url=attendance_picture_url)
+        try:
+            with timer.stage('lambda_invoke'):
+                invoke_lambda_async(attendance_picture_url, checkin.ticket_id, lambda_client)
+        except RuntimeError as e:
+            checkin.status = CheckIn.FAILED
+            checkin.message = str(e)
+            checkin.save()
+        timer.finish(status=checkin.status)
+        serializer = CheckInSerializer(checkin)
+        return Response(serializer.data, status=202)
+
+    with timer.stage('lambda_invoke'):
+        response_status_code, response_status, response_body = invoke_lambda(
+            attendance_picture_url, lambda_client, timer)
+    timer.finish(status=response_status, status_code=response_status_code)
+    if response_status == 'success':
+        remember_checkin(profileID)
     print(f"Lambda invoked for {attendance_picture_url} \n"
       f"Status Code: {response_status_code}\n"
       f"Status: {response_status}\n"
@@ -157,6 +339,334 @@ def upload_attendance_picture(request):
     return Response({'statusCode': response_status_code, 'status': response_status, 'message': response_body}, status=200)
 
 
+@api_view(['POST'])
+def identify_attendance_picture(request):
+    """
+    Check in whoever is in the picture: the Lambda searches the admin's enrolled
+    faces instead of comparing against one profile chosen by the kiosk.
+
+    Takes the same fields as upload_attendance_picture without 'profileID'; the
+    response adds the identified 'profileID' and its 'similarity' on a match.
+    """
+    timer = StageTimer('identify')
+    result = identify_in_picture(request, timer, new_identification_key)
+    if isinstance(result, Response):
+        return result
+    profileID = result.get('profileID')
+    if result.get('status') == 'success' and profileID:
+        remember_checkin(profileID)
+    return Response({'statusCode': result.get('statusCode', 500), 'status': result.get('status', 'Unknown error'),
+                     'message': result.get('body', 'Unknown error'), 'profileID': profileID,
+                     'similarity': result.get('similarity')}, status=200)
+
+
+@api_view(['POST'])
+def upload_group_attendance_picture(request):
+    """
+    Check in every enrolled profile recognized in a group picture, e.g. a whole class at once.
+
+    Takes the same fields as identify_attendance_picture. The response lists one
+    entry per detected face with its 'boundingBox' (fractions of the picture
+    size), 'profileID', 'similarity' and 'status': 'success', 'duplicate' (already
+    checked in) or 'unrecognized'.
+    """
+    timer = StageTimer('group_checkin')
+    result = identify_in_picture(request, timer, new_group_key, group=True)
+    if isinstance(result, Response):
+        return result
+    faces = result.get('faces') or []
+    for face in faces:
+        if face['status'] == 'success':
+            remember_checkin(face['profileID'])
+    return Response({'statusCode': result.get('statusCode', 500), 'status': result.get('status', 'Unknown error'),
+                     'message': result.get('body', 'Unknown error'), 'faces': faces}, status=200)
+
+
+def identify_in_picture(request, timer, new_key, group=False):
+    """
+    Upload a picture without a profile ID and have the Lambda identify the faces in it.
+
+    :param new_key: Builds the picture's CheckinKey from the admin ID.
+    :param group: Keep the picture whole and larger, for many faces.
+    :return: The Lambda's response (the request's StageTimer is finished), or an error Response.
+    """
+    if attendance_picture_too_large(request):
+        return Response({'error': 'Attendance picture is too large'}, status=413)
+
+    with timer.stage('decode'):
+        body = request.data
+        image_file = read_attendance_image(request, body)
+    if attendance_picture_too_large(request, image_file):
+        timer.finish(status='too_large')
+        return Response({'error': 'Attendance picture is too large'}, status=413)
+    try:
+        with timer.stage('normalize'):
+            image_file, original = normalize_attendance_image(image_file, group=group)
+    except ValueError as e:
+        timer.finish(status='invalid_image')
+        return Response({'error': str(e)}, status=400)
+
+    cognitoID = get_user_id(body['idToken'])
+    with timer.stage('cognito'):
+        s3_client, lambda_client = get_aws_clients(
+            body['region'], body['identityPoolId'], body['userPoolId'], body['idToken'], cognitoID)
+    try:
+        checkin_key = new_key(cognitoID)
+    except ValueError as e:
+        timer.finish(status='invalid_key')
+        return Response({'error': str(e)}, status=400)
+
+    bucket = os.getenv("ATTENDANCE_PICTURE_BUCKET_NAME")
+    with timer.stage('s3_upload'):
+        attendance_picture_url = upload_fileobj(image_file, bucket=bucket, object_name=checkin_key.key,
+                                                client=s3_client, metadata=checkin_key.metadata)
+        upload_original(original, bucket, checkin_key.key, client=s3_client)
+
+    with timer.stage('lambda_invoke'):
+        result = invoke_lambda_payload(attendance_picture_url, lambda_client, timer)
+    timer.finish(status=result.get('status', 'Unknown error'), status_code=result.get('statusCode', 500))
+    return result
+
+
+def attendance_bucket_url(object_name):
+    return object_url(os.getenv('ATTENDANCE_PICTURE_BUCKET_NAME'), object_name)
+
+
+@api_view(['POST'])
+def get_attendance_upload_url(request):
+    """
+    Issue a short-lived presigned POST so the browser uploads an attendance picture straight to S3.
+
+    The picture is then verified with verify_uploaded_attendance_picture. The
+    presigned form pins the key, the JPEG content type and the size limit.
+    """
+    body = request.data
+    try:
+        profileID = body['profileID']
+        cognitoID = get_user_id(body['idToken'])
+        checkin_key = attendance_picture_key(cognitoID, profileID)
+    except (KeyError, ValueError) as e:
+        return Response({'error': f"Invalid request: {e}"}, status=400)
+
+    if is_duplicate_checkin(profileID):
+        return Response(duplicate_checkin_result(profileID), status=200)
+
+    s3_client, _ = get_aws_clients(
+        body['region'], body['identityPoolId'], body['userPoolId'], body['idToken'], cognitoID)
+    fields = {'Content-Type': 'image/jpeg',
+              **{f"x-amz-meta-{name}": value for name, value in checkin_key.metadata.items()}}
+    try:
+        upload = s3_client.generate_presigned_post(
+            os.getenv("ATTENDANCE_PICTURE_BUCKET_NAME"), checkin_key.key,
+            Fields=fields,
+            Conditions=[{name: value} for name, value in fields.items()] +
+                       [['content-length-range', 1, settings.ATTENDANCE_PICTURE_MAX_BYTES]],
+            ExpiresIn=settings.ATTENDANCE_UPLOAD_URL_EXPIRES)
+    except ClientError as e:
+        logging.error(e)
+        return Response({'error': 'Could not create an upload URL'}, status=502)
+    return Response({'url': upload['url'], 'fields': upload['fields'], 'key': checkin_key.key,
+                     'expiresIn': settings.ATTENDANCE_UPLOAD_URL_EXPIRES}, status=200)
+
+
+@api_view(['POST'])
+def verify_uploaded_attendance_picture(request):
+    """
+    Verify an attendance picture uploaded through get_attendance_upload_url.
+
+    Only keys issued to the caller for the given profile, and recent enough to
+    come from a live upload URL, are accepted.
+    """
+    timer = StageTimer('checkin_presigned')
+    body = request.data
+    try:
+        profileID = body['profileID']
+        cognitoID = get_user_id(body['idToken'])
+        object_name = body['key']
+        checkin_key = parse_checkin_key(object_name)
+        if (checkin_key.version == 1 or checkin_key.admin_id != cognitoID
+                or checkin_key.profile_id != profileID):
+            raise ValueError("key was not issued for this user and profile")
+        age = datetime.datetime.now(datetime.timezone.utc) - checkin_key.taken_at
+        # allow for the upload itself and some clock skew on top of the URL's lifetime
+        if age > datetime.timedelta(seconds=settings.ATTENDANCE_UPLOAD_URL_EXPIRES + 60):
+            raise ValueError("upload URL has expired")
+    except (KeyError, ValueError) as e:
+        return Response({'error': f"Invalid request: {e}"}, status=400)
+
+    with timer.stage('dedup_check'):
+        duplicate = is_duplicate_checkin(profileID)
+    if duplicate:
+        timer.finish(status='duplicate')
+        return Response(duplicate_checkin_result(profileID), status=200)
+
+    with timer.stage('cognito'):
+        _, lambda_client = get_aws_clients(
+            body['region'], body['identityPoolId'], body['userPoolId'], body['idToken'], cognitoID)
+    return verify_attendance_picture(attendance_bucket_url(object_name), profileID, body, lambda_client, timer)
+
+
+def duplicate_checkin_result(profile_id):
+    return {'statusCode': 409, 'status': 'failure',
+            'message': f"Profile {profile_id} has already checked in"}
+
+
+def read_batch_items(request, body):
+    """
+    Get (image file, profileID, timestamp) tuples from a batch check-in request.
+
+    Accepts JSON with an 'items' list of {image, profileID, timestamp?} or multipart
+    form data with repeated 'image', 'profileID' and optional 'timestamp' fields.
+    Timestamps are when an offline device captured the photo; they default to now.
+    """
+    if request.FILES:
+        images = request.FILES.getlist('image')
+        profile_ids = body.getlist('profileID')
+        timestamps = body.getlist('timestamp') or [None] * len(images)
+        if not (len(images) == len(profile_ids) == len(timestamps)):
+            raise ValueError("Each image needs a profileID (and a timestamp, if any are given)")
+        return list(zip(images, profile_ids, timestamps))
+
+    return [(read_attendance_image(request, item), item['profileID'], item.get('timestamp'))
+            for item in body['items']]
+
+
+def batch_item_count(request, body):
+    """
+    Number of pictures in a batch check-in request, counted without decoding them.
+    """
+    if request.FILES:
+        return len(request.FILES.getlist('image'))
+    return len(body['items'])
+
+
+def attendance_picture_size(image_file):
+    """
+    :param image_file: An uploaded file, or a BytesIO holding a decoded base64 picture.
+    :return: Size of the picture in bytes.
+    """
+    size = getattr(image_file, 'size', None)
+    return size if size is not None else image_file.getbuffer().nbytes
+
+
+def parse_capture_time(timestamp=None):
+    """
+    Parse the ISO timestamp an offline device captured a picture at; None (or empty) means now.
+    """
+    if not timestamp:
+        return None
+    moment = datetime.datetime.fromisoformat(timestamp)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment
+
+
+@api_view(['POST'])
+def upload_attendance_pictures(request):
+    timer = StageTimer('batch_checkin')
+    body = request.data
+    try:
+        if batch_item_count(request, body) > settings.BATCH_CHECKIN_MAX_ITEMS:
+            return Response({'error': f"A batch can hold at most {settings.BATCH_CHECKIN_MAX_ITEMS} pictures"}, status=413)
+        with timer.stage('decode'):
+            items = read_batch_items(request, body)
+        checkin_keys = []
+        cognitoID = get_user_id(body['idToken'])
+        for _, profileID, timestamp in items:
+            checkin_keys.append(attendance_picture_key(cognitoID, profileID, timestamp))
+    except (KeyError, ValueError) as e:
+        return Response({"error": f"Invalid batch: {e}"}, status=400)
+
+    with timer.stage('cognito'):
+        s3_client, lambda_client = get_aws_clients(
+            body['region'], body['identityPoolId'], body['userPoolId'], body['idToken'], cognitoID)
+    bucket = os.getenv("ATTENDANCE_PICTURE_BUCKET_NAME")
+
+    # live check-ins (no capture timestamp) are deduplicated up front; buffered
+    # ones are left to the unique dedup window key on insert
+    with timer.stage('dedup_check'):
+        duplicates = {index for index, (_, profileID, timestamp) in enumerate(items)
+                      if not timestamp and is_duplicate_checkin(profileID)}
+
+    # index -> (status code, message) of pictures not uploaded
+    rejected = {}
+
+    def upload(index):
+        if index in duplicates:
+            return None
+        if attendance_picture_size(items[index][0]) > settings.ATTENDANCE_PICTURE_MAX_BYTES:
+            rejected[index] = (413, 'Attendance picture is too large')
+            return None
+        try:
+            with timer.stage('normalize'):
+                image_file, original = normalize_attendance_image(items[index][0])
+        except ValueError as e:
+            rejected[index] = (400, str(e))
+            return None
+        with timer.stage('s3_upload'):
+            url = upload_fileobj(image_file, bucket, checkin_keys[index].key, client=s3_client,
+                                 metadata=checkin_keys[index].metadata)
+            upload_original(original, bucket, checkin_keys[index].key, client=s3_client)
+        return url
+
+    # upload all pictures concurrently, then verify them in parallel Lambda batches;
+    # per-picture stages add up across worker threads
+    with ThreadPoolExecutor(max_workers=settings.BATCH_UPLOAD_WORKERS) as executor:
+        urls = list(executor.map(upload, range(len(items))))
+
+    uploaded = [index for index, url in enumerate(urls) if url]
+    chunks = [uploaded[i:i + settings.BATCH_LAMBDA_SIZE]
+              for i in range(0, len(uploaded), settings.BATCH_LAMBDA_SIZE)]
+    results = [{'statusCode': 500, 'status': 'failure', 'body': 'Upload to S3 failed'}] * len(items)
+    with timer.stage('lambda_invoke'), ThreadPoolExecutor(max_workers=settings.BATCH_UPLOAD_WORKERS) as executor:
+        futures = [executor.submit(invoke_lambda_batch, [urls[index] for index in chunk], lambda_client, timer)
+                   for chunk in chunks]
+        for chunk, future in zip(chunks, futures):
+            try:
+                chunk_results = future.result()
+            except RuntimeError as e:
+                chunk_results = [{'statusCode': 500, 'status': 'failure', 'body': str(e)}] * len(chunk)
+            for index, result in zip(chunk, chunk_results):
+                results[index] = result
+    for index in duplicates:
+        result = duplicate_checkin_result(items[index][1])
+        results[index] = {**result, 'body': result['message']}
+    for index, (status_code, error) in rejected.items():
+        results[index] = {'statusCode': status_code, 'status': 'failure', 'body': error}
+
+    response_items = [{
+        'profileID': profileID,
+        'url': url or None,
+        'statusCode': result.get('statusCode', 500),
+        'status': result.get('status', 'failure'),
+        'message': result.get('body', 'Unknown error'),
+    } for (_, profileID, _), url, result in zip(items, urls, results)]
+    recorded = sum(1 for item in response_items if item['status'] == 'success')
+    for item, (_, _, timestamp) in zip(response_items, items):
+        if item['status'] == 'success' and not timestamp:
+            remember_checkin(item['profileID'])
+    print(f"Batch check-in: {recorded} of {len(items)} recorded")
+    timer.finish(recorded=recorded, total=len(items))
+    return Response({'recorded': recorded, 'total': len(items), 'results': response_items}, status=200)
+
+
+def metrics(request):
+    """
+    Check-in stage latency histograms and credential cache counters in the Prometheus text format.
+    """
+    return HttpResponse(render_metrics() + render_cache_metrics(), content_type='text/plain; version=0.0.4')
+
+
+@api_view(['GET'])
+def get_checkin_status(request, ticket_id):
+    try:
+        checkin = CheckIn.objects.get(ticket_id=ticket_id)
+        serializer = CheckInSerializer(checkin)
+        return Response(serializer.data, status=200)
+    except CheckIn.DoesNotExist:
+        return Response({"error": f"Check-in {ticket_id} not found"}, status=404)
+
+
 @api_view(['POST'])
 def create_profile(request):
     try:
@@ -169,29 +679,173 @@ def create_profile(request):
             profile_image=body['profileImageUrl'],
             admin_id=body['adminID']
         )
+        store_profile_embedding(new_profile)
+        index_profile_face(new_profile)
 
         serializer = ProfileSerializer(new_profile)
         return Response(serializer.data, status=201)
     except Exception as e:
         return Response({"error": str(e)}, status=400)
 
+@api_view(['POST'])
+def import_profiles(request):
+    """
+    Create or update many profiles at once.
+
+    Accepts multipart form data with a 'roster' CSV/JSON Lines file plus any
+    'image' files it names, or JSON with a 'profiles' list. Rows failing
+    validation or upload are reported per line; the rest are still imported.
+    """
+    body = request.data
+    try:
+        roster = request.FILES.get('roster')
+        if roster is not None:
+            fmt = body.get('format') or roster_format(roster.name)
+            rows = read_roster(io.TextIOWrapper(roster.file, encoding='utf-8', newline=''), fmt)
+        else:
+            rows = enumerate(body['profiles'], start=1)
+        images = {image.name: uploaded_file_opener(image) for image in request.FILES.getlist('image')}
+
+        upload = None
+        default_admin_id = body.get('adminID')
+        if images:
+            cognitoID = get_user_id(body['idToken'])
+            s3_client, _ = get_aws_clients(
+                body['region'], body['identityPoolId'], body['userPoolId'], body['idToken'], cognitoID)
+            upload = s3_image_uploader(os.getenv("PROFILE_PICTURE_BUCKET_NAME"), s3_client)
+            default_admin_id = default_admin_id or cognitoID
+
+        summary = import_roster(rows, images, upload, default_admin_id,
+                                settings.PROFILE_IMPORT_BATCH_SIZE, settings.BATCH_UPLOAD_WORKERS)
+    except (KeyError, ValueError) as e:
+        return Response({"error": f"Invalid roster: {e}"}, status=400)
+    print(f"Profile import: {summary['created']} created, {summary['updated']} updated, "
+          f"{len(summary['errors'])} failed")
+    return Response(summary, status=200)
+
+
 @api_view(['GET'])
+def export_admin_data(request, admin_id):
+    """
+    Stream an admin's profiles (?type=profiles) or attendance (?type=attendance) as CSV or JSON Lines
+    (?file_format=; DRF keeps ?format= for content negotiation).
+    """
+    kind = request.query_params.get('type', 'profiles')
+    fmt = request.query_params.get('file_format', 'csv')
+    try:
+        lines = export_rows(kind, admin_id, fmt)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+    response = StreamingHttpResponse(lines, content_type='text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    response['Content-Disposition'] = f'attachment; filename="{kind}_{admin_id}.{fmt}"'
+    return response
+
+
+@api_view(['GET'])
+@use_read_replica
 # get all profiles for a user from mysql
 def get_profiles(request, profile_id):
     try:
         profiles = Profile.objects.filter(profile_id=profile_id)
-        serializer = ProfileSerializer(profiles, many=True)
-        return Response(serializer.data, status=200)
+        return cached_response(request, f"profiles:{profile_id}",
+                               lambda: list(ProfileSerializer(profiles, many=True).data))
     except Exception as e:
         return Response({"error": str(e)}, status=400)
 
+def parse_query_datetime(value, end_of_day=False):
+    """
+    Parse an ISO date or datetime query parameter into an aware datetime.
+
+    A bare date means the start of that day, or the start of the next day when
+    end_of_day is set, so that 'to=2024-01-31' includes all of January 31.
+    """
+    day = parse_date(value)
+    if day is not None:
+        if end_of_day:
+            day += datetime.timedelta(days=1)
+        moment = datetime.datetime.combine(day, datetime.time.min)
+    else:
+        moment = parse_datetime(value)
+        if moment is None:
+            raise ValueError(f"Invalid date: {value}")
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, datetime.timezone.utc)
+    return moment
+
+
+def encode_cursor(timestamp, attendance_id):
+    return base64.urlsafe_b64encode(
+        f"{timestamp}|{attendance_id}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    timestamp, attendance_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.datetime.fromisoformat(timestamp), int(attendance_id)
+
+
+def filter_attendance(attendance, params):
+    """
+    Apply the optional 'from', 'to' and 'profile_id' query parameters.
+    """
+    if params.get('from'):
+        attendance = attendance.filter(timestamp__gte=parse_query_datetime(params['from']))
+    if params.get('to'):
+        attendance = attendance.filter(timestamp__lt=parse_query_datetime(params['to'], end_of_day=True))
+    if params.get('profile_id'):
+        attendance = attendance.filter(profile_id=params['profile_id'])
+    return attendance
+
+
+def attendance_query(admin_id, params):
+    """
+    Build the attendance queryset for an admin from the list endpoint's query parameters.
+
+    :return: (queryset, page size), with a page size of None for the full list.
+    """
+    # a single joined query; profile fields are read alongside each row
+    attendance = filter_attendance(Attendance.objects.filter(profile__admin_id=admin_id), params)
+    if 'limit' not in params and 'cursor' not in params:
+        return attendance, None
+    limit = min(int(params.get('limit', settings.ATTENDANCE_PAGE_SIZE)), settings.ATTENDANCE_PAGE_MAX_SIZE)
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    attendance = attendance.order_by('-timestamp', '-id')
+    if params.get('cursor'):
+        timestamp, attendance_id = decode_cursor(params['cursor'])
+        attendance = attendance.filter(
+            Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=attendance_id))
+    return attendance, limit
+
+
+def attendance_page(rows, limit):
+    """
+    Cut limit + 1 serialized rows down to a page and the cursor of the page after it.
+    """
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(rows[limit - 1]['timestamp'], rows[limit - 1]['id'])
+    return {'results': rows[:limit], 'next_cursor': next_cursor}
+
+
 @api_view(['GET'])
+@use_read_replica
 def get_attendance_by_admin(request, admin_id):
+    """
+    List an admin's attendance records, optionally filtered by 'from', 'to' and 'profile_id'.
+
+    Without 'limit' or 'cursor' the full list is returned. With them, records come
+    newest first in pages keyed on (timestamp, id), as {results, next_cursor}.
+    """
     try:
-        profiles = Profile.objects.filter(admin_id=admin_id)
-        attendance = Attendance.objects.filter(profile__in=profiles)
-        serializer = AttendanceSerializer(attendance, many=True)
-        return Response(serializer.data, status=200)
+        attendance, limit = attendance_query(admin_id, request.query_params)
+
+        def build():
+            if limit is None:
+                return serialize_attendance(attendance)
+            # fetch one extra row to know whether another page follows
+            return attendance_page(serialize_attendance(attendance[:limit + 1]), limit)
+
+        return cached_response(request, f"attendance:{admin_id}", build)
     except Exception as e:
         return Response({"error": str(e)}, status=400)
 
@@ -201,18 +855,136 @@ def update_profile(request):
         body = json.loads(request.body)
         profile = Profile.objects.get(profile_id=body['profileID'])
         profile.profile_name = body['profileName']
+        image_changed = profile.profile_image != body['profileImageUrl']
         profile.profile_image = body['profileImageUrl']
+        if image_changed:
+            # the stored embedding and face analysis belong to the old image
+            profile.face_embedding = None
+            profile.face_analysis = None
+            profile.image_version += 1
         profile.save()
+        if image_changed:
+            store_profile_embedding(profile)
+            index_profile_face(profile)
         serializer = ProfileSerializer(profile)
         return Response(serializer.data, status=200)
     except Exception as e:
         return Response({"error": str(e)}, status=400)
     
 @api_view(['GET'])
+@use_read_replica
 def get_profile_by_admin(request, admin_id):
     try:
         profiles = Profile.objects.filter(admin_id=admin_id)
-        serializer = ProfileSerializer(profiles, many=True)
-        return Response(serializer.data, status=200)
+        return cached_response(request, f"profiles-by-admin:{admin_id}",
+                               lambda: list(ProfileSerializer(profiles, many=True).data))
+    except Exception as e:
+        return Response({"error": str(e)}, status=400)
+
+
+def parse_query_date(value):
+    day = parse_date(value)
+    if day is None:
+        raise ValueError(f"Invalid date: {value}")
+    return day
+
+
+@api_view(['GET'])
+@use_read_replica
+def get_attendance_analytics(request, admin_id):
+    """
+    Aggregate an admin's attendance from the daily rollups, optionally between 'from' and 'to' dates.
+
+    Returns per-day totals, per-profile counts and attendance rates, where a profile's
+    rate is the share of session days (days with any check-in) it was present on.
+    """
+    try:
+        rollups = AttendanceDailyRollup.objects.filter(admin_id=admin_id)
+        date_filter = Q()
+        if request.query_params.get('from'):
+            date_filter &= Q(attendancedailyrollup__date__gte=parse_query_date(request.query_params['from']))
+            rollups = rollups.filter(date__gte=parse_query_date(request.query_params['from']))
+        if request.query_params.get('to'):
+            date_filter &= Q(attendancedailyrollup__date__lte=parse_query_date(request.query_params['to']))
+            rollups = rollups.filter(date__lte=parse_query_date(request.query_params['to']))
+
+        daily = list(rollups.values('date')
+                     .annotate(present=Count('profile_id'), check_ins=Sum('check_ins'))
+                     .order_by('date'))
+        session_days = len(daily)
+
+        profiles = (Profile.objects.filter(admin_id=admin_id)
+                    .annotate(days_present=Count('attendancedailyrollup', filter=date_filter),
+                              check_ins=Sum('attendancedailyrollup__check_ins', filter=date_filter))
+                    .values('profile_id', 'profile_name', 'days_present', 'check_ins')
+                    .order_by('profile_id'))
+        profile_stats = [{
+            **profile,
+            'check_ins': profile['check_ins'] or 0,
+            'attendance_rate': profile['days_present'] / session_days if session_days else 0.0,
+        } for profile in profiles]
+
+        return Response({
+            'session_days': session_days,
+            'profile_count': len(profile_stats),
+            'daily': daily,
+            'profiles': profile_stats,
+        }, status=200)
+    except Exception as e:
+        return Response({"error": str(e)}, status=400)
+
+
+def parse_days(value, default, maximum=366):
+    if not value:
+        return default
+    if not value.isdigit() or not 1 <= int(value) <= maximum:
+        raise ValueError(f"days must be between 1 and {maximum}")
+    return int(value)
+
+
+@api_view(['GET'])
+@use_read_replica
+def get_attendance_trend(request, admin_id):
+    """
+    Attended and absent counts per day over the last 'days' days (default 10), in time zone 'tz'.
+    """
+    try:
+        tz = dashboard_timezone(request.query_params.get('tz'))
+        days = parse_days(request.query_params.get('days'), 10)
+        return Response(attendance_trend(admin_id, tz, days), status=200)
+    except Exception as e:
+        return Response({"error": str(e)}, status=400)
+
+
+@api_view(['GET'])
+@use_read_replica
+def get_attendance_heatmap(request, admin_id):
+    """
+    Check-ins per day of the month 'month' (YYYY-MM, default the current month), in time zone 'tz'.
+    """
+    try:
+        tz = dashboard_timezone(request.query_params.get('tz'))
+        year = month = None
+        if request.query_params.get('month'):
+            try:
+                year, month = map(int, request.query_params['month'].split('-'))
+                datetime.date(year, month, 1)
+            except ValueError:
+                raise ValueError(f"Invalid month: {request.query_params['month']}")
+        return Response(monthly_heatmap(admin_id, tz, year, month), status=200)
+    except Exception as e:
+        return Response({"error": str(e)}, status=400)
+
+
+@api_view(['GET'])
+@use_read_replica
+def get_attendance_rate_distribution(request, admin_id):
+    """
+    Profiles per attendance-rate bucket over the last 'days' days (default 30), in time zone 'tz'.
+    """
+    try:
+        tz = dashboard_timezone(request.query_params.get('tz'))
+        days = parse_days(request.query_params.get('days'), 30)
+        return Response(attendance_rate_distribution(admin_id, tz, days), status=200)
     except Exception as e:
         return Response({"error": str(e)}, status=400)
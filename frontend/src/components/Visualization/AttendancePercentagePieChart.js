@@ -2,7 +2,7 @@ import React, { useEffect, useRef } from "react";
 import * as d3 from "d3";
 import {colorBlue, colorGrey, colorTheme, colorYellow} from "../../constant/Constant";
 
-const AttendancePercentagePieChart = ({ attendanceData }) => {
+const AttendancePercentagePieChart = ({ distribution }) => {
     const svgRef = useRef();
 
     useEffect(() => {
@@ -19,14 +19,6 @@ const AttendancePercentagePieChart = ({ attendanceData }) => {
             .append("g")
             .attr("transform", `translate(${width / 3}, ${height / 2})`);
 
-        // Calculate attendance percentages
-        const daysInMonth = 30;
-        const attendees = {};
-
-        const today = new Date();
-        const thirtyDaysAgo = new Date(today);
-        thirtyDaysAgo.setDate(today.getDate() - 30);
-
         // Add tooltip
         const tooltip = d3
             .select("body")
@@ -41,38 +33,8 @@ const AttendancePercentagePieChart = ({ attendanceData }) => {
             .style("visibility", "hidden")
             .style("pointer-events", "none");
 
-        Object.values(attendanceData).forEach((attendanceList) => {
-            attendanceList.forEach((entry) => {
-                if (!attendees[entry.profile_name]) {
-                    attendees[entry.profile_name] = 0;
-                }
-                if (entry.attendance === true) {
-                    attendees[entry.profile_name]++;
-                }
-            });
-        });
-
-        const categories = {
-            "90-100%": 0,
-            "70-90%": 0,
-            "50-70%": 0,
-            "<50%": 0,
-        };
-
-        Object.values(attendees).forEach((daysAttended) => {
-            const attendancePercentage = (daysAttended / daysInMonth) * 100;
-            if (attendancePercentage >= 90) {
-                categories["90-100%"]++;
-            } else if (attendancePercentage >= 70) {
-                categories["70-90%"]++;
-            } else if (attendancePercentage >= 50) {
-                categories["50-70%"]++;
-            } else {
-                categories["<50%"]++;
-            }
-        });
-
-        const pieData = Object.entries(categories).map(([label, value]) => ({
+        // Profiles per attendance-rate bucket, counted on the server
+        const pieData = distribution.buckets.map(({ label, value }) => ({
             label,
             value,
         }));
@@ -139,7 +101,7 @@ const AttendancePercentagePieChart = ({ attendanceData }) => {
                 .text(d.label);
         });
 
-    }, [attendanceData]);
+    }, [distribution]);
 
     return (
         <div>
@@ -1,4 +1,4 @@
-import React, { useRef, useEffect, useState } from "react";
+import React, { useEffect, useState } from "react";
 import { getUserId } from "../../services/profilepics";
 import MonthlyHeatMap from "./MonthlyHeatMap";
 import AttendancePercentagePieChart from "./AttendancePercentagePieChart";
@@ -8,90 +8,39 @@ import { CircularProgress, Alert } from "@mui/material";
 const API_URL = process.env.REACT_APP_API_URL;
 
 const DataVisualizationAnalyzer = () => {
-	const [dataGroupByDate, setDataGroupByDate] = useState([]);
-	const [profiles, setProfiles] = useState([]);
+	const [trend, setTrend] = useState(null);
+	const [heatmap, setHeatmap] = useState(null);
+	const [distribution, setDistribution] = useState(null);
 	const [loading, setLoading] = useState(true);
 	const [error, setError] = useState(null);
 
-	function processData(profiles, attendanceRecords) {
-		const attendanceByDate = attendanceRecords.reduce((acc, record) => {
-			const date = new Date(record.timestamp);
-			const dateKey = date.toLocaleDateString("en-US", {
-				year: "numeric",
-				month: "2-digit",
-				day: "2-digit",
-			});
-
-			if (!acc[dateKey]) {
-				acc[dateKey] = new Map();
-			}
-			acc[dateKey].set(record.profile.profile_id, {
-				present: true,
-				photo: record.photo_url,
-				time: date.toLocaleTimeString("en-US", {
-					hour: "2-digit",
-					minute: "2-digit",
-					second: "2-digit",
-				}),
-			});
-			return acc;
-		}, {});
-
-		// Create a map of dates and their corresponding rows
-		const groupedData = {};
-		Object.keys(attendanceByDate).forEach((dateKey) => {
-			// For each date, create a row for each profile
-			groupedData[dateKey] = profiles.map((profile) => {
-				const attendanceInfo = attendanceByDate[dateKey].get(
-					profile.profile_id
-				);
-				return {
-					id: `${dateKey}-${profile.profile_id}`,
-					profile_id: profile.profile_id,
-					profile_name: profile.profile_name,
-					check_in_time: attendanceInfo?.time || null,
-					attendance: attendanceInfo?.present || false,
-					check_in_image: attendanceInfo?.photo || null,
-				};
-			});
-		});
-
-		// Sort dates in descending order
-		const sortedData = Object.fromEntries(
-			Object.entries(groupedData).sort((a, b) => {
-				const dateA = new Date(a[0]);
-				const dateB = new Date(b[0]);
-				return dateB - dateA;
-			})
-		);
-
-		setDataGroupByDate(sortedData);
-	}
-
 	useEffect(() => {
 		const fetchData = async () => {
 			try {
 				const userid = await getUserId();
-
-				// Fetch all profiles under this admin
-				const profilesResponse = await fetch(
-					`${API_URL}/profiles_by_admin/${userid}/`
+				// Days are bucketed on the server in the viewer's time zone
+				const tz = encodeURIComponent(
+					Intl.DateTimeFormat().resolvedOptions().timeZone
 				);
-				if (!profilesResponse.ok) {
-					throw new Error("Failed to fetch profiles");
-				}
-				const profiles = await profilesResponse.json();
-				setProfiles(profiles);
 
-				// Fetch attendance records
-				const attendanceResponse = await fetch(
-					`${API_URL}/attendance/${userid}/`
-				);
-				if (!attendanceResponse.ok) {
-					throw new Error("Failed to fetch attendance data");
-				}
-				const attendanceData = await attendanceResponse.json();
-				processData(profiles, attendanceData);
+				const fetchChart = async (chart, query) => {
+					const response = await fetch(
+						`${API_URL}/dashboard/${userid}/${chart}/?tz=${tz}${query}`
+					);
+					if (!response.ok) {
+						throw new Error("Failed to fetch attendance data");
+					}
+					return response.json();
+				};
+
+				const [trendData, heatmapData, distributionData] = await Promise.all([
+					fetchChart("trend", "&days=10"),
+					fetchChart("heatmap", ""),
+					fetchChart("attendance_rate", "&days=30"),
+				]);
+				setTrend(trendData);
+				setHeatmap(heatmapData);
+				setDistribution(distributionData);
 			} catch (error) {
 				console.error("Error fetching data:", error);
 				setError(error.message);
@@ -113,7 +62,7 @@ const DataVisualizationAnalyzer = () => {
 		return <div>Error: {error}</div>;
 	}
 
-	if (dataGroupByDate === null || Object.keys(dataGroupByDate).length === 0) {
+	if (!trend || trend.profile_count === 0) {
 		return (
 			<Alert severity="info">
 				No attendance data found. Please add attendance data to show analysis.
@@ -124,17 +73,14 @@ const DataVisualizationAnalyzer = () => {
 	return (
 		<div style={containerStyle}>
 			<div style={monthlyHeatMapStyle}>
-				<MonthlyHeatMap attendanceData={dataGroupByDate} />
+				<MonthlyHeatMap heatmap={heatmap} />
 			</div>
 			<div style={rowStyle}>
 				<div style={chartContainerStyle}>
-					<Past10DaysLineGraph
-						attendanceData={dataGroupByDate}
-						profileCount={profiles.length}
-					/>
+					<Past10DaysLineGraph trend={trend} />
 				</div>
 				<div style={chartContainerStyle}>
-					<AttendancePercentagePieChart attendanceData={dataGroupByDate} />
+					<AttendancePercentagePieChart distribution={distribution} />
 				</div>
 			</div>
 		</div>
@@ -2,29 +2,10 @@ import React, { useEffect, useRef } from 'react';
 import * as d3 from 'd3';
 import {colorBlue} from "../../constant/Constant";
 
-const MonthlyHeatMap = ({ attendanceData }) => {
+const MonthlyHeatMap = ({ heatmap }) => {
     const svgRef = useRef();
     const daysOfWeek = ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"];
 
-    function generateFutureDates() {
-        const currentDate = new Date();
-        currentDate.setHours(0, 0, 0, 0);
-
-        const allDaysInMonth = [];
-        const monthStart = new Date(currentDate.getFullYear(), currentDate.getMonth(), 1);
-        const monthEnd = new Date(currentDate.getFullYear(), currentDate.getMonth() + 1, 0); // Last day of the month
-
-        let dateIterator = new Date(monthStart);
-
-        while (dateIterator <= monthEnd) {
-            const dateKey = `${(dateIterator.getMonth() + 1).toString().padStart(2, '0')}/${dateIterator.getDate().toString().padStart(2, '0')}/${dateIterator.getFullYear()}`;
-            allDaysInMonth.push(dateKey);
-            dateIterator.setDate(dateIterator.getDate() + 1);
-        }
-
-        return allDaysInMonth;
-    }
-
     useEffect(() => {
         const svg = d3.select(svgRef.current);
         // Clear previous content
@@ -39,20 +20,16 @@ const MonthlyHeatMap = ({ attendanceData }) => {
             .append("g")
             .attr("transform", `translate(${margin.left},${margin.top})`);
 
-        const processedData = Object.entries(attendanceData).map(([date, attendanceList]) => {
-            const [month, day, year] = date.split("/").map(Number);
-            const parsedDate = new Date(year, month - 1, day);
-
-            const dayOfWeek = parsedDate.getDay();
-
-            const firstDayOfMonth = new Date(year, month - 1, 1).getDay();
-            const dayOfMonth = parsedDate.getDate();
-
-            const weekOfMonth = Math.ceil((dayOfMonth + firstDayOfMonth) / 7);
-
-            const attendanceCount = attendanceList.filter(entry => entry.attendance === true).length;
-
-            return { dateKey: date, dayOfWeek, weekOfMonth, count: attendanceCount };
+        // Every day of the month with its calendar position, from the server
+        const mergedData = heatmap.days.map((d) => {
+            const [year, month, day] = d.date.split("-");
+            return {
+                dateKey: `${month}/${day}/${year}`,
+                attendanceCount: d.count,
+                dayOfWeek: d.weekday,
+                weekOfMonth: d.week,
+                future: d.future,
+            };
         });
 
         // Define scales for the heatmap
@@ -62,45 +39,21 @@ const MonthlyHeatMap = ({ attendanceData }) => {
             .padding(0.05);
 
         const yScale = d3.scaleBand()
-            .domain(d3.range(1, 6))
+            .domain(d3.range(1, d3.max(mergedData, (d) => d.weekOfMonth) + 1))
             .range([0, height])
             .padding(0.05);
 
-        const allDaysInMonth = generateFutureDates();
-        const mergedData = allDaysInMonth.map((date) => {
-            const entry = processedData.find((d) => d.dateKey === date);
-            const [month, day, year] = date.split("/").map(Number);
-            const parsedDate = new Date(year, month - 1, day);
-            const dayOfWeek = parsedDate.getDay();
-            const firstDayOfMonth = new Date(year, month - 1, 1).getDay();
-            const dayOfMonth = parsedDate.getDate();
-            const weekOfMonth = Math.ceil((dayOfMonth + firstDayOfMonth) / 7);
-
-            return {
-                dateKey: date,
-                attendanceCount: entry ? entry.count : 0,
-                dayOfWeek,
-                weekOfMonth,
-            };
-        });
-
         const counts = mergedData.map(d => d.attendanceCount);
         const minCount = d3.min(counts);
         const maxCount = d3.max(counts);
 
-        const currentDate = new Date();
-        currentDate.setHours(0, 0, 0, 0);
-
         const pastDateColorScale = d3.scaleLinear()
             .domain([minCount, maxCount])
             .range(["#dfc7b8", "#af754f"])
             .interpolate(d3.interpolateLab);
 
-        const colorScale = (count, date) => {
-            const dateToCompare = new Date(date);
-            dateToCompare.setHours(0, 0, 0, 0);
-
-            if (dateToCompare > currentDate) {
+        const colorScale = (count, future) => {
+            if (future) {
                 // Grey for future dates
                 return "#d3d3d3";
             } else {
@@ -127,7 +80,7 @@ const MonthlyHeatMap = ({ attendanceData }) => {
             .attr("y", (d) => yScale(d.weekOfMonth))
             .attr("width", xScale.bandwidth())
             .attr("height", yScale.bandwidth())
-            .attr("fill", (d) => colorScale(d.attendanceCount, d.dateKey))
+            .attr("fill", (d) => colorScale(d.attendanceCount, d.future))
             .on("mouseenter", function (event, d) {
                 d3.select(this).style("stroke", colorBlue).style("stroke-width", "2px");
 
@@ -158,7 +111,7 @@ const MonthlyHeatMap = ({ attendanceData }) => {
             .attr("class", "y-axis")
             .style("font-size", "12px")
             .style("font-family", "Arial");
-    }, [attendanceData]);
+    }, [heatmap]);
 
     return (
         <div>
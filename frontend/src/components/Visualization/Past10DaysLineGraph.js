@@ -2,7 +2,7 @@ import React, {useEffect, useRef, useState} from "react";
 import * as d3 from "d3";
 import {colorDarkBlue, colorDarkRed} from "../../constant/Constant";
 
-const Past10DaysLineGraph = ({ attendanceData, profileCount }) => {
+const Past10DaysLineGraph = ({ trend }) => {
     const svgRef = useRef();
     const [isFirstRender, setIsFirstRender] = useState(true);
 
@@ -22,31 +22,18 @@ const Past10DaysLineGraph = ({ attendanceData, profileCount }) => {
             .append("g")
             .attr("transform", `translate(${margin.left}, ${margin.top})`);
 
-        // Process Data
-        const parseDate = d3.timeParse("%m/%d/%Y");
-        const today = new Date();
-        const tenDaysAgo = new Date(today);
-        tenDaysAgo.setDate(today.getDate() - 10);
-        const allDates = d3.timeDays(tenDaysAgo, today).map((d) => d3.timeFormat("%m/%d/%Y")(d));
-
-        // Process Data and fill missing dates with 0 attendance
-        const processedData = allDates.map((date) => {
-            const attendanceList = attendanceData[date] || [];
-            const successCheckInCount = attendanceList.filter((entry) => entry.attendance === true).length;
-            const notAttendedCount = profileCount - successCheckInCount;
-            return { date, successCheckIn: successCheckInCount, notAttended: notAttendedCount };
-        });
-
-        // Convert string date to actual Date object
-        const formattedData = processedData.map((d) => ({
-            ...d,
+        // One point per day, already counted on the server
+        const parseDate = d3.timeParse("%Y-%m-%d");
+        const formattedData = trend.days.map((d) => ({
             date: parseDate(d.date),
+            successCheckIn: d.attended,
+            notAttended: d.not_attended,
         }));
 
         // Define Scales
         const xScale = d3
             .scaleTime()
-            .domain([tenDaysAgo, today])
+            .domain(d3.extent(formattedData, (d) => d.date))
             .range([0, width]);
 
         const maxAttendance = d3.max(formattedData, (d) => Math.max(d.successCheckIn, d.notAttended));
@@ -187,7 +174,7 @@ const Past10DaysLineGraph = ({ attendanceData, profileCount }) => {
                 .style("font-size", "12px")
                 .text(displayTextCollector[i]);
         }
-    }, [attendanceData, profileCount, isFirstRender]);
+    }, [trend, isFirstRender]);
 
     return (
     <div>
@@ -81,6 +81,7 @@ export const WebcamCapture = () => {
 					audio={false}
 					height={360}
 					screenshotFormat="image/jpeg"
+					screenshotQuality={0.85}
 					width={640}
 					videoConstraints={{
 						width: 640,
@@ -109,13 +110,14 @@ export const WebcamCapture = () => {
 									setIsUploading(true);
 									setUploadResult(null);
 									const imageBase64 = getScreenshot();
-									await uploadAttedancePhoto(imageBase64, profileID);
 									const { statusCode, status, message } = await uploadAttedancePhoto(
 										imageBase64,
 										profileID
 									);
 									if (statusCode === 200 && status === "success") {
 										setUploadResult({ success: true, message });
+									} else if (statusCode === 409) {
+										setUploadResult({ success: false, message });
 									} else {
 										setUploadResult({ success: false, message: "Face match failed, please try again" });
 									}
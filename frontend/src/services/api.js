@@ -33,27 +33,116 @@ export const uploadAttedancePhoto = async (photoBase64, profileID) => {
 
 	const loginKey = `cognito-idp.${cognitoConfig.region}.amazonaws.com/${cognitoConfig.userPoolId}`;
 
+	const credentials = {
+		idToken: idToken,
+		identityPoolId: process.env.REACT_APP_IDENTITY_POOL_ID,
+		region: cognitoConfig.region,
+		userPoolId: cognitoConfig.userPoolId,
+		profileID: profileID,
+	};
+
 	try {
-		const response = await fetch(`${API_URL}/upload_attendance_picture/`, {
+		// get a presigned form for the picture's S3 key; duplicates are rejected here
+		const urlResponse = await fetch(`${API_URL}/attendance_upload_url/`, {
 			method: "POST",
-			headers: {
-				"Content-Type": "application/json",
-			},
+			headers: { "Content-Type": "application/json" },
+			body: JSON.stringify(credentials),
+		});
+		if (!urlResponse.ok) {
+			throw new Error("Failed to get an upload URL");
+		}
+		const upload = await urlResponse.json();
+		if (upload.statusCode === 409) {
+			return upload;
+		}
+
+		// upload the photo straight to S3, so the image never passes through the API
+		const photoBlob = await (await fetch(photoBase64)).blob();
+		const formData = new FormData();
+		Object.entries(upload.fields).forEach(([name, value]) =>
+			formData.append(name, value)
+		);
+		formData.append("file", photoBlob, "attendance.jpg");
+		const s3Response = await fetch(upload.url, {
+			method: "POST",
+			body: formData,
+		});
+		if (!s3Response.ok) {
+			throw new Error("Failed to upload photo");
+		}
+
+		const response = await fetch(`${API_URL}/verify_attendance_picture/`, {
+			method: "POST",
+			headers: { "Content-Type": "application/json" },
+			body: JSON.stringify({ ...credentials, key: upload.key }),
+		});
+		if (!response.ok) {
+			throw new Error("Failed to verify photo");
+		}
+		return await response.json();
+	} catch (error) {
+		console.error("Error uploading photo:", error);
+		throw error;
+	}
+};
+
+// check in whoever is in the photo; the response names the identified profileID
+export const identifyAttendancePhoto = async (photoBase64) => {
+	const { idToken } = getTokens();
+
+	if (!idToken) {
+		throw new Error("No ID token available");
+	}
+
+	try {
+		const response = await fetch(`${API_URL}/identify_attendance_picture/`, {
+			method: "POST",
+			headers: { "Content-Type": "application/json" },
 			body: JSON.stringify({
 				image: photoBase64,
 				idToken: idToken,
 				identityPoolId: process.env.REACT_APP_IDENTITY_POOL_ID,
 				region: cognitoConfig.region,
 				userPoolId: cognitoConfig.userPoolId,
-				profileID: profileID,
 			}),
 		});
 		if (!response.ok) {
-			throw new Error("Failed to upload photo");
+			throw new Error("Failed to identify photo");
 		}
 		return await response.json();
 	} catch (error) {
-		console.error("Error uploading photo:", error);
+		console.error("Error identifying photo:", error);
+		throw error;
+	}
+};
+
+// check in every recognized face in a group photo; the response lists each
+// face's boundingBox, profileID and status
+export const checkInGroupPhoto = async (photoBase64) => {
+	const { idToken } = getTokens();
+
+	if (!idToken) {
+		throw new Error("No ID token available");
+	}
+
+	try {
+		const response = await fetch(`${API_URL}/group_attendance_picture/`, {
+			method: "POST",
+			headers: { "Content-Type": "application/json" },
+			body: JSON.stringify({
+				image: photoBase64,
+				idToken: idToken,
+				identityPoolId: process.env.REACT_APP_IDENTITY_POOL_ID,
+				region: cognitoConfig.region,
+				userPoolId: cognitoConfig.userPoolId,
+			}),
+		});
+		if (!response.ok) {
+			throw new Error("Failed to check in group photo");
+		}
+		return await response.json();
+	} catch (error) {
+		console.error("Error checking in group photo:", error);
 		throw error;
 	}
 };